@@ -6,8 +6,8 @@ from datetime import datetime, date, timedelta
 from pathlib import Path 
 from datetime import time
 
-import shutil
 import traceback
+import asyncio
 import pytz
 import pandas as pd
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
@@ -31,12 +31,16 @@ DATA_DIR = BASE_DIR / "data"
 DATA_DIR.mkdir(exist_ok=True)
 
 from telegram.constants import ParseMode
+from shared.delivery import delivery
+from shared.names import names
+from shared.reportcache import reports, data_version
+from shared.state import state
+from shared.scheduler import scheduler, daily
 
-async def safe_send(bot, chat_id, text):
-    try:
-        await bot.send_message(chat_id=chat_id, text=text, parse_mode=ParseMode.HTML)
-    except Exception as e:
-        print(f"Ошибка отправки сообщения: {e}")
+async def safe_send(bot, chat_id, text, urgent=False):
+    # Через общую очередь доставки: лимиты Telegram, повторы, журнал на диске.
+    # Только ставит в очередь — ошибки отправки пишет в лог сама доставка
+    await delivery.send("bot2", chat_id, text, parse_mode=ParseMode.HTML, urgent=urgent)
 
 def load_config():
     config_path = Path(__file__).parent / "config.json"
@@ -44,8 +48,8 @@ def load_config():
         return json.load(f)
 
 def save_config(data):
-    with CONFIG.open("w", encoding="utf-8") as f:
-        json.dump(data, f, ensure_ascii=False, indent=2)
+    # Правки из меню сливаются в одну атомарную запись вне event loop
+    state.save(CONFIG, data)
 
 def escape_markdown(text: str) -> str:
     escape_chars = r"\_*[]()~`>#+-=|{}.!<>"
@@ -80,123 +84,474 @@ def is_allowed_menu_chat(chat, context):
         context.bot_data.get("leader_report_channel"),
     }
 
+# Лог сообщений с ТТН: одна партиция на день, data/<YYYY-MM-DD>.csv, только дозапись.
+# День партиции — дата из timestamp строки, читатели открывают только нужные дни.
+# Одна строка на ТТН (колонка ttn), ТТН извлекаются один раз при захвате.
+LOG_FIELDS = ["timestamp", "chat_id", "user_id", "message", "ttn"]
+
+def partition_file(day: date) -> Path:
+    return DATA_DIR / f"{day.isoformat()}.csv"
+
 def load_df(day: date):
-    f = DATA_DIR / f"{day.isoformat()}.csv"
-    if not f.exists():
-        return pd.DataFrame(columns=["timestamp", "chat_id", "user_id", "message"])
+    f = partition_file(day)
+    if not f.exists() or f.stat().st_size == 0:
+        return pd.DataFrame(columns=LOG_FIELDS)
     df = pd.read_csv(f)
     return df
 
-def load_multiple_days_df(days_count=3):
-    frames = []
-    ttn_pattern = re.compile(r"[12456]\d{9,}")  # паттерн ТТН
-
-    for i in range(days_count):
-        day = date.today() - timedelta(days=i)
+# Индекс ТТН в памяти: день → chat_id → user_id → число ТТН.
+# Пополняется в save_message_to_file, при старте собирается из партиций
+# последних INDEX_DAYS дней. user_id внутри чата — в порядке первого появления.
+TTN_PATTERN = re.compile(r"(?<!\d)[12456]\d{11,13}(?!\d)")  # ТТН: 12–14 цифр
+INDEX_DAYS = 7
+ttn_index: dict[str, dict[int, dict[str, int]]] = {}
+
+# Уже учтённые ТТН: (chat_id, ТТН) → день. Повтор в том же чате за TTN_DEDUP_DAYS
+# дней (пересланное сообщение, ТТН дважды в тексте) не записывается и не считается.
+TTN_DEDUP_DAYS = 31
+ttn_seen: dict[tuple[int, str], str] = {}
+
+# Смещение лога: сколько строк ТТН записано с запуска. Версия данных для кэша отчётов
+log_offset = 0
+
+# Счётчики ТТН по операторам с начала месяца, сохраняются в data/month_counters.json
+# (при сбросе буфера лога, см. PartitionWriter)
+month_counters = {"month": "", "counts": {}}
+month_counters_dirty = False
+
+def extract_ttns(text) -> list[str]:
+    """ТТН из текста сообщения, без повторов, в порядке появления."""
+    return list(dict.fromkeys(TTN_PATTERN.findall(str(text))))
+
+def take_new_ttns(seen: dict, chat_id: int, day: str, ttns) -> list[str]:
+    """ТТН, которых не было в этом чате за TTN_DEDUP_DAYS дней; отмечает их в seen."""
+    cutoff = (date.fromisoformat(day) - timedelta(days=TTN_DEDUP_DAYS - 1)).isoformat()
+    new = []
+    for ttn in ttns:
+        key = (chat_id, ttn)
+        if seen.get(key, "") < cutoff:
+            seen[key] = day
+            new.append(ttn)
+    return new
+
+def index_rows(index: dict, rows):
+    for row in rows:
+        if not row.get("ttn"):
+            continue
+        try:
+            chat_id = int(row["chat_id"])
+        except (TypeError, ValueError):
+            continue
+        users = index.setdefault(str(row["timestamp"])[:10], {}).setdefault(chat_id, {})
+        user_id = str(row["user_id"])
+        users[user_id] = users.get(user_id, 0) + 1
+
+def build_ttn_index(start: date, end: date) -> dict:
+    index = {}
+    day = start
+    while day <= end:
+        f = partition_file(day)
+        if f.exists():
+            try:
+                with open(f, encoding="utf-8", newline="") as csvfile:
+                    index_rows(index, csv.DictReader(csvfile))
+            except Exception as e:
+                print(f"⚠️ Ошибка при индексации {f.name}: {e}")
+        day += timedelta(days=1)
+    return index
+
+def build_ttn_seen(start: date, end: date) -> dict:
+    seen = {}
+    day = start
+    while day <= end:
+        f = partition_file(day)
+        if f.exists():
+            skipped = 0
+            try:
+                with open(f, encoding="utf-8", newline="") as csvfile:
+                    for row in csv.DictReader(csvfile):
+                        if not row.get("ttn"):
+                            continue
+                        try:
+                            chat_id = int(row["chat_id"])
+                        except (TypeError, ValueError):
+                            skipped += 1
+                            continue
+                        seen[(chat_id, row["ttn"])] = day.isoformat()
+            except Exception as e:
+                print(f"⚠️ Ошибка при чтении ТТН из {f.name}: {e}")
+            if skipped:
+                print(f"⚠️ {f.name}: пропущено строк с некорректным chat_id: {skipped}")
+        day += timedelta(days=1)
+    return seen
+
+def prune_ttn_index():
+    cutoff = (date.today() - timedelta(days=INDEX_DAYS - 1)).isoformat()
+    for day in [d for d in ttn_index if d < cutoff]:
+        del ttn_index[day]
+    seen_cutoff = (date.today() - timedelta(days=TTN_DEDUP_DAYS - 1)).isoformat()
+    for key in [k for k, d in ttn_seen.items() if d < seen_cutoff]:
+        del ttn_seen[key]
+
+def ttn_user_counts(start: date, end: date) -> dict[str, int]:
+    """Число ТТН по пользователям за дни start..end (в пределах индекса) во всех чатах."""
+    counts = {}
+    day = start
+    while day <= end:
+        for users in ttn_index.get(day.isoformat(), {}).values():
+            for user_id, count in users.items():
+                counts[user_id] = counts.get(user_id, 0) + count
+        day += timedelta(days=1)
+    return counts
+
+def month_counters_file() -> Path:
+    return DATA_DIR / "month_counters.json"
+
+def save_month_counters():
+    # Через общее хранилище: запись атомарная, в фоне и сливается с соседними сбросами
+    state.save(month_counters_file(), month_counters, indent=None)
+
+def load_month_counters() -> dict:
+    """Счётчики с диска; если файла нет или месяц сменился — пересчёт по партициям месяца."""
+    today = date.today()
+    month = today.strftime("%Y-%m")
+    data = state.reload(month_counters_file(), None)
+    if isinstance(data, dict) and data.get("month") == month:
+        return data
+
+    counts = {}
+    for users_by_chat in build_ttn_index(today.replace(day=1), today).values():
+        for users in users_by_chat.values():
+            for user_id, count in users.items():
+                counts[user_id] = counts.get(user_id, 0) + count
+    return {"month": month, "counts": counts}
+
+def count_month_message(row: dict):
+    global month_counters_dirty
+    month = row["timestamp"][:7]
+    if month > month_counters["month"]:
+        # Новый месяц — счётчики с нуля
+        month_counters["month"] = month
+        month_counters["counts"] = {}
+    if month != month_counters["month"]:
+        return
+    user_id = str(row["user_id"])
+    month_counters["counts"][user_id] = month_counters["counts"].get(user_id, 0) + 1
+    month_counters_dirty = True
+
+def flush_month_counters():
+    global month_counters_dirty
+    if month_counters_dirty:
+        save_month_counters()
+        month_counters_dirty = False
+
+def month_user_counts(today: date) -> dict[str, int]:
+    if month_counters["month"] != today.strftime("%Y-%m"):
+        return {}
+    return month_counters["counts"]
+
+def append_rows(rows: list[dict]):
+    """Дозапись строк в партиции их дней (без копирования файлов)."""
+    by_day = {}
+    for row in rows:
+        by_day.setdefault(row["timestamp"][:10], []).append(row)
+    for day, day_rows in by_day.items():
+        f = DATA_DIR / f"{day}.csv"
+        file_exists = f.exists() and f.stat().st_size > 0
+        with open(f, "a", encoding="utf-8", newline="") as csvfile:
+            writer = csv.DictWriter(csvfile, fieldnames=LOG_FIELDS)
+            if not file_exists:
+                writer.writeheader()
+            writer.writerows(day_rows)
+
+class PartitionWriter:
+    """
+    Буферизованная дозапись в дневные партиции: файл текущего дня открыт постоянно,
+    строки сбрасываются пачкой по max_rows или раз в max_delay секунд и при остановке.
+    Запись на диск идёт в потоке (не в event loop), сбросы не пересекаются.
+    Перед переходом на новый день файл прошлого дня сбрасывается на диск (fsync).
+    """
+
+    def __init__(self, max_rows=50, max_delay=2.0, on_flush=None):
+        self.max_rows = max_rows
+        self.max_delay = max_delay
+        self.on_flush = on_flush
+        self.buffer = []
+        self.day = None
+        self.file = None
+        self.writer = None
+        self.task = None
+        self.lock = asyncio.Lock()
+        self.wakeup = asyncio.Event()
+        self.closing = False
+
+    def write(self, row: dict):
+        self.buffer.append(row)
+        if self.task is None:
+            # Без фоновой задачи (скрипты, миграции) пишем сразу
+            self._flush_rows()
+        elif len(self.buffer) >= self.max_rows:
+            self.wakeup.set()
+
+    def _write_rows(self, rows: list[dict]) -> tuple[int, Exception | None]:
+        """Пишет строки (в потоке); возвращает (сколько записано, ошибка)."""
+        written = 0
         try:
-            df = load_df(day)
-            if not df.empty:
-                df = df[df["message"].astype(str).str.contains(ttn_pattern, na=False)]
-                if not df.empty:
-                    frames.append(df)
+            for row in rows:
+                day = row["timestamp"][:10]
+                if day != self.day:
+                    if self.day is not None and day < self.day:
+                        # Запоздавшая строка прошлого дня — разовая дозапись
+                        append_rows([row])
+                        written += 1
+                        continue
+                    self._open(day)
+                self.writer.writerow(row)
+                written += 1
+            if self.file:
+                self.file.flush()
         except Exception as e:
-            print(f"⚠️ Ошибка при загрузке данных за {day}: {e}")
-
-    return pd.concat(frames, ignore_index=True) if frames else pd.DataFrame()
-
-def get_today_file():
-    today_file = DATA_DIR / f"{date.today().isoformat()}.csv"
-    if today_file.exists():
-        # Файл на сегодня уже есть — используем его
-        return today_file
-
-    # Файла с сегодняшней датой нет — ищем старый файл без даты (например, messages_current.csv)
-    # или просто любой другой CSV в папке, кроме сегодняшнего
-    files = list(DATA_DIR.glob("*.csv"))
-    old_file = None
-    for f in files:
-        if f != today_file:
-            old_file = f
-            break
-
-    if old_file:
-        # Копируем содержимое старого файла в новый с сегодняшней датой
-        shutil.copy2(old_file, today_file)
-        # Удаляем старый файл
-        old_file.unlink()
-        print(f"Старый файл {old_file} перенесён в {today_file}")
-    else:
-        # Старого файла нет — создаём новый (пустой)
-        with open(today_file, "w", encoding="utf-8", newline="") as f:
-            pass
-        print(f"Создан новый файл {today_file}")
+            return written, e
+        return written, None
+
+    def _done(self, rows: list[dict], written: int, error: Exception | None):
+        if error is not None:
+            # Незаписанные строки возвращаются в буфер — следующий сброс повторит их,
+            # счётчики месяца до этого не сохраняем
+            print(f"❌ Ошибка записи лога сообщений: {error}")
+            self.buffer = rows[written:] + self.buffer
+            return
+        if self.on_flush:
+            self.on_flush()
+
+    def _flush_rows(self):
+        rows, self.buffer = self.buffer, []
+        self._done(rows, *self._write_rows(rows))
+
+    async def flush(self):
+        async with self.lock:
+            rows, self.buffer = self.buffer, []
+            if rows:
+                self._done(rows, *await asyncio.to_thread(self._write_rows, rows))
+
+    def _open(self, day: str):
+        self._close()
+        f = DATA_DIR / f"{day}.csv"
+        file_exists = f.exists() and f.stat().st_size > 0
+        self.file = open(f, "a", encoding="utf-8", newline="")
+        self.writer = csv.DictWriter(self.file, fieldnames=LOG_FIELDS)
+        if not file_exists:
+            self.writer.writeheader()
+        self.day = day
+
+    def _close(self):
+        if self.file:
+            self.file.flush()
+            os.fsync(self.file.fileno())
+            self.file.close()
+        self.file, self.writer, self.day = None, None, None
+
+    async def _run(self):
+        while not self.closing:
+            try:
+                await asyncio.wait_for(self.wakeup.wait(), timeout=self.max_delay)
+            except asyncio.TimeoutError:
+                pass
+            self.wakeup.clear()
+            await self.flush()
+
+    def start(self):
+        self.closing = False
+        self.task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        # Задачу не отменяем посреди записи в потоке — просим её завершиться
+        if self.task:
+            self.closing = True
+            self.wakeup.set()
+            await self.task
+            self.task = None
+        await self.flush()
+        async with self.lock:
+            await asyncio.to_thread(self._close)
+
+log_writer = PartitionWriter(on_flush=flush_month_counters)
+
+def migrate_legacy_log():
+    """
+    Старый формат: один файл, который каждый день копировался под новой датой
+    и содержал всю историю. Раскладываем такие файлы по дневным партициям.
+    """
+    for f in sorted(DATA_DIR.glob("*.csv")):
+        try:
+            file_day = datetime.strptime(f.stem, "%Y-%m-%d").date().isoformat()
+        except ValueError:
+            file_day = None
+        with open(f, encoding="utf-8", newline="") as csvfile:
+            rows = list(csv.DictReader(csvfile))
+        if file_day and all(row["timestamp"][:10] == file_day for row in rows):
+            continue
 
-    return today_file
+        # Строки своего дня остаются в файле, остальные уходят в партиции
+        own = [row for row in rows if row["timestamp"][:10] == file_day]
+        other = [row for row in rows if row["timestamp"][:10] != file_day]
+        tmp = f.with_suffix(".tmp")
+        with open(tmp, "w", encoding="utf-8", newline="") as csvfile:
+            writer = csv.DictWriter(csvfile, fieldnames=LOG_FIELDS)
+            writer.writeheader()
+            writer.writerows(own)
+        append_rows(other)
+        os.replace(tmp, f)
+        if file_day is None:
+            f.unlink()
+        print(f"📦 {f.name}: {len(other)} строк разложено по дневным партициям")
+
+def migrate_ttn_column():
+    """
+    Партиции старого формата (без колонки ttn): одна строка на ТТН, повторы
+    (чат, ТТН) убираются. Строки без ТТН остаются с пустым ttn.
+    """
+    seen, converted = {}, 0
+    for f in sorted(DATA_DIR.glob("*.csv")):
+        with open(f, encoding="utf-8", newline="") as csvfile:
+            reader = csv.DictReader(csvfile)
+            rows = list(reader)
+            fields = reader.fieldnames or []
+        skipped = 0
+        if "ttn" in fields:
+            for row in rows:
+                if not row["ttn"]:
+                    continue
+                try:
+                    chat_id = int(row["chat_id"])
+                    day = date.fromisoformat(str(row["timestamp"])[:10]).isoformat()
+                except (TypeError, ValueError):
+                    skipped += 1
+                    continue
+                seen[(chat_id, row["ttn"])] = day
+            if skipped:
+                print(f"⚠️ {f.name}: пропущено строк с некорректным chat_id/временем: {skipped}")
+            continue
+
+        out = []
+        for row in rows:
+            ttns = extract_ttns(row["message"])
+            try:
+                chat_id = int(row["chat_id"])
+                day = date.fromisoformat(str(row["timestamp"])[:10]).isoformat()
+            except (TypeError, ValueError):
+                # Битая строка остаётся в логе как есть, без ТТН
+                if ttns:
+                    skipped += 1
+                ttns = []
+            if not ttns:
+                out.append(row | {"ttn": ""})
+                continue
+            new = take_new_ttns(seen, chat_id, day, ttns)
+            out.extend(row | {"ttn": ttn} for ttn in new)
+        if skipped:
+            print(f"⚠️ {f.name}: строк с некорректным chat_id/временем оставлено без ТТН: {skipped}")
+        tmp = f.with_suffix(".tmp")
+        with open(tmp, "w", encoding="utf-8", newline="") as csvfile:
+            writer = csv.DictWriter(csvfile, fieldnames=LOG_FIELDS, extrasaction="ignore")
+            writer.writeheader()
+            writer.writerows(out)
+        os.replace(tmp, f)
+        converted += 1
+        print(f"📦 {f.name}: {len(rows)} сообщений → {len(out)} строк по ТТН")
+
+    if converted:
+        # Счётчики месяца считались по сообщениям — пересчитаются по ТТН при загрузке
+        month_counters_file().unlink(missing_ok=True)
 
 def save_message_to_file(message):
+    global log_offset
     if not message.text:
         return
-    if not re.search(r"[0-9]\d{11,13}", message.text):
+    ttns = extract_ttns(message.text)
+    if not ttns:
         return
 
     try:
-        f = get_today_file()
-
-        row = {
+        base = {
             "timestamp": message.date.strftime("%Y-%m-%d %H:%M:%S"),
-            "chat_id": message.chat.id,
+            "chat_id": int(message.chat.id),
             "user_id": str(message.from_user.id) if message.from_user else "unknown",
             "message": html.escape(message.text),
         }
-
-        file_exists = f.exists() and f.stat().st_size > 0
-        with open(f, "a", encoding="utf-8", newline="") as csvfile:
-            writer = csv.DictWriter(csvfile, fieldnames=row.keys())
-            if not file_exists:
-                writer.writeheader()
-            writer.writerow(row)
-
-        print(f"✅ Сообщение сохранено в {f}")
+        day = base["timestamp"][:10]
+        rows = [base | {"ttn": ttn} for ttn in take_new_ttns(ttn_seen, base["chat_id"], day, ttns)]
+        if not rows:
+            print("ℹ️ ТТН из сообщения уже учтены")
+            return
+        for row in rows:
+            log_writer.write(row)
+            count_month_message(row)
+        index_rows(ttn_index, rows)
+        log_offset += len(rows)
+        if len(ttn_index) > INDEX_DAYS:
+            prune_ttn_index()
+        print(f"✅ ТТН ({len(rows)}) сохранены в {day}.csv")
 
     except Exception as e:
         print(f"❌ Ошибка при сохранении сообщения: {e}")
 
 async def resolve_user_name(bot, user_id: str):
-    try:
-        user = await bot.get_chat(int(user_id))
-        if user.username:
-            return f"@{user.username}"
-        full = (user.first_name or "") + (" " + user.last_name if user.last_name else "")
-        return escape_user_tag(full.strip() or f"User{user_id}")
-    except:
-        return escape_user_tag(f"@{user.username}")
-
-async def format_project_report(df, bot_data, bot=None):
+    info = await names.lookup("bot2", bot, user_id)
+    if not info or not info["ok"]:
+        return escape_user_tag(f"User{user_id}")
+    if info["username"]:
+        return f"@{info['username']}"
+    full = (info["first_name"] or "") + (" " + info["last_name"] if info["last_name"] else "")
+    return escape_user_tag(full.strip() or f"User{user_id}")
+
+def display_name(info: dict | None) -> str:
+    """Имя из кэша get_chat для отчётов и меню (HTML)."""
+    if not info or not info["ok"]:
+        return "неизвестно"
+    return f"@{info['username']}" if info["username"] else html.escape(info["full_name"])
+
+def report_version(bot_data) -> tuple:
+    """Версия данных отчётов: смещение лога, день и настройки проектов/пользователей."""
+    config = data_version(bot_data.get("projects", {}), bot_data.get("norms", {}), bot_data.get("users", {}))
+    return log_offset, date.today().isoformat(), config
+
+async def format_project_report(bot_data, bot=None):
+    # Пока новых ТТН нет, основной отчёт и отчёт руководителю берут готовый текст
+    return await reports.get_or_build(
+        ("bot2", "project", bot is not None), report_version(bot_data),
+        lambda: build_project_report(bot_data, bot),
+    )
+
+async def build_project_report(bot_data, bot=None):
     today = date.today()
     today_str = today.strftime("%d.%m")
     out = [f"<b>Знижки на {today_str}</b>\n"]
     total = 0
     unknowns = []
 
-    df["timestamp"] = pd.to_datetime(df["timestamp"], errors="coerce")
-    df_today = df[df["timestamp"].dt.date == today]
+    day_index = ttn_index.get(today.isoformat(), {})
 
     projects = bot_data.get("projects", {})
     norms = bot_data.get("norms", {})
     users = bot_data.get("users", {})
 
     for cid, proj in projects.items():
-        g = df_today[df_today["chat_id"] == int(cid)]
-        g = g[g["message"].astype(str).str.contains(r"[12456]\d{9,}", na=False)]
+        user_counts = day_index.get(int(cid), {})
 
-        if g.empty:
+        if not user_counts:
             out.append(f"👉 <b>{proj}: 0 ‼️</b>")
             out.append(f"🎯норма -- {norms.get(proj, 0)}")
             out.append("🚩по операторам: нет данных\n")
             continue
 
-        ini_map = g["user_id"].astype(str).map(lambda u: users.get(u, None))
-        vc = ini_map.value_counts()
+        # Счётчики по инициалам в порядке первого появления, сортировка как у value_counts
+        ini_counts = {}
+        for uid, cnt in user_counts.items():
+            ini = users.get(uid)
+            if ini is not None:
+                ini_counts[ini] = ini_counts.get(ini, 0) + cnt
+        vc = pd.Series(ini_counts, dtype="int64").sort_values(ascending=False)
         count = vc.sum()
         norm = norms.get(proj, 0)
         flag = "‼️" if count < norm else ""
@@ -206,41 +561,38 @@ async def format_project_report(df, bot_data, bot=None):
         out.append(f"🚩по операторам: {ops or 'нет данных'}\n")
         total += count
 
-        unknown_ids = set(g["user_id"].astype(str)) - set(users.keys())
-        for uid in unknown_ids:
-            unknowns.append((uid, proj))
+        for uid in user_counts:
+            if uid not in users:
+                unknowns.append((uid, proj))
 
     out.append(f"ИТОГО по всем проектам: {total}")
 
     # 🔻 Блок "Без инициалов"
     if unknowns and bot:
         out.append("\n❓ Без инициалов:")
+        infos = await names.lookup_many("bot2", bot, [uid for uid, _ in unknowns])
         for uid, proj in unknowns:
-            try:
-                user = await bot.get_chat(int(uid))
-                if user.username:
-                    name = f"@{user.username}"
-                else:
-                    name = html.escape(user.full_name)
-            except Exception:
-                name = "неизвестно"
-            out.append(f"🟥 {uid} {name} ({proj})")
+            out.append(f"🟥 {uid} {display_name(infos[uid])} ({proj})")
 
     return "\n".join(out), unknowns
 
     
-def format_operator_report(df, bot_data):
+def format_operator_report(bot_data):
+    key = ("bot2", "operator")
+    version = report_version(bot_data)
+    text = reports.get(key, version)
+    if text is None:
+        text = build_operator_report(bot_data)
+        reports.put(key, version, text)
+    return text
+
+def build_operator_report(bot_data):
     today = date.today()
     today_str = today.strftime("%d.%m")
-    first_day = today.replace(day=1)
     users = bot_data.get("users", {})
 
-    df["timestamp"] = pd.to_datetime(df["timestamp"], errors="coerce")
-    df_month = df[(df["timestamp"].dt.date >= first_day) & (df["timestamp"].dt.date <= today)]
-    df_today = df[df["timestamp"].dt.date == today]
-
-    month_counts = df_month["user_id"].astype(str).value_counts()
-    today_counts = df_today["user_id"].astype(str).value_counts()
+    month_counts = month_user_counts(today)
+    today_counts = ttn_user_counts(today, today)
 
     stats = []
     for uid, ini in users.items():
@@ -256,8 +608,8 @@ def format_operator_report(df, bot_data):
     lines.extend([line for _, line in stats])
     return "\n".join(lines) if len(lines) > 1 else "Нет данных по операторам."
 
-async def format_leader_report(df, bot_data, comment=None):
-    text, unknowns = await format_project_report(df, bot_data)  # Добавлено await
+async def format_leader_report(bot_data, comment=None):
+    text, unknowns = await format_project_report(bot_data)  # Добавлено await
     if comment and comment.strip() and comment.strip() != "-":
         comment_escaped = html.escape(comment.strip()) # Можно добавить escape HTML, если нужно
         text += f"\n\n💬 Комментарий:\n{comment_escaped}"
@@ -265,27 +617,32 @@ async def format_leader_report(df, bot_data, comment=None):
 
 async def send_report(bot, bot_data, chat_id: int, report_type: str = None, comment=None, send_all=False):
     print(f"send_report: bot type = {type(bot)}, bot_data type = {type(bot_data)}")
-    df = load_multiple_days_df(3)
-    if df.empty:
+    # Отчёту по операторам нужен месяц, остальным — только сегодняшний день
+    today = date.today()
+    if send_all or report_type == "manager":
+        has_data = month_user_counts(today) or ttn_user_counts(today, today)
+    else:
+        has_data = ttn_user_counts(today, today)
+    if not has_data:
         await safe_send(bot, chat_id, "Нет данных для отчёта за последние дни.")
         return
 
     try:
         if send_all:
-            text_main, _ = await format_project_report(df, bot_data, bot)
-            text_manager = format_operator_report(df, bot_data)
-            text_leader = await format_leader_report(df, bot_data, comment)
+            text_main, _ = await format_project_report(bot_data, bot)
+            text_manager = format_operator_report(bot_data)
+            text_leader = await format_leader_report(bot_data, comment)
 
             await safe_send(bot, chat_id, "*Основной отчёт:*\n" + text_main)
             await safe_send(bot, chat_id, "*Отчёт менеджеров:*\n" + text_manager)
             await safe_send(bot, chat_id, "*Отчёт руководителю:*\n" + text_leader)
         else:
             if report_type == "main":
-                text, _ = await format_project_report(df, bot_data, bot)
+                text, _ = await format_project_report(bot_data, bot)
             elif report_type == "manager":
-                text = format_operator_report(df, bot_data)
+                text = format_operator_report(bot_data)
             elif report_type == "leader":
-                text = await format_leader_report(df, bot_data, comment)
+                text = await format_leader_report(bot_data, comment)
             else:
                 text = "Неверный тип отчёта."
             await safe_send(bot, chat_id, text)
@@ -296,10 +653,7 @@ async def send_report(bot, bot_data, chat_id: int, report_type: str = None, comm
 async def notify_admin(bot, bot_data, text: str):
     error_channel = bot_data.get("error_channel")
     if error_channel:
-        try:
-            await safe_send(bot, error_channel, f"⚠️ Ошибка:\n{text}")
-        except:
-            pass
+        await safe_send(bot, error_channel, f"⚠️ Ошибка:\n{text}", urgent=True)
 
 async def scheduled_report(bot, bot_data):
     try:
@@ -308,7 +662,7 @@ async def scheduled_report(bot, bot_data):
     except Exception as e:
         tb = traceback.format_exc()
         print(f"[{datetime.now()}] ❌ Ошибка автоотчёта: {tb}")
-        await safe_send(bot, bot_data["error_channel"], f"Ошибка автоотчёта:\n{tb}")
+        await safe_send(bot, bot_data["error_channel"], f"Ошибка автоотчёта:\n{tb}", urgent=True)
 
 def main_menu_keyboard():
     return InlineKeyboardMarkup([
@@ -333,20 +687,16 @@ def report_menu_keyboard():
 async def users_menu_keyboard(bot_data, bot):
     keyboard = []
     USERS = bot_data.get("users", {})
-    df_multi = load_multiple_days_df(3)
+    today = date.today()
     known_user_ids = set(USERS.keys())
-    unknown_user_ids = sorted(set(df_multi["user_id"].astype(str).unique()) - known_user_ids)
+    unknown_user_ids = sorted(set(ttn_user_counts(today - timedelta(days=2), today)) - known_user_ids)
 
     for uid, ini in USERS.items():
         keyboard.append([InlineKeyboardButton(f"{html.escape(ini)} ({uid})", callback_data=f"edit_user:{uid}")])
 
+    infos = await names.lookup_many("bot2", bot, unknown_user_ids)
     for uid in unknown_user_ids:
-        try:
-            user = await bot.get_chat(int(uid))
-            name = f"@{user.username}" if user.username else html.escape(user.full_name)
-        except:
-            name = "неизвестно"
-        keyboard.append([InlineKeyboardButton(f"🟥 {uid} {name}", callback_data=f"add_ini:{uid}")])
+        keyboard.append([InlineKeyboardButton(f"🟥 {uid} {display_name(infos[uid])}", callback_data=f"add_ini:{uid}")])
 
     keyboard.append([InlineKeyboardButton("➕ Добавить пользователя", callback_data="add_user")])
     keyboard.append([InlineKeyboardButton("🗑 Удалить пользователя", callback_data="del_user_menu")])
@@ -386,35 +736,85 @@ def channels_menu_keyboard():
         [InlineKeyboardButton("⬅️ Назад", callback_data="main_menu")]
     ])
 
-async def check_missed_messages(app):
-    from_date = date.today().replace(day=1)
-    df = load_df(from_date)
-
-    if df.empty:
-        print("Нет сообщений за текущий месяц.")
-        return
-
-    df["timestamp"] = pd.to_datetime(df["timestamp"], errors="coerce")
-    recent = df[df["timestamp"].dt.date >= from_date]
-
-    if recent.empty:
-        print("Нет новых сообщений.")
-        return
-
-    print("🔎 Сохраняем все найденные сообщения с ТТН с начала месяца:")
-    for _, row in recent.iterrows():
-        # Фейковое сообщение, чтобы использовать `save_message_to_file`
-        class FakeMessage:
-            def __init__(self, row):
-                self.text = row["message"]
-                self.date = row["timestamp"]
-                self.chat = type("chat", (), {"id": row["chat_id"]})()
-                self.from_user = type("user", (), {"id": int(row["user_id"])})()
+# Проверка пропущенных ТТН за месяц. Источники сообщений:
+#   - собственный лог бота (партиции data/<день>.csv) — из текста каждого сообщения
+#     заново извлекаются ТТН, недостающие в логе (старый формат, смена шаблона ТТН);
+#   - необязательные выгрузки в data/backfill/*.csv — CSV с заголовком
+#     timestamp,chat_id,user_id,message (timestamp как в логе: "YYYY-MM-DD HH:MM:SS"),
+#     например экспорт истории чата; файлы кладёт администратор, бот их только читает.
+# Каждое сообщение учитывается один раз, дубли ТТН отсекает ttn_seen,
+# новые строки дописываются в партиции одной пачкой.
+BACKFILL_DIR = DATA_DIR / "backfill"
+PROGRESS_EVERY = 5000
+
+def message_key(row) -> tuple:
+    return (str(row["chat_id"]), str(row["user_id"]), str(row["timestamp"]), str(row["message"]))
+
+def replay_sources(start: date, end: date) -> list[Path]:
+    days = [start + timedelta(days=i) for i in range((end - start).days + 1)]
+    own = [f for f in (partition_file(day) for day in days) if f.exists()]
+    exports = sorted(BACKFILL_DIR.glob("*.csv")) if BACKFILL_DIR.is_dir() else []
+    return own + exports
+
+def collect_missed_rows(start: date, end: date) -> tuple[list[dict], int]:
+    """Потоково читает лог и выгрузки, возвращает (сообщения с ТТН за start..end, всего сообщений)."""
+    first, last = start.isoformat(), end.isoformat()
+    seen_keys = set()
+    candidates, total = [], 0
+    for f in replay_sources(start, end):
+        with open(f, encoding="utf-8", newline="") as csvfile:
+            for row in csv.DictReader(csvfile):
+                if not first <= str(row.get("timestamp"))[:10] <= last:
+                    continue
+                # В логе сообщение с несколькими ТТН занимает несколько строк
+                key = message_key(row)
+                if key in seen_keys:
+                    continue
+                seen_keys.add(key)
+                total += 1
+                if total % PROGRESS_EVERY == 0:
+                    print(f"🔎 Проверено сообщений: {total}, с ТТН: {len(candidates)}")
+                if TTN_PATTERN.search(str(row["message"])):
+                    candidates.append(row)
+    return candidates, total
+
+async def check_missed_messages(app) -> str:
+    global log_offset
+    today = date.today()
+    from_date = today.replace(day=1)
+    await log_writer.flush()
+    if not replay_sources(from_date, today):
+        print(f"Нет лога за месяц и выгрузок в {BACKFILL_DIR}.")
+        return "Нет сообщений для проверки."
+
+    missed, total = await asyncio.to_thread(collect_missed_rows, from_date, today)
+    rows = []
+    for row in sorted(missed, key=lambda r: r["timestamp"]):
+        try:
+            chat_id = int(row["chat_id"])
+        except (TypeError, ValueError):
+            continue
+        base = {
+            "timestamp": row["timestamp"],
+            "chat_id": chat_id,
+            "user_id": str(row["user_id"]),
+            "message": row["message"],
+        }
+        ttns = extract_ttns(row["message"])
+        rows.extend(base | {"ttn": ttn} for ttn in take_new_ttns(ttn_seen, chat_id, row["timestamp"][:10], ttns))
 
-        msg = FakeMessage(row)
-        save_message_to_file(msg)
+    if rows:
+        await asyncio.to_thread(append_rows, rows)
+        index_rows(ttn_index, rows)
+        log_offset += len(rows)
+        for row in rows:
+            count_month_message(row)
+        prune_ttn_index()
+        flush_month_counters()
 
-    print("✅ Все сообщения с ТТН добавлены в файл.")
+    summary = f"Проверено сообщений: {total}, добавлено ТТН: {len(rows)}"
+    print(f"✅ {summary}")
+    return summary
 
 
 async def callback_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -534,8 +934,8 @@ async def callback_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
             await query.edit_message_text("Проект не найден.", reply_markup=keyboard)
 
     elif data == "check_missed":
-        await check_missed_messages(context.application)
-        await query.edit_message_text("✅ Проверка завершена.", reply_markup=main_menu_keyboard())
+        summary = await check_missed_messages(context.application)
+        await query.edit_message_text(f"✅ Проверка завершена.\n{summary}", reply_markup=main_menu_keyboard())
 
     elif data == "channels_menu":
         keyboard = channels_menu_keyboard()
@@ -692,10 +1092,8 @@ async def message_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
             if 0 <= hh < 24 and 0 <= mm < 60:
                 bot_data["report_time"] = f"{hh:02}:{mm:02}"
                 save_config(bot_data)
-
-                rescheduler = bot_data.get("reschedule_report")
-                if rescheduler:
-                    rescheduler()
+                # Планировщик читает report_time сам, просим перепроверить сразу
+                scheduler.refresh()
 
                 await message.reply_text(f"✅ Время отчёта установлено: {hh:02}:{mm:02}", reply_markup=main_menu_keyboard())
                 chat_data.clear()
@@ -748,7 +1146,6 @@ from telegram.ext import (
     MessageHandler, filters
 )
 from fastapi import Request
-from apscheduler.schedulers.asyncio import AsyncIOScheduler
 
 load_dotenv()
 
@@ -777,14 +1174,6 @@ import asyncio
 async def scheduled_job():
     await scheduled_report(application.bot, application.bot_data)
 
-# Планировщик
-scheduler = AsyncIOScheduler()
-hour, minute = map(int, cfg.get("report_time", "17:00").split(":"))
-scheduler.add_job(
-    scheduled_job,
-    "cron", hour=hour, minute=minute, timezone=pytz.timezone("Europe/Kiev")
-)
-
 # === Экспортируемые функции для общего multi_bot ===
 
 async def handle_startup():
@@ -793,22 +1182,36 @@ async def handle_startup():
 
     # ✅ Устанавливаем webhook
     await application.bot.set_webhook(WEBHOOK_URL)
+    delivery.register("bot2", application.bot.send_message)
 
-    # Запускаем планировщик
-    scheduler.start()
+    # Автоотчёт в report_time (время меняется из меню и подхватывается без перезапуска)
+    scheduler.add_job("bot2_report", scheduled_job,
+                      daily(lambda: application.bot_data.get("report_time", "17:00")), grace=3600)
 
-    # Очистка старых данных
+    # Старый формат (сообщение целиком) → строка на ТТН, затем раскладка по партициям
+    await asyncio.to_thread(migrate_ttn_column)
+    await asyncio.to_thread(migrate_legacy_log)
     cleanup_old_data_files()
+    today = date.today()
+    ttn_seen.update(await asyncio.to_thread(build_ttn_seen, today - timedelta(days=TTN_DEDUP_DAYS - 1), today))
+    ttn_index.update(await asyncio.to_thread(build_ttn_index, today - timedelta(days=INDEX_DAYS - 1), today))
+    month_counters.update(await asyncio.to_thread(load_month_counters))
+    save_month_counters()
+    log_writer.start()
 
     if ERROR_CHANNEL_ID:
-        await application.bot.send_message(ERROR_CHANNEL_ID, "✅ bot2 запущен")
+        await delivery.send("bot2", ERROR_CHANNEL_ID, "✅ bot2 запущен", urgent=True)
 
-async def handle_webhook(request: Request):
-    data = await request.json()
+async def process_update(data: dict):
     update = Update.de_json(data, application.bot)
     await application.process_update(update)
+
+async def handle_webhook(request: Request):
+    data = await request.json()
+    await process_update(data)
     return {"ok": True}
 
 async def handle_shutdown():
+    await log_writer.stop()
     await application.stop()
     await application.shutdown()
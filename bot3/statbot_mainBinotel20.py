@@ -8,9 +8,7 @@ import time
 import re
 import shutil
 import tempfile
-import csv
 import aiohttp
-import requests
 import pytz
 
 from pathlib import Path
@@ -18,7 +16,6 @@ from datetime import datetime, date, timedelta
 
 # === СТОРОННИЕ БИБЛИОТЕКИ ===
 from dotenv import load_dotenv
-from apscheduler.schedulers.asyncio import AsyncIOScheduler
 
 from telegram import (
     Bot,
@@ -45,9 +42,19 @@ from telegram.ext import (
 
 from telegram.helpers import escape_markdown
 
+import pandas as pd
+
+from shared.binotel import ingestion as binotel
+from shared.callstats import merge_aggregates
+from shared.delivery import delivery
+from shared.names import names
+from shared.reportcache import reports, data_version
+from shared.state import state
+from shared.singleflight import jobs
+from shared.scheduler import scheduler, cron
+
 # === НАСТРОЙКА ЛОГИРОВАНИЯ ===
 logging.basicConfig(level=logging.INFO)
-logging.getLogger("apscheduler").setLevel(logging.ERROR)
 logging.getLogger("telegram").setLevel(logging.ERROR)
 logging.getLogger("httpx").setLevel(logging.WARNING)
 
@@ -67,16 +74,13 @@ WEBHOOK_PATH = "/webhook/bot3"
 WEBHOOK_URL = f"{WEBHOOK_DOMAIN}{WEBHOOK_PATH}"
 ERROR_CHANNEL_ID = int(os.getenv("ERROR_CHANNEL_ID", "-1"))  # если не задан, будет -1
 SESSION_ID = os.getenv("SESSION_ID")
+KYIV_TZ = pytz.timezone("Europe/Kyiv")
+
+# Настройки (settings.json) из той же папки; состояние в памяти, см. shared/state.py
+SETTINGS_FILE = BASE_DIR / "settings.json"
 
-# Функция загрузки настроек из JSON (settings.json) из той же папки
 def load_settings(filename: str = "settings.json") -> dict:
-    try:
-        settings_path = BASE_DIR / filename
-        with settings_path.open("r", encoding="utf-8") as f:
-            return json.load(f)
-    except Exception as e:
-        logging.error(f"Ошибка загрузки {filename}: {e}")
-        return {}
+    return state.load(BASE_DIR / filename, {})
 
 settings = load_settings()
 ADMIN_LIST = settings.get("ADMIN_LIST", [])
@@ -84,14 +88,7 @@ REPORT_CHANNEL_ID = settings.get("REPORT_CHANNEL_ID")
 
 # --- Сообщение об падениях бота ---
 async def notify_admins(context, message: str):
-    try:
-        await message_queue.send(
-            context.bot,
-            chat_id=ERROR_CHANNEL_ID,
-            text=f"🚨 {message}"
-        )
-    except Exception as e:
-        logging.error(f"❌ Не удалось отправить ошибку в канал: {e}")
+    await delivery.send("bot3", ERROR_CHANNEL_ID, f"🚨 {message}", urgent=True, label="канал ошибок")
 
 # --- Работа с JSON ---
 def load_json(path):
@@ -106,13 +103,10 @@ def load_json(path):
         return {}
 
 def save_json(path, data):
-    try:
-        with open(path, "w", encoding="utf-8") as f:
-            json.dump(data, f, ensure_ascii=False, indent=2)
-    except Exception as e:
-        logging.error(f"Ошибка сохранения {path}: {e}")
+    # Память обновляется сразу, файл — атомарно и вне event loop
+    state.save(path, data)
 
-def save_settings(data, path="settings.json"):
+def save_settings(data, path=SETTINGS_FILE):
     save_json(path, data)
 
 def get_admin_ids() -> list[int]:
@@ -173,156 +167,16 @@ def update_report_channel(new_channel_id: str):
 
 # Загружаем звонки
 
-def fetch_via_playwright() -> Path | None:
-    import os, json, csv, time, tempfile, shutil, requests, pytz
-    from datetime import datetime, timedelta, date
-    from pathlib import Path
-    from dotenv import load_dotenv
-
-    def should_replace_file(file_path: Path, interval_end: datetime) -> bool:
-        if not file_path.exists():
-            return True
-        file_mtime = datetime.fromtimestamp(file_path.stat().st_mtime, tz=pytz.UTC)
-        return file_mtime < interval_end.astimezone(pytz.UTC)
-
-    # Ключи и пути из .env
-    BINOTEL_API_KEY = os.getenv("BINOTEL_API_KEY")
-    BINOTEL_API_SECRET = os.getenv("BINOTEL_API_SECRET")
-    BINOTEL_FOLDER = BASE_DIR / os.getenv("BINOTEL_FOLDER", "binotel")
-    CSV_OUTPUT_FOLDER = BASE_DIR / os.getenv("BINOTEL_CSV_FOLDER", "new_data")
-
-    if not BINOTEL_API_KEY or not BINOTEL_API_SECRET:
-        print("❌ Не заданы ключи BINOTEL_API_KEY или BINOTEL_API_SECRET")
-        return None
-
-    KYIV_TZ = pytz.timezone("Europe/Kyiv")
-    now_kyiv = datetime.now(KYIV_TZ)
-    date_str = now_kyiv.strftime("%Y-%m-%d")
-
-    day_folder = BINOTEL_FOLDER / date_str
-    day_folder.mkdir(parents=True, exist_ok=True)
-
-    # Удаление старых папок
-    for subdir in BINOTEL_FOLDER.iterdir():
-        if subdir.is_dir() and subdir.name != date_str:
-            shutil.rmtree(subdir)
-
-    start_of_interval = now_kyiv.replace(hour=7, minute=30, second=0, microsecond=0)
-    planned_end = now_kyiv.replace(hour=22, minute=0, second=0, microsecond=0)
-    if now_kyiv < start_of_interval:
-        print("⚠️ Ещё не наступило время для запросов (до 07:30)")
-        return None
-
-    minute = (now_kyiv.minute // 30) * 30
-    last_interval_end = now_kyiv.replace(minute=minute, second=0, microsecond=0) + timedelta(minutes=30)
-    end_of_interval = min(planned_end, last_interval_end)
-    if end_of_interval <= start_of_interval:
-        print("⚠️ Нет доступных интервалов для запроса")
+async def fetch_call_stats() -> dict | None:
+    # Окна Binotel качает общий сервис, агрегаты по сотрудникам считаются при загрузке
+    date_str = await binotel.refresh()
+    if not date_str:
         return None
-
-    interval = timedelta(minutes=30)
-    current_start = start_of_interval
-
-    while current_start < end_of_interval:
-        current_end = current_start + interval
-        filename = f"{current_start.strftime('%H_%M')}_{current_end.strftime('%H_%M')}.json"
-        filepath = day_folder / filename
-
-        if not should_replace_file(filepath, current_end):
-            try:
-                with open(filepath, "r", encoding="utf-8") as f:
-                    data = json.load(f)
-                if data.get("status") == "success" and data.get("callDetails"):
-                    print(f"🔁 Уже скачано: {filename}")
-                    current_start = current_end
-                    continue
-            except Exception as e:
-                print(f"⚠️ Повреждённый файл {filename}, перезапрашиваем...")
-
-        payload = {
-            "startTime": int(current_start.timestamp()),
-            "stopTime": int(current_end.timestamp()),
-            "key": BINOTEL_API_KEY,
-            "secret": BINOTEL_API_SECRET
-        }
-
-        try:
-            response = requests.post(
-                "https://api.binotel.com/api/4.0/stats/outgoing-calls-for-period.json",
-                headers={"Content-Type": "application/json"},
-                json=payload,
-                timeout=30
-            )
-
-            print(f"📡 {current_start.strftime('%H:%M')}–{current_end.strftime('%H:%M')} — Статус: {response.status_code}")
-            if response.status_code == 200:
-                data = response.json()
-                with open(filepath, "w", encoding="utf-8") as f:
-                    json.dump(data, f, ensure_ascii=False, indent=2)
-            else:
-                print(f"❌ Ошибка HTTP {response.status_code}")
-        except Exception as e:
-            print(f"❌ Ошибка запроса: {e}")
-
-        current_start = current_end
-        time.sleep(1)
-
-    # Обработка и сохранение CSV
-    transformed_calls = []
-    for file in sorted(day_folder.glob("*.json")):
-        try:
-            with open(file, "r", encoding="utf-8") as f:
-                data = json.load(f)
-            if data.get("status") != "success":
-                continue
-
-            call_details = data.get("callDetails", {})
-            calls = list(call_details.values()) if isinstance(call_details, dict) else call_details
-
-            for call in calls:
-                employee_data = call.get("employeeData", {})
-                employee_name = employee_data.get("name", "") if isinstance(employee_data, dict) else ""
-                transformed_calls.append({
-                    "general call id": call.get("generalCallID", ""),
-                    "date": datetime.fromtimestamp(int(call.get("startTime", 0)), KYIV_TZ).strftime("%H:%M %d-%m-%Y"),
-                    "pbx number": call.get("pbxNumberData", {}).get("number", ""),
-                    "pbx number name": "",
-                    "customer number": call.get("externalNumber", ""),
-                    "customer name": "",
-                    "link to crm": "",
-                    "list of labels in customer": "",
-                    "employee number": call.get("internalNumber", ""),
-                    "employee name": employee_name,
-                    "waitsec": call.get("waitsec", ""),
-                    "billsec": call.get("billsec", ""),
-                    "disposition": call.get("disposition", ""),
-                    "trunkNumber": "",
-                    "isNewCall": call.get("isNewCall", ""),
-                    "recording status": call.get("recordingStatus", ""),
-                    "who hung up": call.get("whoHungUp", ""),
-                    "comment": "",
-                    "tags": ""
-                })
-
-        except Exception as e:
-            print(f"⚠️ Ошибка чтения {file.name}: {e}")
-
-    if not transformed_calls:
-        print("⚠️ Нет данных для CSV")
+    stats = await operator_stats(datetime.strptime(date_str, "%Y-%m-%d").date())
+    if not stats:
+        print("⚠️ Нет звонков за сегодня")
         return None
-
-    desired_columns = list(transformed_calls[0].keys())
-    tmpfile = tempfile.NamedTemporaryFile(delete=False, suffix=".csv", mode='w', encoding='utf-8-sig', newline='')
-    writer = csv.DictWriter(tmpfile, fieldnames=desired_columns, delimiter=';', extrasaction='ignore')
-    writer.writeheader()
-    writer.writerows(transformed_calls)
-    tmpfile.close()
-
-    final_path = CSV_OUTPUT_FOLDER / f"binotel_calls_{date_str}.csv"
-    final_path.parent.mkdir(parents=True, exist_ok=True)
-    shutil.move(tmpfile.name, final_path)
-    print(f"✅ CSV сохранён: {final_path}")
-    return final_path
+    return stats
 
 def get_today_file(folder: Path):
     today = date.today()
@@ -338,7 +192,21 @@ from playwright.async_api import async_playwright
 
 load_dotenv()  # загружаем .env при импорте
 
+# Версия статистики — хэш скачанного содержимого. Пока он не меняется, data.json
+# не переписывается; mtime файла — время последней загрузки (по нему json_cutoff_time
+# отсекает звонки для прошлой статистики)
+last_stat_json = {"version": None, "ts": 0.0}
+
+def write_stat_json(path: Path, json_data, ts: float):
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(json_data, f, ensure_ascii=False, indent=2)
+    os.utime(path, (ts, ts))
+
 async def fetch_json_data() -> Path | None:
+    # Одновременные рассылка и отчёт ждут одну загрузку в один и тот же файл
+    return await jobs.run(("bot3_stat_json", date.today().isoformat()), download_json_data)
+
+async def download_json_data() -> Path | None:
     save_path = Path("new_data") / "data.json"
     save_path.parent.mkdir(parents=True, exist_ok=True)
 
@@ -368,9 +236,14 @@ async def fetch_json_data() -> Path | None:
                     print(f"❌ Ошибка при разборе JSON: {e}")
                     return None
 
-                with open(save_path, "w", encoding="utf-8") as f:
-                    json.dump(json_data, f, ensure_ascii=False, indent=2)
-
+                ts = time.time()
+                version = data_version(json_data)
+                if version == last_stat_json["version"] and save_path.exists():
+                    print("♻️ Статистика не изменилась — data.json не переписываем")
+                    os.utime(save_path, (ts, ts))
+                else:
+                    write_stat_json(save_path, json_data, ts)
+                last_stat_json.update(version=version, ts=ts)
                 return save_path
 
     except Exception as e:
@@ -391,11 +264,43 @@ CURRENT_OLD_FILE = BASE_DIR / "current" / "old_data.json"
 CURRENT_NEW_FILE = BASE_DIR / "current" / "new_data.json"
 
 def load_users():
-    data = load_json(USERS_FILE)
+    data = state.load(USERS_FILE, [])
     return data if isinstance(data, list) else []
 
 def save_users(users):
     save_json(USERS_FILE, users)
+    rebuild_users_index(users)
+
+# Индекс пользователей и групп в памяти: str(user_id) → запись, ИНИЦИАЛЫ → записи.
+# Собирается один раз из users.json и пересобирается при каждом save_users
+users_by_id: dict[str, dict] = {}
+users_by_initials: dict[str, list[dict]] = {}
+users_index_ready = False
+
+def rebuild_users_index(users: list[dict]):
+    global users_index_ready
+    users_by_id.clear()
+    users_by_initials.clear()
+    for u in users:
+        users_by_id.setdefault(str(u.get("user_id")), u)
+        users_by_initials.setdefault(str(u.get("initials", "")).upper(), []).append(u)
+    users_index_ready = True
+
+def find_user(user_id) -> dict | None:
+    if not users_index_ready:
+        rebuild_users_index(load_users())
+    return users_by_id.get(str(user_id))
+
+def users_with_initials(initials) -> list[dict]:
+    if not users_index_ready:
+        rebuild_users_index(load_users())
+    return users_by_initials.get(str(initials).upper(), [])
+
+def add_user(entry: dict):
+    """Новая запись: индекс обновляется сразу, users.json — в фоне (shared/state.py)."""
+    users = load_users()
+    users.append(entry)
+    save_users(users)
 
 def adapt_new_format(json_data):
     if not isinstance(json_data, dict):
@@ -435,15 +340,10 @@ def adapt_new_format(json_data):
     return json_data  # старый формат
 
 def load_norms(path=NORMS_FILE):
-    if path.exists():
-        with open(path, "r", encoding="utf-8") as f:
-            return json.load(f)
-    else:
-        return {}
+    return state.load(path, {})
 
 def save_norms(norms):
-    with open(NORMS_FILE, "w", encoding="utf-8") as f:
-        json.dump(norms, f, ensure_ascii=False, indent=2)
+    save_json(NORMS_FILE, norms)
 
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if update.effective_chat.type != "private":
@@ -796,12 +696,15 @@ async def clean_invalid_groups(query, context):
     valid_users = []
     removed_groups = []
 
+    # Проверка всех групп разом; свежий (до 10 минут) ответ берём из кэша.
+    # Удаляем только группы, которые Telegram точно не отдаёт, не при сетевой ошибке
+    infos = await names.lookup_many("bot3", context.bot, [u.get("user_id") for u in users], max_age=600)
     for u in users:
-        try:
-            await context.bot.get_chat(u.get("user_id"))
-            valid_users.append(u)
-        except Exception:
+        info = infos.get(str(u.get("user_id")))
+        if info is not None and not info["ok"]:
             removed_groups.append(u.get("initials", "??"))
+        else:
+            valid_users.append(u)
 
     if removed_groups:
         save_users(valid_users)
@@ -960,19 +863,21 @@ async def text_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 async def reload_norms_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     global norms
-    norms = load_norms("norms.json")
+    if not NORMS_FILE.exists():
+        await update.message.reply_text(f"❌ Файл норм {NORMS_FILE.name} не знайдено, норми не змінено.")
+        return
+    norms = state.reload(NORMS_FILE, {})
     await update.message.reply_text("Норми успішно оновлено!")
 
 async def perform_broadcast_by_template(update: Update, context: ContextTypes.DEFAULT_TYPE, template_text: str, initials_input: str):
     await update.message.reply_text(f"✅Запущена розсилка по шаблону, ініціали: {initials_input}")
-    users = load_users()
 
     initials_list = [i.strip().upper() for i in initials_input.split()]
 
     if "ВСЕМ" in initials_list or "ВСІМ" in initials_list:
-        target_users = users
+        target_users = load_users()
     else:
-        target_users = [u for u in users if u.get("initials", "").upper() in initials_list]
+        target_users = [u for initials in dict.fromkeys(initials_list) for u in users_with_initials(initials)]
 
     if not target_users:
         await update.message.reply_text("❌Користувачі з такими ініціалами не знайдені.")
@@ -983,15 +888,8 @@ async def perform_broadcast_by_template(update: Update, context: ContextTypes.DE
         escaped_tag = escape_markdown_tag(tag_raw)
         text_to_send = template_text.replace("{tag}", escaped_tag)
 
-        try:
-            await message_queue.send(
-                bot=context.bot,
-                chat_id=user.get("user_id"),
-                text=text_to_send,
-                parse_mode=ParseMode.MARKDOWN
-            )
-        except Exception as e:
-            logging.error(f"❌ Помилка при відправці шаблону користувачу {user.get('initials')}: {e}")
+        await delivery.send("bot3", user.get("user_id"), text_to_send, parse_mode=ParseMode.MARKDOWN,
+                            label=f"шаблон, {user.get('initials')}")
 
 def get_zone_and_emoji(key, value, norms):
     if not key or not norms:
@@ -1146,13 +1044,7 @@ def build_warnings_by_projects(projects: list[dict], norms: dict) -> list[dict]:
     return warnings
 
 async def scheduled_broadcast(context: ContextTypes.DEFAULT_TYPE):
-    global last_broadcast_time
-
-    now = datetime.now()
-    if last_broadcast_time and now - last_broadcast_time < timedelta(minutes=55):
-        logging.info("⏱ Авторассылка недавно уже выполнялась, пропускаем.")
-        return
-
+    # Повторы по времени отсекает планировщик (слот отмечается в scheduler_state.json)
     try:
         class DummyMessage:
             async def reply_text(self, *args, **kwargs):
@@ -1166,167 +1058,80 @@ async def scheduled_broadcast(context: ContextTypes.DEFAULT_TYPE):
 
         initials_input = "ВСІМ"
         await broadcast_with_file_management(dummy_update, context, initials_input)
-        last_broadcast_time = now
         logging.info("✅ Авторассылка успешно выполнена")
 
     except Exception as e:
         error_msg = f"[🕓 scheduled_broadcast] Ошибка при авторассылке: {e}"
         logging.error(error_msg)
         try:
-            await context.bot.send_message(ERROR_CHANNEL_ID, f"❗ Помилка авторассилки:\n{e}")
+            await delivery.send("bot3", ERROR_CHANNEL_ID, f"❗ Помилка авторассилки:\n{e}", urgent=True)
         except Exception:
             pass
 
-def get_active_initials_from_calls(csv_path: Path, active_minutes_threshold=80) -> set[str]:
-    now = datetime.now()
+async def prefetch_broadcast():
+    # За PREFETCH_LEAD до авторассылки звонки Binotel (с агрегатами) уже на месте,
+    # рассылка только докачивает хвост последних минут. Статистика скачивается в самой
+    # рассылке: её время — граница скорости для следующей рассылки
+    await fetch_call_stats()
+
+def kyiv_now() -> datetime:
+    # Время звонков в хранилище — киевское без tz, сравниваем с ним же
+    return datetime.now(KYIV_TZ).replace(tzinfo=None)
+
+def operator_initials(employee: str) -> str | None:
+    name = employee.strip()
+    return name[:2].upper() if len(name) >= 2 else None
+
+async def operator_stats(day: date, until: datetime | None = None) -> dict:
+    """Агрегати дзвінків по ініціалах за день; until — лише дзвінки з хвилиною раніше until."""
+    until_ts = None
+    if until is not None:
+        # Время звонков до минуты, как в прежней выгрузке: floor(t) < until ⇔ t < ceil(until)
+        until_ts = int(KYIV_TZ.localize(pd.Timestamp(until).ceil("min").to_pydatetime()).timestamp())
+    # Готовые агрегаты, пока в окнах дня нет новых звонков (рассылка и отчёт подряд)
+    async def merged():
+        return merge_aggregates(await asyncio.to_thread(binotel.stats, day, day, until_ts), operator_initials)
+
+    return await reports.get_or_build(("bot3", "stats", day, until_ts), binotel.version(day, day), merged)
+
+def get_active_initials(stats: dict, active_minutes_threshold=80) -> set[str]:
+    now = kyiv_now()
     active_initials = set()
-
-    wait_time = 0
-    while csv_path.exists() and csv_path.stat().st_size == 0 and wait_time < 180:
-        # logging.info(f"⏳ Очікуємо завершення завантаження CSV... {wait_time} сек")
-        time.sleep(1)
-        wait_time += 1
-
-    if not csv_path.exists() or csv_path.stat().st_size == 0:
-        logging.error("❌ CSV не був завантажений або порожній.")
-        return active_initials
-
-    try:
-        time.sleep(1)
-
-        with open(csv_path, newline='', encoding='utf-8') as f:
-            reader = csv.DictReader(f, delimiter=";")
-            rows = list(reader)
-
-            if rows:
-                for row in rows:
-                    raw_name = row.get("employee name", "").strip()
-                    if not raw_name:
-                        continue
-
-                    initials = raw_name[:2].upper()
-
-                    try:
-                        call_time = datetime.strptime(row["date"], "%H:%M %d-%m-%Y")
-                        if call_time.date() == now.date():
-                            minutes_diff = (now - call_time).total_seconds() / 60
-                            if 0 <= minutes_diff <= active_minutes_threshold:
-                                active_initials.add(initials)
-                    except Exception as e:
-                        # logging.warning(f"⚠️ Не вдалося обробити дату: {row.get('date')} — {e}")
-                        continue
-    except Exception as e:
-        logging.error(f"❌ Помилка читання CSV: {e}")
-
+    for initials, s in stats.items():
+        last_call = datetime.fromtimestamp(s["last"], KYIV_TZ).replace(tzinfo=None, second=0)
+        minutes_diff = (now - last_call).total_seconds() / 60
+        if 0 <= minutes_diff <= active_minutes_threshold:
+            active_initials.add(initials)
     return active_initials
 
-def inject_speed_from_calls(new_data: dict, csv_path: Path) -> None:
-    from collections import defaultdict
-
-    call_times_by_initials = defaultdict(list)
-    now = datetime.now()
-
-    try:
-        with open(csv_path, newline='', encoding='utf-8') as f:
-            reader = csv.DictReader(f, delimiter=";")
-            for row in reader:
-                raw_name = row.get("employee name", "").strip()
-                if not raw_name or len(raw_name) < 2:
-                    continue
-
-                initials = raw_name[:2].upper()
-
-                try:
-                    call_time = datetime.strptime(row["date"], "%H:%M %d-%m-%Y")
-                    if call_time.date() == now.date():
-                        call_times_by_initials[initials].append(call_time)
-                except:
-                    continue
-    except Exception as e:
-        logging.error(f"❌ Помилка при аналізі CSV для швидкості: {e}")
-        return
-
-    # ⏱ Для каждого сотрудника считаем часы
-    for initials, calls in call_times_by_initials.items():
-        calls.sort()
-        work_minutes = 0
-        block_start = calls[0]
-
-        for i in range(1, len(calls)):
-            diff = (calls[i] - calls[i - 1]).total_seconds() / 60
-            if diff <= 80:
-                continue
-            else:
-                block_end = calls[i - 1]
-                block_duration = (block_end - block_start).total_seconds() / 60
-                work_minutes += block_duration
-                block_start = calls[i]
-
-        # Последний блок
-        block_end = calls[-1]
-        last_block_duration = (block_end - block_start).total_seconds() / 60
-        work_minutes += last_block_duration
-
+def inject_speed_from_stats(data: dict, stats: dict) -> None:
+    # ⏱ Скорость = заказы / рабочие часы (сессии с паузой до 80 минут)
+    for initials, s in stats.items():
+        work_minutes = sum(end - start for start, end in s["sessions"].get("80min", [])) / 60
         hours = work_minutes / 60
-        if hours > 0 and initials in new_data:
-            orders = new_data[initials].get("orders_total", 0)
-            speed = orders / hours if hours else 0.0
-            new_data[initials]["speed"] = round(speed, 2)
-
-def inject_old_speed_from_calls_by_json_time(old_data: dict, csv_path: Path, old_json_file: Path) -> None:
-    from collections import defaultdict
-    import os
+        if hours > 0 and initials in data:
+            orders = data[initials].get("orders_total", 0)
+            data[initials]["speed"] = round(orders / hours, 2)
 
+def json_cutoff_time(json_file: Path) -> datetime | None:
     try:
-        cutoff_time = datetime.fromtimestamp(old_json_file.stat().st_mtime)
+        return datetime.fromtimestamp(json_file.stat().st_mtime, KYIV_TZ).replace(tzinfo=None)
     except Exception as e:
         logging.error(f"❌ Не вдалося отримати час створення JSON: {e}")
-        return
-
-    call_times_by_initials = defaultdict(list)
-
-    try:
-        with open(csv_path, newline='', encoding='utf-8') as f:
-            reader = csv.DictReader(f, delimiter=";")
-            for row in reader:
-                raw_name = row.get("employee name", "").strip()
-                if not raw_name or len(raw_name) < 2:
-                    continue
-
-                initials = raw_name[:2].upper()
-                try:
-                    call_time = datetime.strptime(row["date"], "%H:%M %d-%m-%Y")
-                    if call_time < cutoff_time and call_time.date() == cutoff_time.date():
-                        call_times_by_initials[initials].append(call_time)
-                except Exception:
-                    continue
-    except Exception as e:
-        logging.error(f"❌ Помилка читання CSV: {e}")
-        return
-
-    for initials, calls in call_times_by_initials.items():
-        calls.sort()
-        work_minutes = 0
-        block_start = calls[0]
-
-        for i in range(1, len(calls)):
-            diff = (calls[i] - calls[i - 1]).total_seconds() / 60
-            if diff <= 80:
-                continue
-            else:
-                block_end = calls[i - 1]
-                work_minutes += (block_end - block_start).total_seconds() / 60
-                block_start = calls[i]
-
-        work_minutes += (calls[-1] - block_start).total_seconds() / 60
-        hours = work_minutes / 60
+        return None
 
-        if hours > 0 and initials in old_data:
-            orders = old_data[initials].get("orders_total", 0)
-            speed = orders / hours
-            old_data[initials]["speed"] = round(speed, 2)
+# Рассылки идут по одной: следующая (второй админ, планировщик) ждёт окончания текущей
+# и затем выполняет свою — со своими инициалами и своими ответами, а файлы
+# статистики не переписываются параллельно
+broadcast_lock = asyncio.Lock()
 
 async def broadcast_with_file_management(update: Update, context: ContextTypes.DEFAULT_TYPE, initials_input: str):
+    if broadcast_lock.locked():
+        await update.message.reply_text("⏳ Розсилка вже виконується — ваша почнеться одразу після неї.")
+    async with broadcast_lock:
+        await run_broadcast(update, context, initials_input)
+
+async def run_broadcast(update: Update, context: ContextTypes.DEFAULT_TYPE, initials_input: str):
     old_file = get_today_file(FOLDER_OLD)
 
     if old_file:
@@ -1351,22 +1156,28 @@ async def broadcast_with_file_management(update: Update, context: ContextTypes.D
 
         await update.message.reply_text("🕐 Завантаження дзвінків з Binotel... (1–2 хвилини)")
         start_time = time.time()
-        csv_path = fetch_via_playwright()
+        calls_stats = await fetch_call_stats()
         duration = time.time() - start_time
 
-        if not csv_path:
+        if calls_stats is None:
             await update.message.reply_text("❌ Не вдалося завантажити файл дзвінків з Binotel.")
             return
 
-        inject_speed_from_calls(new_data, csv_path)
+        inject_speed_from_stats(new_data, calls_stats)
 
         if old_file and old_data:
-            inject_old_speed_from_calls_by_json_time(old_data, csv_path, old_file)
-
-        await update.message.reply_text(f"✅ Файл дзвінків отримано за {duration:.1f} сек.")
+            cutoff_time = json_cutoff_time(old_file)
+            if cutoff_time:
+                inject_speed_from_stats(old_data, await operator_stats(cutoff_time.date(), until=cutoff_time))
+
+        stats = binotel.last_stats
+        await update.message.reply_text(
+            f"✅ Файл дзвінків отримано за {duration:.1f} сек. "
+            f"(вікон: {stats.get('windows', 0)}, завантажено: {stats.get('fetched', 0)}, "
+            f"з кешу: {stats.get('cached', 0)})"
+        )
 
-        active_initials = get_active_initials_from_calls(csv_path, active_minutes_threshold=70)
-        csv_path.unlink(missing_ok=True)
+        active_initials = get_active_initials(calls_stats, active_minutes_threshold=70)
 
         await update.message.reply_text(f"🎧 Активні ініціали: {', '.join(active_initials) or 'немає'}")
 
@@ -1428,15 +1239,8 @@ async def broadcast_with_file_management(update: Update, context: ContextTypes.D
             old_file_exists=bool(old_data), norms=norms
         )
 
-        try:
-            await message_queue.send(
-                context.bot,
-                chat_id=user.get("user_id"),
-                text=msg_text,
-                parse_mode=ParseMode.MARKDOWN
-            )
-        except Exception as e:
-            logging.error(f"Ошибка отправки пользователю {initials}: {e}")
+        await delivery.send("bot3", user.get("user_id"), msg_text, parse_mode=ParseMode.MARKDOWN,
+                            label=f"розсилка, {initials}")
 
     # Формируем отчёт для канала в новом формате
     report_data = []
@@ -1512,15 +1316,8 @@ async def broadcast_with_file_management(update: Update, context: ContextTypes.D
 
         report_text = "\n".join(lines)
 
-        try:
-            await message_queue.send(
-                context.bot,
-                chat_id=REPORT_CHANNEL_ID,
-                text=report_text,
-                parse_mode=ParseMode.MARKDOWN
-            )
-        except Exception as e:
-            logging.error(f"❌Ошибка отправки отчёта в канал: {e}")
+        await delivery.send("bot3", REPORT_CHANNEL_ID, report_text, parse_mode=ParseMode.MARKDOWN,
+                            label="отчёт в канал")
 
     try:
         if old_file:
@@ -1533,6 +1330,8 @@ async def broadcast_with_file_management(update: Update, context: ContextTypes.D
 
     await update.message.reply_text("✅ Розсилка виконана і файли оновлено.")
 
+GROUP_INITIALS_RE = re.compile(r"\(([A-Za-zА-Яа-я]{2})\)")
+
 async def handle_group_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
     chat = update.effective_chat
 
@@ -1544,21 +1343,20 @@ async def handle_group_message(update: Update, context: ContextTypes.DEFAULT_TYP
     if chat_id in (REPORT_CHANNEL_ID, ERROR_CHANNEL_ID):
         return
 
+    # Известная группа — поиск по индексу в памяти, без чтения users.json
+    if find_user(chat_id) is not None:
+        return
+
     title = chat.title or "Без названия"
 
-    initials_match = re.search(r"\(([A-Za-zА-Яа-я]{2})\)", title)
+    initials_match = GROUP_INITIALS_RE.search(title)
     initials = initials_match.group(1).upper() if initials_match else str(chat_id)
 
-    users = load_users()
-    exists = any(g.get("user_id") == chat_id for g in users)
-
-    if not exists:
-        users.append({
-            "initials": initials,
-            "tag": "",
-            "user_id": chat_id
-        })
-        save_users(users)
+    add_user({
+        "initials": initials,
+        "tag": "",
+        "user_id": chat_id
+    })
 
 async def my_chat_member_update(update: Update, context: ContextTypes.DEFAULT_TYPE):
     chat_member_update = update.my_chat_member
@@ -1566,6 +1364,8 @@ async def my_chat_member_update(update: Update, context: ContextTypes.DEFAULT_TY
     new_status = chat_member_update.new_chat_member.status
 
     if new_status in ("kicked", "left"):
+        if find_user(chat.id) is None:
+            return
         users = load_users()
         users = [u for u in users if u.get("user_id") != chat.id]
         save_users(users)
@@ -1573,14 +1373,11 @@ async def my_chat_member_update(update: Update, context: ContextTypes.DEFAULT_TY
         
 async def error_handler(update: object, context: ContextTypes.DEFAULT_TYPE) -> None:
     logging.error("❌ Произошла ошибка:", exc_info=context.error)
-    try:
-        await context.bot.send_message(
-            chat_id=ERROR_CHANNEL_ID,
-            text=f"🚨 Произошла ошибка:\n<pre>{html.escape(str(context.error))}</pre>",
-            parse_mode="HTML"
-        )
-    except Exception as e:
-        logging.error(f"❌ Ошибка при отправке сообщения об ошибке: {e}")
+    await delivery.send(
+        "bot3", ERROR_CHANNEL_ID,
+        f"🚨 Произошла ошибка:\n<pre>{html.escape(str(context.error))}</pre>",
+        parse_mode="HTML", urgent=True, label="канал ошибок"
+    )
 
 async def test_auto_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if not is_admin(update.effective_user.id):
@@ -1588,46 +1385,6 @@ async def test_auto_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await update.message.reply_text("🔁 Тестовий запуск авторассилки...")
     await scheduled_broadcast(context)
 
-# rate_limiter.py или внизу main файла
-import time
-import logging
-from asyncio import Queue, create_task, sleep
-from collections import defaultdict
-
-class MessageQueue:
-    def __init__(self, max_per_sec=10, parallel_limit=10):
-        self.queue = Queue()
-        self.max_per_sec = max_per_sec
-        self.parallel_limit = parallel_limit
-        self.last_sent = defaultdict(lambda: 0)
-        self.active_tasks = set()
-
-    async def start(self):
-        while True:
-            if len(self.active_tasks) < self.parallel_limit:
-                task = await self.queue.get()
-                t = create_task(self._safe_send(task))
-                self.active_tasks.add(t)
-                t.add_done_callback(self.active_tasks.discard)
-            await sleep(0.05)  # проверка каждые 50мс
-
-    async def _safe_send(self, task_data):
-        bot, chat_id, text, parse_mode = task_data
-        now = time.time()
-        delay = max(1.0 - (now - self.last_sent[chat_id]), 0.0)
-        await sleep(delay)
-        try:
-            await bot.send_message(chat_id=chat_id, text=text, parse_mode=parse_mode)
-        except Exception as e:
-            logging.error(f"❌ Ошибка при отправке сообщения в {chat_id}: {e}")
-        self.last_sent[chat_id] = time.time()
-
-    async def send(self, bot, chat_id, text, parse_mode=None):
-        await self.queue.put((bot, chat_id, text, parse_mode))
-
-# Глобальная очередь сообщений
-message_queue = MessageQueue(max_per_sec=15, parallel_limit=15)
-
 # 💡 Глобальная переменная приложения
 app_instance = None
 
@@ -1668,14 +1425,13 @@ async def send_stats_report(reply_func, user_id):
 
         await reply_func("📞 Загрузка звонков Binotel...")
         start_time = time.time()
-        csv_path = fetch_via_playwright()
-        if not csv_path:
+        calls_stats = await fetch_call_stats()
+        if calls_stats is None:
             await reply_func("❌ Не удалось загрузить звонки с Binotel.")
             return
         duration = time.time() - start_time
-        inject_speed_from_calls(stat_data, csv_path)
-        active_initials = get_active_initials_from_calls(csv_path)
-        Path(csv_path).unlink(missing_ok=True)
+        inject_speed_from_stats(stat_data, calls_stats)
+        active_initials = get_active_initials(calls_stats)
 
         await reply_func(
             f"✅ Звонки загружены за {duration:.1f} сек.\nАктивные: {', '.join(active_initials) or 'нет'}"
@@ -1774,8 +1530,6 @@ async def send_stats_report(reply_func, user_id):
             text = "\n".join(lines).strip()
             await reply_func(text, parse_mode="Markdown")
 
-        Path(json_path).unlink(missing_ok=True)
-
     except Exception as e:
         logging.error(f"❌ Ошибка в отправке отчёта: {e}")
         await reply_func(f"❌ Ошибка при выполнении: {e}")
@@ -1783,35 +1537,6 @@ async def send_stats_report(reply_func, user_id):
 async def debug_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await send_stats_report(update.message, context)
 
-# Планировщик авторассылки (экспортируемая функция)
-def setup_scheduler(app):
-    from apscheduler.schedulers.background import BackgroundScheduler
-    import asyncio
-
-    global last_broadcast_time
-    last_broadcast_time = None  # Инициализация глобальной переменной
-
-    scheduler = BackgroundScheduler(timezone="Europe/Kyiv")
-    loop = asyncio.get_event_loop()
-
-    def job_func():
-        try:
-            ctx = make_context(app)
-            asyncio.run_coroutine_threadsafe(scheduled_broadcast(ctx), loop)
-        except Exception as e:
-            logging.error(f"[🕓 scheduled_broadcast] Ошибка при авторассылке: {e}")
-
-    for hour in range(9, 21):
-        scheduler.add_job(
-            job_func,
-            trigger='cron',
-            hour=hour,
-            minute=2,
-            id=f'broadcast_{hour:02d}'
-        )
-
-    scheduler.start()
-
 # bot3/statbot_mainBinotel20.py
 
 import os
@@ -1853,16 +1578,21 @@ async def handle_startup():
     # ✅ Устанавливаем Webhook
     await application.bot.set_webhook(WEBHOOK_URL)
 
-    asyncio.create_task(message_queue.start())
-    setup_scheduler(application)
+    delivery.register("bot3", application.bot.send_message)
+    # Авторассылка каждый час 9–20 в :02
+    scheduler.add_job("bot3_broadcast", lambda: scheduled_broadcast(make_context(application)),
+                      cron(range(9, 21), 2), prefetch=prefetch_broadcast)
 
     if ERROR_CHANNEL_ID:
-        await application.bot.send_message(ERROR_CHANNEL_ID, "✅ bot3 запущен")
+        await delivery.send("bot3", ERROR_CHANNEL_ID, "✅ bot3 запущен", urgent=True)
 
-async def handle_webhook(request: Request):
-    data = await request.json()
+async def process_update(data: dict):
     update = Update.de_json(data, application.bot)
     await application.process_update(update)
+
+async def handle_webhook(request: Request):
+    data = await request.json()
+    await process_update(data)
     return {"ok": True}
 
 async def handle_shutdown():
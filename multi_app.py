@@ -1,5 +1,7 @@
 import os
+from pathlib import Path
 from fastapi import FastAPI, Request, HTTPException
+from fastapi.responses import JSONResponse
 from dotenv import load_dotenv
 import uvicorn
 
@@ -12,11 +14,19 @@ WEBHOOK_BASE_URL = os.getenv("WEBHOOK_BASE_URL") or os.getenv("RENDER_EXTERNAL_U
 if not WEBHOOK_BASE_URL:
     print("⚠️  WEBHOOK_BASE_URL не задан! Вебхуки не будут установлены.")
 
+# === Общие сервисы ===
+from shared.binotel import ingestion as binotel_ingestion
+from shared.delivery import delivery
+from shared.state import state
+from shared.intake import UpdateIntake, RecentUpdates
+from shared.scheduler import scheduler
+
 # === Импорт ботов ===
 from bot1.zvonki_single_run import (
     bot as bot1_instance,
     handle_startup as startup_bot1,
     handle_webhook as webhook_bot1,
+    process_update as process_bot1,
     handle_shutdown as shutdown_bot1
 )
 
@@ -24,6 +34,7 @@ from bot2.flashcall_app20 import (
     application as app_bot2,
     handle_startup as startup_bot2,
     handle_webhook as webhook_bot2,
+    process_update as process_bot2,
     handle_shutdown as shutdown_bot2
 )
 
@@ -31,6 +42,7 @@ from bot3.statbot_mainBinotel20 import (
     application as app_bot3,
     handle_startup as startup_bot3,
     handle_webhook as webhook_bot3,
+    process_update as process_bot3,
     handle_shutdown as shutdown_bot3
 )
 
@@ -39,23 +51,39 @@ bots = {
     "bot1": {
         "startup": startup_bot1,
         "webhook": webhook_bot1,
+        "process": process_bot1,
         "shutdown": shutdown_bot1,
         "set_webhook": lambda: bot1_instance.set_webhook(f"{WEBHOOK_BASE_URL}/webhook/bot1")
     },
     "bot2": {
         "startup": startup_bot2,
         "webhook": webhook_bot2,
+        "process": process_bot2,
         "shutdown": shutdown_bot2,
         "set_webhook": lambda: app_bot2.bot.set_webhook(f"{WEBHOOK_BASE_URL}/webhook/bot2")
     },
     "bot3": {
         "startup": startup_bot3,
         "webhook": webhook_bot3,
+        "process": process_bot3,
         "shutdown": shutdown_bot3,
         "set_webhook": lambda: app_bot3.bot.set_webhook(f"{WEBHOOK_BASE_URL}/webhook/bot3")
     }
 }
 
+# === Очереди приёма апдейтов: webhook отвечает сразу, обработка — в воркерах бота ===
+WEBHOOK_QUEUE_SIZE = int(os.getenv("WEBHOOK_QUEUE_SIZE", "1000"))
+WEBHOOK_WORKERS = int(os.getenv("WEBHOOK_WORKERS", "4"))
+intakes = {
+    name: UpdateIntake(name, bot["process"], max_pending=WEBHOOK_QUEUE_SIZE, workers=WEBHOOK_WORKERS)
+    for name, bot in bots.items()
+}
+# Уже принятые update_id: повторная доставка того же апдейта отбрасывается сразу
+recent_updates = RecentUpdates(
+    Path(__file__).resolve().parent / os.getenv("RECENT_UPDATES_FILE", "recent_updates.json"),
+    ttl=float(os.getenv("RECENT_UPDATES_TTL_HOURS", "24")) * 3600,
+)
+
 # === Инициализация FastAPI ===
 app = FastAPI()
 
@@ -67,33 +95,89 @@ async def health_check():
 @app.on_event("startup")
 async def on_startup():
     import asyncio
+    try:
+        await binotel_ingestion.start()
+        print("✅ Сервис звонков Binotel запущен")
+    except Exception as e:
+        print(f"❌ Ошибка запуска сервиса Binotel: {e}")
+
+    try:
+        await delivery.start()
+        print("✅ Очередь доставки Telegram запущена")
+    except Exception as e:
+        print(f"❌ Ошибка запуска очереди доставки: {e}")
+
+    recent_updates.load()
+
     for name, bot in bots.items():
         try:
             await bot["startup"]()
+            intakes[name].start()
             await bot["set_webhook"]()
             print(f"✅ {name} успешно запущен и webhook установлен")
             await asyncio.sleep(2)  # задержка, чтобы избежать Flood control
         except Exception as e:
             print(f"❌ Ошибка запуска {name}: {e}")
 
+    # Задачи по расписанию боты добавили в startup, запускаем один общий цикл
+    scheduler.start()
+    print(f"✅ Планировщик запущен: {', '.join(scheduler.jobs)}")
+
 @app.on_event("shutdown")
 async def on_shutdown():
+    try:
+        await scheduler.stop()
+    except Exception as e:
+        print(f"❌ Ошибка при остановке планировщика: {e}")
+
     for name, bot in bots.items():
         try:
+            await intakes[name].stop()
             await bot["shutdown"]()
             print(f"🔻 {name} остановлен")
         except Exception as e:
             print(f"❌ Ошибка при остановке {name}: {e}")
 
+    try:
+        await delivery.stop()
+    except Exception as e:
+        print(f"❌ Ошибка при остановке очереди доставки: {e}")
+
+    try:
+        recent_updates.save()
+        await state.flush()
+    except Exception as e:
+        print(f"❌ Ошибка при сохранении состояния: {e}")
+
+    try:
+        await binotel_ingestion.stop()
+    except Exception as e:
+        print(f"❌ Ошибка при остановке сервиса Binotel: {e}")
+
 @app.post("/webhook/{bot_name}")
 async def webhook_router(bot_name: str, request: Request):
     if bot_name not in bots:
         raise HTTPException(status_code=404, detail=f"❌ Бот {bot_name} не найден")
 
     try:
-        return await bots[bot_name]["webhook"](request)
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"❌ Ошибка при обработке update: {e}")
+        data = await request.json()
+    except Exception:
+        raise HTTPException(status_code=400, detail="❌ Некорректный JSON")
+    if not isinstance(data, dict) or not isinstance(data.get("update_id"), int):
+        raise HTTPException(status_code=400, detail="❌ Это не update Telegram")
+
+    update_id = data["update_id"]
+    if recent_updates.is_duplicate(bot_name, update_id):
+        print(f"♻️ [{bot_name}] Повторная доставка update {update_id} — пропускаем")
+        return {"ok": True}
+
+    # Обработка — в фоне; при переполнении явный отказ, Telegram повторит позже
+    if not intakes[bot_name].submit(data):
+        print(f"⚠️ [{bot_name}] Очередь апдейтов заполнена, update {update_id} отклонён")
+        return JSONResponse(status_code=503, content={"ok": False, "error": "overloaded"},
+                            headers={"Retry-After": "5"})
+    recent_updates.add(bot_name, update_id)
+    return {"ok": True}
 
 if __name__ == "__main__":
     uvicorn.run("multi_app:app", host="0.0.0.0", port=8000, reload=False)
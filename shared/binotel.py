@@ -0,0 +1,343 @@
+# -*- coding: utf-8 -*-
+# Общий сервис загрузки исходящих звонков Binotel для bot1 и bot3.
+# Каждое получасовое окно скачивается один раз и хранится в одной папке
+# binotel/<date> в корне проекта (см. shared/callstore.py), оба бота читают
+# звонки отсюда сразу в DataFrame.
+import os
+import json
+import time
+import random
+import asyncio
+from pathlib import Path
+from datetime import date, datetime, timedelta
+from typing import Iterable
+
+import aiohttp
+import numpy as np
+import pandas as pd
+import pytz
+from dotenv import load_dotenv
+
+from shared.callstore import CallStore, calls_to_columns, merge_columns
+from shared.singleflight import jobs
+
+ROOT_DIR = Path(__file__).resolve().parent.parent
+load_dotenv(dotenv_path=ROOT_DIR / ".env")
+
+KYIV_TZ = pytz.timezone("Europe/Kyiv")
+BINOTEL_URL = "https://api.binotel.com/api/4.0/stats/outgoing-calls-for-period.json"
+WINDOW = timedelta(minutes=30)
+# Окно считается закрытым (sealed) через столько после конца: звонки,
+# начатые в последние минуты окна, попадают в API после завершения
+SEAL_GRACE = timedelta(minutes=5)
+
+
+def day_end(date_str: str) -> datetime:
+    return KYIV_TZ.localize(datetime.strptime(date_str, "%Y-%m-%d").replace(hour=23, minute=59))
+
+
+def window_filename(start: datetime, end: datetime) -> str:
+    return f"{start.strftime('%H_%M')}_{end.strftime('%H_%M')}.npz"
+
+
+def plan_windows(now_kyiv: datetime) -> list[tuple[datetime, datetime]]:
+    """Получасовые окна рабочего дня 07:30→22:00, начавшиеся до now_kyiv."""
+    start_of_interval = now_kyiv.replace(hour=7, minute=30, second=0, microsecond=0)
+    planned_end = now_kyiv.replace(hour=22, minute=0, second=0, microsecond=0)
+    if now_kyiv < start_of_interval:
+        return []
+
+    minute = (now_kyiv.minute // 30) * 30
+    last_interval_end = now_kyiv.replace(minute=minute, second=0, microsecond=0) + WINDOW
+    end_of_interval = min(planned_end, last_interval_end)
+
+    windows = []
+    current_start = start_of_interval
+    while current_start < end_of_interval:
+        windows.append((current_start, current_start + WINDOW))
+        current_start += WINDOW
+    return windows
+
+
+def call_details_dict(data: dict) -> dict:
+    call_details = data.get("callDetails") or {}
+    if isinstance(call_details, dict):
+        return call_details
+    return {str(c.get("generalCallID", "")): c for c in call_details}
+
+
+def store_response(store: CallStore, file_path: Path, body: bytes,
+                   tail_from: int | None, sealed: bool) -> int | None:
+    """Записывает ответ Binotel в окно; для хвостового запроса сливает звонки по generalCallID.
+
+    Возвращает число новых звонков или None, если Binotel вернул ошибку.
+    """
+    data = json.loads(body)
+    if data.get("status") != "success":
+        return None
+    columns = calls_to_columns(call_details_dict(data))
+
+    if tail_from is not None and file_path.exists():
+        old = store.read_window(file_path)
+        added = int((~np.isin(columns["call_id"], old["call_id"])).sum())
+        columns = merge_columns(old, columns)
+    else:
+        added = len(columns["call_id"])
+
+    store.write_window(file_path, columns, sealed)
+    return added
+
+
+class RateLimiter:
+    """Не больше rate запросов в секунду: старты запросов разносятся равномерно."""
+
+    def __init__(self, rate: float):
+        self.interval = 1.0 / rate if rate > 0 else 0.0
+        self.next_slot = 0.0
+        self.lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self.lock:
+            now = time.monotonic()
+            delay = self.next_slot - now
+            self.next_slot = max(now, self.next_slot) + self.interval
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+
+class BinotelIngestion:
+    def __init__(self, folder: Path, concurrency: int = 3, max_rps: float = 2.0, retries: int = 3,
+                 retention_days: int = 35):
+        self.folder = folder
+        self.retention_days = retention_days
+        self.store = CallStore(folder)
+        self.concurrency = concurrency
+        self.max_rps = max_rps
+        self.retries = retries
+        self.session: aiohttp.ClientSession | None = None
+        self.started = False
+        self.last_stats: dict = {}
+        # Когда последний раз за день докачали все окна без ошибок: {date: time.time()}
+        self.refreshed: dict[str, float] = {}
+        # Закрытые окна, про которые уже известно, что их не нужно читать с диска
+        self.sealed: set[Path] = set()
+
+    async def start(self):
+        self.folder.mkdir(parents=True, exist_ok=True)
+        await asyncio.to_thread(self._housekeeping, datetime.now(KYIV_TZ).strftime("%Y-%m-%d"))
+        self._get_session()
+        self.started = True
+
+    async def stop(self):
+        self.started = False
+        if self.session and not self.session.closed:
+            await self.session.close()
+        self.session = None
+
+    def _get_session(self) -> aiohttp.ClientSession:
+        # Один пул соединений на весь процесс, не больше concurrency одновременно
+        if self.session is None or self.session.closed:
+            self.session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=self.concurrency),
+                headers={"Content-Type": "application/json"},
+                timeout=aiohttp.ClientTimeout(total=30),
+            )
+        return self.session
+
+    def day_folder(self, date_str: str) -> Path:
+        return self.store.day_folder(date_str)
+
+    def _pending_days(self, date_str: str) -> list[str]:
+        """Прошедшие дни, окна которых ещё не сжаты (возможно, с незакрытым хвостом)."""
+        return [d for d in self.store.days() if d < date_str and self.day_folder(d).is_dir()]
+
+    def _housekeeping(self, date_str: str):
+        # Прошедшие дни сжимаем в один файл, когда все окна закрыты
+        # (или день старше вчерашнего — докачать его уже не получится)
+        yesterday = (datetime.strptime(date_str, "%Y-%m-%d").date() - timedelta(days=1)).isoformat()
+        for d in self._pending_days(date_str):
+            folder = self.day_folder(d)
+            all_sealed = all(
+                (self.store.read_meta(folder / window_filename(start, end)) or {}).get("sealed")
+                for start, end in plan_windows(day_end(d))
+            )
+            if all_sealed or d < yesterday:
+                if self.store.compact_day(d):
+                    print(f"🗜 Звонки за {d} сжаты в один файл")
+                self.sealed = {p for p in self.sealed if p.parent != folder}
+
+        keep_from = datetime.strptime(date_str, "%Y-%m-%d").date() - timedelta(days=self.retention_days)
+        for d in self.store.apply_retention(keep_from):
+            self.sealed = {p for p in self.sealed if p.parent != self.day_folder(d)}
+            print(f"🗑️ Удалены звонки за {d} (хранение {self.retention_days} дн.)")
+
+    def _plan_missing(self, day_folder: Path, windows: list[tuple[datetime, datetime]],
+                      now_kyiv: datetime) -> list[tuple]:
+        """Окна, которые нужно запросить: (start, end, filepath, tail_from, sealed).
+
+        tail_from=None — окна нет на диске, качаем целиком; иначе окно ещё не закрыто
+        и запрашиваются только звонки начиная с последнего виденного startTime.
+        """
+        missing = []
+        for start, end in windows:
+            filepath = day_folder / window_filename(start, end)
+            if filepath in self.sealed:
+                continue
+            sealed = now_kyiv >= end + SEAL_GRACE
+            meta = self.store.read_meta(filepath)
+            if meta is None:
+                missing.append((start, end, filepath, None, sealed))
+            elif meta["sealed"]:
+                self.sealed.add(filepath)
+                print(f"🔁 Уже скачано: {filepath.name}")
+            else:
+                missing.append((start, end, filepath, meta["last_start"] or int(start.timestamp()), sealed))
+        return missing
+
+    async def _fetch_window(self, semaphore: asyncio.Semaphore, limiter: RateLimiter,
+                            start: datetime, end: datetime, filepath: Path,
+                            tail_from: int | None, sealed: bool, credentials: dict) -> dict:
+        label = f"{start.strftime('%H:%M')}–{end.strftime('%H:%M')}"
+        if tail_from is not None:
+            label += f" (с {datetime.fromtimestamp(tail_from, KYIV_TZ).strftime('%H:%M:%S')})"
+        payload = {
+            "startTime": tail_from if tail_from is not None else int(start.timestamp()),
+            "stopTime": int(end.timestamp()),
+            **credentials
+        }
+        result = {"window": label, "ok": False, "attempts": 0, "seconds": 0.0, "new_calls": 0}
+        started = time.monotonic()
+
+        async with semaphore:
+            for attempt in range(1, self.retries + 1):
+                result["attempts"] = attempt
+                await limiter.acquire()
+                try:
+                    async with self._get_session().post(BINOTEL_URL, json=payload) as response:
+                        if response.status == 200:
+                            # Разбор ответа (~800 КБ) и запись на диск — вне event loop
+                            body = await response.read()
+                            added = await asyncio.to_thread(
+                                store_response, self.store, filepath, body, tail_from, sealed
+                            )
+                            if added is not None:
+                                result["ok"] = True
+                                result["new_calls"] = added
+                                result["bytes"] = len(body)
+                                if sealed:
+                                    self.sealed.add(filepath)
+                                break
+                            print(f"❌ {label} — Binotel вернул ошибку (попытка {attempt})")
+                        else:
+                            print(f"❌ {label} — Ошибка HTTP {response.status} (попытка {attempt})")
+                            if response.status < 500 and response.status != 429:
+                                break
+                except Exception as e:
+                    print(f"❌ {label} — Ошибка запроса: {e!r} (попытка {attempt})")
+
+                if attempt < self.retries:
+                    await asyncio.sleep(2 ** (attempt - 1) + random.random())
+
+        result["seconds"] = time.monotonic() - started
+        status = "✅" if result["ok"] else "❌"
+        print(f"📡 {label} — {status} за {result['seconds']:.2f} с (попыток: {result['attempts']}, "
+              f"новых звонков: {result['new_calls']})")
+        return result
+
+    async def refresh(self) -> str | None:
+        """
+        Докачивает недостающие окна 07:30→сейчас за сегодня, возвращает дату папки или None.
+        Одновременные вызовы (bot1, bot3, планировщик) ждут одну и ту же загрузку.
+        """
+        date_str = datetime.now(KYIV_TZ).strftime("%Y-%m-%d")
+        return await jobs.run(("binotel_refresh", date_str), self._refresh)
+
+    def fresh(self, max_age: float) -> str | None:
+        """Дата сегодняшней папки, если её полностью докачали не раньше max_age секунд назад."""
+        date_str = datetime.now(KYIV_TZ).strftime("%Y-%m-%d")
+        refreshed = self.refreshed.get(date_str)
+        if refreshed is None or time.time() - refreshed > max_age:
+            return None
+        return date_str
+
+    async def _refresh(self) -> str | None:
+        api_key = os.getenv("BINOTEL_API_KEY")
+        api_secret = os.getenv("BINOTEL_API_SECRET")
+        if not api_key or not api_secret:
+            print("❌ Не заданы ключи BINOTEL_API_KEY или BINOTEL_API_SECRET")
+            return None
+
+        now_kyiv = datetime.now(KYIV_TZ)
+        date_str = now_kyiv.strftime("%Y-%m-%d")
+        day_folder = self.day_folder(date_str)
+        await asyncio.to_thread(day_folder.mkdir, parents=True, exist_ok=True)
+
+        # Сегодняшние окна плюс незакрытые хвосты прошедших дней
+        windows = plan_windows(now_kyiv)
+        plan = [(day_folder, windows)]
+        for d in await asyncio.to_thread(self._pending_days, date_str):
+            plan.append((self.day_folder(d), plan_windows(day_end(d))))
+
+        started = time.monotonic()
+        missing = []
+        for folder, folder_windows in plan:
+            missing += await asyncio.to_thread(self._plan_missing, folder, folder_windows, now_kyiv)
+        windows_total = sum(len(w) for _, w in plan)
+
+        credentials = {"key": api_key, "secret": api_secret}
+        semaphore = asyncio.Semaphore(self.concurrency)
+        limiter = RateLimiter(self.max_rps)
+        results = await asyncio.gather(*(
+            self._fetch_window(semaphore, limiter, start, end, filepath, tail_from, sealed, credentials)
+            for start, end, filepath, tail_from, sealed in missing
+        ))
+
+        await asyncio.to_thread(self._housekeeping, date_str)
+
+        self.last_stats = {
+            "windows": windows_total,
+            "cached": windows_total - len(missing),
+            "fetched": sum(1 for r in results if r["ok"]),
+            "tail": sum(1 for _, _, _, tail_from, _ in missing if tail_from is not None),
+            "bytes": sum(r.get("bytes", 0) for r in results),
+            "failed": [r["window"] for r in results if not r["ok"]],
+            "seconds": time.monotonic() - started,
+            "per_window": results,
+        }
+        print(f"📊 Binotel: окон {windows_total}, из кэша {self.last_stats['cached']}, "
+              f"скачано {self.last_stats['fetched']} (хвостов {self.last_stats['tail']}), "
+              f"ошибок {len(self.last_stats['failed'])}, {self.last_stats['bytes'] / 1024:.0f} КБ, "
+              f"за {self.last_stats['seconds']:.1f} с")
+
+        if not windows:
+            print("⚠️ Ещё не наступило время для запросов (до 07:30)")
+            return None
+        if not self.last_stats["failed"]:
+            self.refreshed = {date_str: time.time()}
+        return date_str
+
+    def load_day(self, date_str: str) -> pd.DataFrame:
+        """Все звонки дня (синхронно, из корутин — через asyncio.to_thread)."""
+        return self.store.load_day(date_str)
+
+    def query(self, start: date, end: date, employees: Iterable[str] | None = None) -> pd.DataFrame:
+        """История звонков за несколько дней без обращения к API (синхронно)."""
+        return self.store.query(start, end, employees)
+
+    def version(self, start: date, end: date) -> tuple:
+        """Версия звонков за даты start..end — ключ для кэша готовых отчётов."""
+        return self.store.version(start, end)
+
+    def stats(self, start: date, end: date, until: int | None = None) -> list[dict]:
+        """Готовые агрегаты по сотрудникам за даты start..end для merge_aggregates (синхронно)."""
+        return self.store.stats(start, end, until)
+
+
+# Единственный экземпляр, запускается из multi_app.py
+ingestion = BinotelIngestion(
+    ROOT_DIR / os.getenv("BINOTEL_FOLDER", "binotel"),
+    concurrency=int(os.getenv("BINOTEL_CONCURRENCY", "3")),
+    max_rps=float(os.getenv("BINOTEL_MAX_RPS", "2")),
+    retries=int(os.getenv("BINOTEL_RETRIES", "3")),
+    retention_days=int(os.getenv("BINOTEL_RETENTION_DAYS", "35")),
+)
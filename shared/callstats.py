@@ -0,0 +1,108 @@
+# -*- coding: utf-8 -*-
+# Готовые агрегаты звонков по сотрудникам: считаются при записи каждого окна
+# Binotel и хранятся рядом с хранилищем (binotel/<date>.stats.json), поэтому
+# отчёт — это проход по сотрудникам, а не по всем звонкам дня.
+from typing import Callable, Iterable
+
+import pandas as pd
+
+from shared.sessions import work_sessions, union_sessions
+
+# Профили рабочих сессий: пауза между звонками (с) и округление времени звонка (с)
+SESSION_PROFILES = {
+    "hour": (3600, 1),     # bot1: активные часы, пауза до часа
+    "80min": (4800, 60),   # bot3: скорость, пауза до 80 минут, время до минуты
+}
+SUM_FIELDS = ("total", "cancel", "zero", "wait", "talk")
+
+
+def window_aggregates(calls: pd.DataFrame) -> dict[str, dict]:
+    """Агрегаты одного окна (или дня) по каждому сотруднику, calls — из columns_to_frame."""
+    if calls.empty:
+        return {}
+    frame = pd.DataFrame({
+        "employee": calls["employee"].astype(str),
+        "start": calls["start"],
+        "billsec": calls["billsec"],
+        "waitsec": calls["waitsec"],
+        "cancel": calls["disposition"].astype(str).str.upper() == "CANCEL",
+        "zero": calls["billsec"] == 0,
+    })
+
+    agg = frame.groupby("employee").agg(
+        total=("start", "size"),
+        cancel=("cancel", "sum"),
+        zero=("zero", "sum"),
+        wait=("waitsec", "sum"),
+        talk=("billsec", "sum"),
+        first=("start", "min"),
+        last=("start", "max"),
+    )
+    result = {
+        employee: {name: int(value) for name, value in row.items()} | {"sessions": {}}
+        for employee, row in agg.to_dict("index").items()
+    }
+    for profile, (gap, step) in SESSION_PROFILES.items():
+        sessions = work_sessions(frame["employee"], frame["start"] // step * step, gap)
+        for employee, start, end in zip(sessions["key"], sessions["start"], sessions["end"]):
+            result[employee]["sessions"].setdefault(profile, []).append([int(start), int(end)])
+    return result
+
+
+def merge_aggregates(parts: Iterable[dict[str, dict]],
+                     key_of: Callable[[str], str | None] = lambda employee: employee) -> dict[str, dict]:
+    """
+    Сливает агрегаты окон/дней; key_of группирует сотрудников (например, по инициалам),
+    None — сотрудник пропускается.
+    """
+    merged = {}
+    for part in parts:
+        for employee, stats in part.items():
+            key = key_of(employee)
+            if key is None:
+                continue
+            target = merged.get(key)
+            if target is None:
+                merged[key] = {
+                    **{name: stats[name] for name in SUM_FIELDS},
+                    "first": stats["first"],
+                    "last": stats["last"],
+                    "sessions": {p: list(s) for p, s in stats["sessions"].items()},
+                }
+                continue
+            for name in SUM_FIELDS:
+                target[name] += stats[name]
+            target["first"] = min(target["first"], stats["first"])
+            target["last"] = max(target["last"], stats["last"])
+            for profile, sessions in stats["sessions"].items():
+                target["sessions"].setdefault(profile, []).extend(sessions)
+
+    for stats in merged.values():
+        for profile, sessions in stats["sessions"].items():
+            stats["sessions"][profile] = union_sessions(sessions, SESSION_PROFILES[profile][0])
+    return merged
+
+
+def stats_frame(merged: dict[str, dict], profile: str) -> pd.DataFrame:
+    """
+    Таблица по ключам (отсортирована): total, cancel, zero, wait, talk, first_call,
+    last_call (киевское время без tz), sessions, active_seconds для профиля сессий.
+    """
+    rows = {
+        key: {
+            **{name: stats[name] for name in SUM_FIELDS},
+            "first": stats["first"],
+            "last": stats["last"],
+            "sessions": len(stats["sessions"].get(profile, [])),
+            "active_seconds": sum(end - start for start, end in stats["sessions"].get(profile, [])),
+        }
+        for key, stats in merged.items()
+    }
+    columns = list(SUM_FIELDS) + ["first", "last", "sessions", "active_seconds"]
+    frame = pd.DataFrame.from_dict(rows, orient="index", columns=columns).sort_index()
+    for name, column in (("first", "first_call"), ("last", "last_call")):
+        frame[column] = (
+            pd.to_datetime(frame.pop(name), unit="s", utc=True)
+            .dt.tz_convert("Europe/Kyiv").dt.tz_localize(None)
+        )
+    return frame
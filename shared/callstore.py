@@ -0,0 +1,334 @@
+# -*- coding: utf-8 -*-
+# Компактное колоночное хранилище звонков Binotel.
+# Одно получасовое окно = один .npz с типизированными колонками:
+# целые epoch-секунды, категориальные имена сотрудников и статусы,
+# int billsec/waitsec. Боты читают день сразу в DataFrame без CSV.
+#
+# Раскладка на диске:
+#   <folder>/<YYYY-MM-DD>/<HH_MM>_<HH_MM>.npz — окна текущего (незакрытого) дня
+#   <folder>/<YYYY-MM-DD>.npz                 — прошедший день, сжатый в один файл
+#   <folder>/<YYYY-MM-DD>.stats.json          — агрегаты по сотрудникам для каждого окна
+import io
+import os
+import json
+import shutil
+import threading
+from pathlib import Path
+from datetime import date, datetime, timedelta
+from typing import Iterable
+
+import numpy as np
+import pandas as pd
+import pytz
+
+from shared.callstats import window_aggregates
+
+KYIV_TZ = pytz.timezone("Europe/Kyiv")
+
+# Колонки звонка и их типы на диске
+NUMERIC_COLUMNS = {
+    "call_id": np.int64,
+    "start": np.int64,
+    "billsec": np.int32,
+    "waitsec": np.int32,
+}
+CATEGORY_COLUMNS = ("employee", "disposition")
+# Ключ агрегатов, посчитанных по сжатому дню целиком
+DAY_KEY = "day"
+
+
+def _to_int(value) -> int:
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return 0
+
+
+def calls_to_columns(call_details: dict) -> dict[str, np.ndarray]:
+    """Сырые callDetails Binotel → словарь колонок (категории как codes + names)."""
+    calls = list(call_details.values())
+    columns = {
+        "call_id": np.fromiter((_to_int(c.get("generalCallID")) for c in calls), np.int64, len(calls)),
+        "start": np.fromiter((_to_int(c.get("startTime")) for c in calls), np.int64, len(calls)),
+        "billsec": np.fromiter((_to_int(c.get("billsec")) for c in calls), np.int32, len(calls)),
+        "waitsec": np.fromiter((_to_int(c.get("waitsec")) for c in calls), np.int32, len(calls)),
+    }
+    employees = []
+    for c in calls:
+        employee_data = c.get("employeeData", {})
+        employees.append(employee_data.get("name", "") if isinstance(employee_data, dict) else "")
+    _set_category(columns, "employee", employees)
+    _set_category(columns, "disposition", [str(c.get("disposition", "")) for c in calls])
+    return columns
+
+
+def _set_category(columns: dict, name: str, values):
+    cat = pd.Categorical(values)
+    columns[f"{name}_codes"] = cat.codes.astype(np.int32)
+    columns[f"{name}_names"] = np.asarray(cat.categories, dtype=str)
+
+
+def _category_values(columns: dict, name: str) -> np.ndarray:
+    names = columns[f"{name}_names"]
+    codes = columns[f"{name}_codes"]
+    if len(names) == 0:
+        return np.array([""] * len(codes), dtype=str)
+    return names[codes]
+
+
+def merge_columns(old: dict, new: dict) -> dict:
+    """Объединяет два окна по call_id, при совпадении побеждает новая запись."""
+    merged = {name: np.concatenate([old[name], new[name]]) for name in NUMERIC_COLUMNS}
+    for name in CATEGORY_COLUMNS:
+        values = np.concatenate([_category_values(old, name), _category_values(new, name)])
+        _set_category(merged, name, values)
+
+    # Последнее вхождение каждого call_id
+    _, first_in_reversed = np.unique(merged["call_id"][::-1], return_index=True)
+    keep = np.sort(len(merged["call_id"]) - 1 - first_in_reversed)
+    result = {name: merged[name][keep] for name in NUMERIC_COLUMNS}
+    for name in CATEGORY_COLUMNS:
+        _set_category(result, name, _category_values(merged, name)[keep])
+    return result
+
+
+def concat_columns(parts: list[dict]) -> dict:
+    merged = {name: np.concatenate([p[name] for p in parts]) for name in NUMERIC_COLUMNS}
+    for name in CATEGORY_COLUMNS:
+        _set_category(merged, name, np.concatenate([_category_values(p, name) for p in parts]))
+    return merged
+
+
+def columns_to_frame(columns: dict) -> pd.DataFrame:
+    df = pd.DataFrame({name: columns[name] for name in NUMERIC_COLUMNS})
+    for name in CATEGORY_COLUMNS:
+        df[name] = pd.Categorical.from_codes(columns[f"{name}_codes"], categories=columns[f"{name}_names"])
+    # Время звонка по Киеву без tz — так его показывают отчёты
+    df["call_dt"] = (
+        pd.to_datetime(df["start"], unit="s", utc=True).dt.tz_convert(KYIV_TZ).dt.tz_localize(None)
+    )
+    return df
+
+
+def empty_frame() -> pd.DataFrame:
+    return columns_to_frame(calls_to_columns({}))
+
+
+def _window_bounds(date_str: str, name: str) -> tuple[int, int]:
+    """Границы окна "HH_MM_HH_MM" (или всего дня) в epoch-секундах."""
+    day = datetime.strptime(date_str, "%Y-%m-%d")
+    if name == DAY_KEY:
+        start, end = day, day + timedelta(days=1)
+    else:
+        h1, m1, h2, m2 = map(int, name.split("_"))
+        start, end = day.replace(hour=h1, minute=m1), day.replace(hour=h2, minute=m2)
+    return int(KYIV_TZ.localize(start).timestamp()), int(KYIV_TZ.localize(end).timestamp())
+
+
+class CallStore:
+    def __init__(self, folder: Path):
+        self.folder = folder
+        # date -> {окно: агрегаты по сотрудникам}, пишется из потоков загрузки
+        self._stats: dict[str, dict[str, dict]] = {}
+        self._stats_lock = threading.Lock()
+        # date -> номер версии агрегатов, растёт при каждом изменении данных дня
+        self._versions: dict[str, int] = {}
+
+    def day_folder(self, date_str: str) -> Path:
+        return self.folder / date_str
+
+    def day_path(self, date_str: str) -> Path:
+        return self.folder / f"{date_str}.npz"
+
+    def stats_path(self, date_str: str) -> Path:
+        return self.folder / f"{date_str}.stats.json"
+
+    def is_compacted(self, date_str: str) -> bool:
+        return self.day_path(date_str).exists()
+
+    def days(self) -> list[str]:
+        """Даты, за которые есть звонки (окна или сжатый день)."""
+        if not self.folder.exists():
+            return []
+        found = set()
+        for path in self.folder.iterdir():
+            name = path.stem if path.suffix == ".npz" else path.name
+            try:
+                datetime.strptime(name, "%Y-%m-%d")
+            except ValueError:
+                continue
+            found.add(name)
+        return sorted(found)
+
+    def read_meta(self, path: Path) -> dict | None:
+        """sealed/last_start окна без чтения колонок, None — окна нет или оно битое."""
+        if not path.exists():
+            return None
+        try:
+            with np.load(path, allow_pickle=False) as npz:
+                return {"sealed": bool(npz["sealed"]), "last_start": int(npz["last_start"])}
+        except Exception:
+            print(f"⚠️ Повреждённый файл {path.name}, перезапрашиваем...")
+            return None
+
+    def read_window(self, path: Path) -> dict:
+        with np.load(path, allow_pickle=False) as npz:
+            return {name: npz[name] for name in npz.files}
+
+    def write_window(self, path: Path, columns: dict, sealed: bool):
+        """Записывает окно и сразу обновляет агрегаты дня по этому окну."""
+        self._save_npz(path, columns, sealed)
+        date_str = path.parent.name
+        window_stats = window_aggregates(columns_to_frame(columns))
+        with self._stats_lock:
+            windows = self._window_stats(date_str)
+            if windows.get(path.stem) == window_stats:
+                return
+            windows[path.stem] = window_stats
+            self._versions[date_str] = self._versions.get(date_str, 0) + 1
+            self._save_stats(date_str)
+
+    def _save_npz(self, path: Path, columns: dict, sealed: bool):
+        last_start = int(columns["start"].max()) if len(columns["start"]) else 0
+        buffer = io.BytesIO()
+        np.savez_compressed(buffer, sealed=np.bool_(sealed), last_start=np.int64(last_start), **columns)
+        # Атомарная замена: читатель видит либо старое, либо новое окно целиком
+        tmp_path = path.with_suffix(".tmp")
+        tmp_path.write_bytes(buffer.getvalue())
+        os.replace(tmp_path, path)
+
+    def _read_day_columns(self, date_str: str) -> dict | None:
+        if self.is_compacted(date_str):
+            return self.read_window(self.day_path(date_str))
+
+        windows = []
+        for path in sorted(self.day_folder(date_str).glob("*.npz")):
+            try:
+                windows.append(self.read_window(path))
+            except Exception as e:
+                print(f"⚠️ Ошибка чтения {path.name}: {e}")
+        return concat_columns(windows) if windows else None
+
+    def load_day(self, date_str: str) -> pd.DataFrame:
+        """Все звонки дня одним DataFrame (синхронно, из корутин — через asyncio.to_thread)."""
+        columns = self._read_day_columns(date_str)
+        return columns_to_frame(columns) if columns is not None else empty_frame()
+
+    def query(self, start: date, end: date, employees: Iterable[str] | None = None) -> pd.DataFrame:
+        """Звонки за даты start..end включительно, при необходимости только указанных сотрудников."""
+        parts = []
+        day = start
+        while day <= end:
+            columns = self._read_day_columns(day.isoformat())
+            if columns is not None:
+                parts.append(columns)
+            day += timedelta(days=1)
+        if not parts:
+            return empty_frame()
+
+        df = columns_to_frame(concat_columns(parts))
+        if employees is not None:
+            df = df[df["employee"].isin(list(employees))].reset_index(drop=True)
+            df["employee"] = df["employee"].cat.remove_unused_categories()
+        return df
+
+    def compact_day(self, date_str: str) -> bool:
+        """Сливает окна прошедшего дня в один файл <date>.npz и удаляет папку окон."""
+        folder = self.day_folder(date_str)
+        if not folder.is_dir():
+            return False
+        windows = [self.read_window(path) for path in sorted(folder.glob("*.npz"))]
+        if windows:
+            self._save_npz(self.day_path(date_str), concat_columns(windows), sealed=True)
+        shutil.rmtree(folder)
+        return bool(windows)
+
+    def apply_retention(self, keep_from: date) -> list[str]:
+        """Удаляет дни раньше keep_from, возвращает удалённые даты."""
+        removed = []
+        for date_str in self.days():
+            if date_str >= keep_from.isoformat():
+                continue
+            if self.is_compacted(date_str):
+                self.day_path(date_str).unlink()
+            if self.day_folder(date_str).is_dir():
+                shutil.rmtree(self.day_folder(date_str))
+            self.stats_path(date_str).unlink(missing_ok=True)
+            with self._stats_lock:
+                self._stats.pop(date_str, None)
+                self._versions[date_str] = self._versions.get(date_str, 0) + 1
+            removed.append(date_str)
+        return removed
+
+    # === Агрегаты по сотрудникам ===
+    def _window_stats(self, date_str: str) -> dict[str, dict]:
+        """Агрегаты окон дня из памяти/диска; недостающие окна досчитываются. Под _stats_lock."""
+        if date_str in self._stats:
+            return self._stats[date_str]
+
+        stats = {}
+        path = self.stats_path(date_str)
+        if path.exists():
+            try:
+                stats = json.loads(path.read_text(encoding="utf-8"))
+            except Exception as e:
+                print(f"⚠️ Повреждённый файл {path.name}, пересчитываем: {e}")
+
+        changed = False
+        if self.is_compacted(date_str):
+            if not stats:
+                stats[DAY_KEY] = window_aggregates(self.load_day(date_str))
+                changed = True
+        else:
+            for window_path in sorted(self.day_folder(date_str).glob("*.npz")):
+                if window_path.stem not in stats:
+                    stats[window_path.stem] = window_aggregates(columns_to_frame(self.read_window(window_path)))
+                    changed = True
+
+        self._stats[date_str] = stats
+        if changed:
+            self._save_stats(date_str)
+        return stats
+
+    def _save_stats(self, date_str: str):
+        tmp_path = self.stats_path(date_str).with_suffix(".tmp")
+        tmp_path.write_text(json.dumps(self._stats[date_str], ensure_ascii=False), encoding="utf-8")
+        os.replace(tmp_path, self.stats_path(date_str))
+
+    def _partial_window_stats(self, date_str: str, name: str, start: int, until: int) -> dict:
+        window_path = self.day_folder(date_str) / f"{name}.npz"
+        columns = self.read_window(window_path) if window_path.exists() else self._read_day_columns(date_str)
+        calls = columns_to_frame(columns)
+        return window_aggregates(calls[(calls["start"] >= start) & (calls["start"] < until)])
+
+    def day_stats(self, date_str: str, until: int | None = None) -> list[dict]:
+        """
+        Агрегаты окон дня для merge_aggregates; until (epoch) — только звонки до этого момента,
+        окно на границе досчитывается по сырым звонкам.
+        """
+        with self._stats_lock:
+            windows = dict(self._window_stats(date_str))
+        parts = []
+        for name, stats in windows.items():
+            start, end = _window_bounds(date_str, name)
+            if until is None or end <= until:
+                parts.append(stats)
+            elif start < until:
+                parts.append(self._partial_window_stats(date_str, name, start, until))
+        return parts
+
+    def version(self, start: date, end: date) -> tuple:
+        """Версия данных за даты start..end: меняется, только когда меняются агрегаты."""
+        return tuple(
+            self._versions.get((start + timedelta(days=i)).isoformat(), 0)
+            for i in range((end - start).days + 1)
+        )
+
+    def stats(self, start: date, end: date, until: int | None = None) -> list[dict]:
+        """Агрегаты за даты start..end включительно (синхронно)."""
+        parts = []
+        day = start
+        while day <= end:
+            parts += self.day_stats(day.isoformat(), until)
+            day += timedelta(days=1)
+        return parts
@@ -0,0 +1,331 @@
+# -*- coding: utf-8 -*-
+# Общая доставка сообщений Telegram для всех ботов.
+# Лимиты: token bucket на токен бота (общий бюджет) и на каждый чат,
+# RetryAfter — пауза только для этого чата, срочные сообщения (алерты в канал
+# ошибок) уходят раньше массовых рассылок. Неотправленное пишется в журнал
+# outbox.jsonl и досылается после перезапуска. Журнал дописывается пачками
+# из фоновой задачи (не в event loop) и сжимается до неотправленного, когда разрастается.
+import os
+import json
+import time
+import asyncio
+import logging
+import itertools
+from collections import deque
+from pathlib import Path
+from typing import Awaitable, Callable
+
+ROOT_DIR = Path(__file__).resolve().parent.parent
+
+# Ошибки сети — повторяем, остальные (BadRequest, Forbidden, ChatNotFound...) — нет
+TRANSIENT_ERRORS = {"NetworkError", "TimedOut", "TimeoutError", "ClientConnectorError",
+                    "ServerDisconnectedError", "ClientOSError"}
+MAX_ATTEMPTS = 5
+# Пауза для сбора пачки записей журнала и размер, после которого журнал сжимается
+JOURNAL_DELAY = 0.5
+JOURNAL_COMPACT_LINES = 2000
+
+
+class TokenBucket:
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, now: float) -> float:
+        """Сколько секунд ждать до следующего токена."""
+        self._refill(now)
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def take(self, now: float):
+        self._refill(now)
+        self.tokens -= 1
+
+
+def normalize_chat_id(chat_id: int | str) -> int | str:
+    """"-100123" и -100123 — один чат (общие очередь и лимит); @username остаётся строкой."""
+    try:
+        return int(chat_id)
+    except (TypeError, ValueError):
+        return chat_id
+
+
+def retry_after_seconds(error: Exception) -> float | None:
+    """RetryAfter aiogram (timeout) и python-telegram-bot (retry_after) без импорта обоих."""
+    if type(error).__name__ != "RetryAfter":
+        return None
+    value = getattr(error, "retry_after", None) or getattr(error, "timeout", None) or 1
+    return value.total_seconds() if hasattr(value, "total_seconds") else float(value)
+
+
+class _BotLane:
+    """Очереди одного бота: по чату FIFO, между чатами — срочные первыми."""
+
+    def __init__(self, name: str, delivery: "TelegramDelivery"):
+        self.name = name
+        self.delivery = delivery
+        self.send_func: Callable[..., Awaitable] | None = None
+        self.bucket = TokenBucket(delivery.global_rate, delivery.global_rate)
+        self.chats: dict[int | str, deque] = {}
+        self.chat_buckets: dict[int | str, TokenBucket] = {}
+        self.retry_until: dict[int | str, float] = {}
+        self.busy: set = set()
+        self.wakeup = asyncio.Event()
+        self.task: asyncio.Task | None = None
+        self.inflight: set[asyncio.Task] = set()
+
+    def pending(self) -> int:
+        return sum(len(q) for q in self.chats.values()) + len(self.busy)
+
+    def put(self, job: dict):
+        self.chats.setdefault(job["chat_id"], deque()).append(job)
+        self.wakeup.set()
+
+    def _chat_bucket(self, chat_id) -> TokenBucket:
+        bucket = self.chat_buckets.get(chat_id)
+        if bucket is None:
+            # Группы и каналы (отрицательный id) — около 20 сообщений в минуту
+            if str(chat_id).startswith("-"):
+                bucket = TokenBucket(self.delivery.group_rate, self.delivery.group_burst)
+            else:
+                bucket = TokenBucket(self.delivery.chat_rate, 1)
+            self.chat_buckets[chat_id] = bucket
+        return bucket
+
+    async def _next_chat(self):
+        while True:
+            now = time.monotonic()
+            ready, next_wait = [], None
+            for chat_id, queue in self.chats.items():
+                if not queue or chat_id in self.busy:
+                    continue
+                wait = max(self._chat_bucket(chat_id).wait_time(now), self.retry_until.get(chat_id, 0) - now)
+                if wait <= 0:
+                    ready.append((not queue[0]["urgent"], queue[0]["seq"], chat_id))
+                elif next_wait is None or wait < next_wait:
+                    next_wait = wait
+            if ready:
+                return min(ready)[2]
+
+            self.wakeup.clear()
+            try:
+                await asyncio.wait_for(self.wakeup.wait(), timeout=next_wait)
+            except asyncio.TimeoutError:
+                pass
+
+    async def run(self):
+        while True:
+            chat_id = await self._next_chat()
+            wait = self.bucket.wait_time(time.monotonic())
+            if wait > 0:
+                await asyncio.sleep(wait)
+            now = time.monotonic()
+            self.bucket.take(now)
+            self._chat_bucket(chat_id).take(now)
+
+            job = self.chats[chat_id].popleft()
+            self.busy.add(chat_id)
+            task = asyncio.create_task(self._deliver(job))
+            self.inflight.add(task)
+            task.add_done_callback(self.inflight.discard)
+
+    async def _deliver(self, job: dict):
+        chat_id = job["chat_id"]
+        try:
+            await self.send_func(chat_id=chat_id, text=job["text"], parse_mode=job["parse_mode"], **job["kwargs"])
+            self.delivery._journal({"op": "done", "id": job["id"]})
+        except Exception as e:
+            retry_after = retry_after_seconds(e)
+            job["attempts"] += 1
+            if retry_after is not None:
+                # Flood control: чат ждёт сколько сказал Telegram, остальные чаты идут дальше
+                logging.warning(f"⏳ [{self.name}] RetryAfter {retry_after:.0f} с для {chat_id}")
+                self.retry_until[chat_id] = time.monotonic() + retry_after
+                self.chats[chat_id].appendleft(job)
+            elif type(e).__name__ in TRANSIENT_ERRORS and job["attempts"] < MAX_ATTEMPTS:
+                self.retry_until[chat_id] = time.monotonic() + 2 ** job["attempts"]
+                self.chats[chat_id].appendleft(job)
+            else:
+                # send() давно вернулся — об отказе (бот заблокирован, чат не найден) сообщаем здесь
+                label = f" ({job['label']})" if job.get("label") else ""
+                logging.error(f"❌ [{self.name}] Не доставлено в {chat_id}{label}: {e}")
+                self.delivery._journal({"op": "done", "id": job["id"]})
+        finally:
+            self.busy.discard(chat_id)
+            self.wakeup.set()
+
+
+class TelegramDelivery:
+    def __init__(self, journal_path: Path, global_rate: float = 25.0, chat_rate: float = 1.0,
+                 group_per_minute: float = 20.0, group_burst: float = 3.0):
+        self.journal_path = journal_path
+        self.global_rate = global_rate
+        self.chat_rate = chat_rate
+        self.group_rate = group_per_minute / 60
+        self.group_burst = group_burst
+        self.lanes: dict[str, _BotLane] = {}
+        self._seq = itertools.count()
+        # Неотправленные сообщения (то, что останется в журнале после сжатия)
+        self.unsent: dict[str, dict] = {}
+        self._journal_buffer: list[str] = []
+        self._journal_lines = 0
+        self._journal_wakeup = asyncio.Event()
+        self._journal_task: asyncio.Task | None = None
+        self._journal_closing = False
+
+    def _lane(self, bot_name: str) -> _BotLane:
+        if bot_name not in self.lanes:
+            self.lanes[bot_name] = _BotLane(bot_name, self)
+        return self.lanes[bot_name]
+
+    def _journal(self, record: dict):
+        if self._journal_task is None:
+            return
+        if record["op"] == "add":
+            self.unsent[record["job"]["id"]] = record["job"]
+        else:
+            self.unsent.pop(record["id"], None)
+        self._journal_buffer.append(json.dumps(record, ensure_ascii=False) + "\n")
+        self._journal_wakeup.set()
+
+    def _append(self, lines: list[str]):
+        with self.journal_path.open("a", encoding="utf-8") as f:
+            f.writelines(lines)
+            f.flush()
+
+    def _rewrite(self, lines: list[str]):
+        tmp_path = self.journal_path.with_suffix(".tmp")
+        with tmp_path.open("w", encoding="utf-8") as f:
+            f.writelines(lines)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.journal_path)
+
+    async def _flush_journal(self, compact: bool = False):
+        lines, self._journal_buffer = self._journal_buffer, []
+        if lines:
+            try:
+                await asyncio.to_thread(self._append, lines)
+                self._journal_lines += len(lines)
+            except Exception as e:
+                logging.error(f"❌ Ошибка записи журнала доставки: {e}")
+                self._journal_buffer = lines + self._journal_buffer
+                return
+        # Журнал растёт на две строки за сообщение — оставляем в нём только неотправленное
+        if compact or self._journal_lines > max(JOURNAL_COMPACT_LINES, 4 * len(self.unsent)):
+            snapshot = [json.dumps({"op": "add", "job": job}, ensure_ascii=False) + "\n"
+                        for job in self.unsent.values()]
+            try:
+                await asyncio.to_thread(self._rewrite, snapshot)
+                self._journal_lines = len(snapshot)
+            except Exception as e:
+                logging.error(f"❌ Ошибка сжатия журнала доставки: {e}")
+
+    async def _journal_writer(self):
+        # Единственный писатель файла журнала: дозапись и сжатие не пересекаются
+        while True:
+            await self._journal_wakeup.wait()
+            await asyncio.sleep(JOURNAL_DELAY)
+            self._journal_wakeup.clear()
+            # При остановке — последняя дозапись и сжатие до неотправленного
+            await self._flush_journal(compact=self._journal_closing)
+            if self._journal_closing:
+                return
+
+    def _restore(self) -> list[dict]:
+        """Неотправленные сообщения из журнала; журнал переписывается только с ними."""
+        pending = {}
+        if self.journal_path.exists():
+            with self.journal_path.open(encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except json.JSONDecodeError:
+                        continue
+                    if record.get("op") == "add":
+                        pending[record["job"]["id"]] = record["job"]
+                    elif record.get("op") == "done":
+                        pending.pop(record.get("id"), None)
+
+        self._rewrite([json.dumps({"op": "add", "job": job}, ensure_ascii=False) + "\n"
+                       for job in pending.values()])
+        return list(pending.values())
+
+    async def start(self):
+        self.journal_path.parent.mkdir(parents=True, exist_ok=True)
+        restored = await asyncio.to_thread(self._restore)
+        self.unsent = {job["id"]: job for job in restored}
+        self._journal_lines = len(restored)
+        self._journal_task = asyncio.create_task(self._journal_writer())
+        for job in restored:
+            job["chat_id"] = normalize_chat_id(job["chat_id"])
+            job["seq"] = next(self._seq)
+            self._lane(job["bot"]).put(job)
+        if restored:
+            print(f"📬 Восстановлено неотправленных сообщений: {len(restored)}")
+
+    def register(self, bot_name: str, send_func: Callable[..., Awaitable]):
+        """send_func(chat_id=, text=, parse_mode=, **kwargs) — send_message конкретного бота."""
+        lane = self._lane(bot_name)
+        lane.send_func = send_func
+        if lane.task is None:
+            lane.task = asyncio.create_task(lane.run())
+
+    async def send(self, bot_name: str, chat_id: int | str, text: str, parse_mode: str | None = None,
+                   urgent: bool = False, label: str | None = None, **kwargs):
+        """
+        Ставит сообщение в очередь и сразу возвращается; ошибки отправки пишутся в лог
+        вместе с label (кому/что отправляли). urgent — алерты, обгоняют массовые рассылки.
+        kwargs уходят в журнал на диске, поэтому допустимы только JSON-значения
+        (disable_web_page_preview и т.п.); сообщения с клавиатурой отправляйте напрямую.
+        """
+        try:
+            json.dumps(kwargs)
+        except (TypeError, ValueError) as e:
+            raise TypeError(f"delivery.send: параметры {sorted(kwargs)} не сохраняются в журнал: {e}") from e
+        job = {
+            "id": f"{time.time_ns()}-{next(self._seq)}",
+            "bot": bot_name,
+            "chat_id": normalize_chat_id(chat_id),
+            "text": text,
+            "parse_mode": str(parse_mode) if parse_mode is not None else None,
+            "urgent": urgent,
+            "kwargs": kwargs,
+            "label": label,
+            "attempts": 0,
+        }
+        self._journal({"op": "add", "job": job})
+        job["seq"] = next(self._seq)
+        self._lane(bot_name).put(job)
+
+    async def stop(self, timeout: float = 5.0):
+        # Даём очередям немного дослаться, остальное останется в журнале
+        deadline = time.monotonic() + timeout
+        while any(lane.pending() and lane.task for lane in self.lanes.values()) and time.monotonic() < deadline:
+            await asyncio.sleep(0.1)
+        for lane in self.lanes.values():
+            for task in [lane.task, *lane.inflight]:
+                if task:
+                    task.cancel()
+            lane.task = None
+        if self._journal_task:
+            # Писателя не отменяем (запись в потоке не прервать) — просим его завершиться
+            self._journal_closing = True
+            self._journal_wakeup.set()
+            await self._journal_task
+            self._journal_task = None
+            self._journal_closing = False
+
+
+# Единственный экземпляр, запускается из multi_app.py
+delivery = TelegramDelivery(
+    ROOT_DIR / os.getenv("DELIVERY_JOURNAL", "outbox.jsonl"),
+    global_rate=float(os.getenv("TELEGRAM_GLOBAL_RPS", "25")),
+    chat_rate=float(os.getenv("TELEGRAM_CHAT_RPS", "1")),
+    group_per_minute=float(os.getenv("TELEGRAM_GROUP_PER_MIN", "20")),
+)
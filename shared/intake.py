@@ -0,0 +1,147 @@
+# -*- coding: utf-8 -*-
+# Приём webhook-апдейтов Telegram для multi_app: апдейт проверяется, ставится
+# в ограниченную очередь бота и Telegram сразу получает 200. Пул воркеров
+# бота разбирает очередь, апдейты одного чата обрабатываются строго по порядку,
+# разные чаты — параллельно. Переполненная очередь — явный отказ (503),
+# Telegram повторит доставку позже. Повторно доставленные апдейты
+# (тот же update_id) отсекаются до очереди по RecentUpdates.
+import time
+import asyncio
+import logging
+from collections import OrderedDict, deque
+from pathlib import Path
+from typing import Awaitable, Callable
+
+from shared.state import state
+
+# Разделы апдейта, в которых лежит чат (или пользователь) для упорядочивания
+CHAT_SECTIONS = ("message", "edited_message", "channel_post", "edited_channel_post",
+                 "my_chat_member", "chat_member", "chat_join_request")
+
+
+def update_chat_key(data: dict):
+    """Ключ порядка апдейта: id чата, иначе id пользователя, иначе сам update_id."""
+    for section in CHAT_SECTIONS:
+        chat = (data.get(section) or {}).get("chat")
+        if chat and "id" in chat:
+            return chat["id"]
+    callback = data.get("callback_query") or {}
+    chat = (callback.get("message") or {}).get("chat")
+    if chat and "id" in chat:
+        return chat["id"]
+    for section in ("callback_query", "inline_query", "chosen_inline_result",
+                    "shipping_query", "pre_checkout_query", "poll_answer"):
+        user = (data.get(section) or {}).get("from") or (data.get(section) or {}).get("user")
+        if user and "id" in user:
+            return user["id"]
+    return f"update:{data.get('update_id')}"
+
+
+class UpdateIntake:
+    def __init__(self, name: str, process: Callable[[dict], Awaitable], max_pending: int = 1000,
+                 workers: int = 4):
+        self.name = name
+        self.process = process
+        self.max_pending = max_pending
+        self.workers = workers
+        self.chats: dict = {}
+        self.ready: asyncio.Queue = asyncio.Queue()
+        self.pending = 0
+        self.tasks: list[asyncio.Task] = []
+
+    def submit(self, data: dict) -> bool:
+        """Ставит апдейт в очередь; False — очередь заполнена."""
+        if self.pending >= self.max_pending:
+            return False
+        key = update_chat_key(data)
+        queue = self.chats.get(key)
+        if queue is None:
+            # Чата нет ни в очереди, ни в обработке — он становится готовым
+            queue = self.chats[key] = deque()
+            self.ready.put_nowait(key)
+        queue.append(data)
+        self.pending += 1
+        return True
+
+    async def _worker(self):
+        while True:
+            key = await self.ready.get()
+            queue = self.chats[key]
+            data = queue.popleft()
+            try:
+                await self.process(data)
+            except Exception:
+                logging.exception(f"❌ [{self.name}] Ошибка при обработке апдейта {data.get('update_id')}")
+            finally:
+                self.pending -= 1
+                # Следующий апдейт этого чата — только после текущего, в конец очереди чатов
+                if queue:
+                    self.ready.put_nowait(key)
+                else:
+                    del self.chats[key]
+
+    def start(self):
+        if not self.tasks:
+            self.tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def stop(self, timeout: float = 10.0):
+        # Даём разобрать очередь: Telegram уже получил 200 и повторно не пришлёт
+        deadline = asyncio.get_running_loop().time() + timeout
+        while self.pending and asyncio.get_running_loop().time() < deadline:
+            await asyncio.sleep(0.1)
+        if self.pending:
+            print(f"⚠️ [{self.name}] Не обработано апдейтов при остановке: {self.pending}")
+        for task in self.tasks:
+            task.cancel()
+        self.tasks = []
+
+
+class RecentUpdates:
+    """
+    Недавно принятые update_id по ботам: не больше max_per_bot на бота и не старше ttl.
+    Сохраняется через shared/state.py и переживает перезапуск.
+    """
+
+    def __init__(self, path: Path, ttl: float = 24 * 3600, max_per_bot: int = 5000, save_delay: float = 2.0):
+        self.path = path
+        self.ttl = ttl
+        self.max_per_bot = max_per_bot
+        self.save_delay = save_delay
+        self.seen: dict[str, OrderedDict[int, float]] = {}
+        self.dirty = False
+        self.task: asyncio.Task | None = None
+
+    def load(self):
+        now = time.time()
+        for bot_name, items in state.load(self.path, {}).items():
+            self.seen[bot_name] = OrderedDict(
+                (int(update_id), ts) for update_id, ts in items if now - ts < self.ttl
+            )
+
+    def is_duplicate(self, bot_name: str, update_id: int) -> bool:
+        ts = self.seen.get(bot_name, {}).get(update_id)
+        return ts is not None and time.time() - ts < self.ttl
+
+    def add(self, bot_name: str, update_id: int):
+        now = time.time()
+        seen = self.seen.setdefault(bot_name, OrderedDict())
+        seen[update_id] = now
+        seen.move_to_end(update_id)
+        # Самые старые — в начале: срезаем лишние и просроченные
+        while seen and (len(seen) > self.max_per_bot or now - next(iter(seen.values())) >= self.ttl):
+            seen.popitem(last=False)
+        self.dirty = True
+        if self.task is None:
+            self.task = asyncio.create_task(self._save_later())
+
+    async def _save_later(self):
+        try:
+            await asyncio.sleep(self.save_delay)
+        finally:
+            self.task = None
+        self.save()
+
+    def save(self):
+        if self.dirty:
+            state.save(self.path, {name: list(seen.items()) for name, seen in self.seen.items()}, indent=None)
+            self.dirty = False
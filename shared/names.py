@@ -0,0 +1,118 @@
+# -*- coding: utf-8 -*-
+# Общий кэш имён чатов/пользователей Telegram (bot.get_chat) для всех ботов.
+# Ответы хранятся с TTL в chat_names.json и переживают перезапуск, отказы
+# (чат не найден, бот удалён) тоже кэшируются. Запросы к API — пачкой
+# с ограничением параллельности, повторный запрос того же чата ждёт первый.
+import os
+import json
+import time
+import asyncio
+import logging
+from pathlib import Path
+from typing import Iterable
+
+ROOT_DIR = Path(__file__).resolve().parent.parent
+
+# Сетевые сбои и флуд-контроль — не ответ о чате, такие ошибки не кэшируем
+TRANSIENT_ERRORS = {"NetworkError", "TimedOut", "RetryAfter", "TimeoutError"}
+
+
+def _chat_info(chat) -> dict:
+    first_name = getattr(chat, "first_name", None) or ""
+    last_name = getattr(chat, "last_name", None) or ""
+    return {
+        "ok": True,
+        "username": getattr(chat, "username", None),
+        "first_name": first_name,
+        "last_name": last_name,
+        "full_name": getattr(chat, "full_name", None) or f"{first_name} {last_name}".strip(),
+        "title": getattr(chat, "title", None),
+    }
+
+
+class ChatNameResolver:
+    def __init__(self, cache_path: Path, ttl: float = 24 * 3600, negative_ttl: float = 6 * 3600,
+                 concurrency: int = 5):
+        self.cache_path = cache_path
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.semaphore = asyncio.Semaphore(concurrency)
+        self.cache: dict[str, dict] | None = None
+        self.inflight: dict[str, asyncio.Future] = {}
+
+    def _load(self) -> dict:
+        try:
+            with open(self.cache_path, encoding="utf-8") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
+        except Exception as e:
+            logging.error(f"⚠️ Повреждён кэш имён {self.cache_path.name}: {e}")
+            return {}
+
+    def _save(self, snapshot: dict):
+        tmp = self.cache_path.with_suffix(".tmp")
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(snapshot, f, ensure_ascii=False)
+        os.replace(tmp, self.cache_path)
+
+    def _fresh(self, entry: dict | None, max_age: float | None) -> bool:
+        if entry is None:
+            return False
+        ttl = self.ttl if entry["ok"] else self.negative_ttl
+        if max_age is not None:
+            ttl = min(ttl, max_age)
+        return time.time() - entry["ts"] < ttl
+
+    async def _fetch(self, bot, key: str, chat_id) -> dict | None:
+        async with self.semaphore:
+            try:
+                entry = _chat_info(await bot.get_chat(int(chat_id)))
+            except Exception as e:
+                if type(e).__name__ in TRANSIENT_ERRORS:
+                    logging.warning(f"⚠️ get_chat {chat_id}: {e}")
+                    return None
+                entry = {"ok": False, "error": str(e)}
+        entry["ts"] = time.time()
+        self.cache[key] = entry
+        return entry
+
+    async def lookup_many(self, bot_name: str, bot, chat_ids: Iterable,
+                          max_age: float | None = None) -> dict[str, dict | None]:
+        """
+        chat_id → {"ok": True, username, full_name, ...} | {"ok": False} (чат недоступен)
+        | None (временная ошибка). max_age — требовать запись не старше N секунд.
+        """
+        if self.cache is None:
+            self.cache = await asyncio.to_thread(self._load)
+
+        result, waits = {}, {}
+        for chat_id in dict.fromkeys(str(c) for c in chat_ids):
+            key = f"{bot_name}:{chat_id}"
+            entry = self.cache.get(key)
+            if self._fresh(entry, max_age):
+                result[chat_id] = entry
+            elif key in self.inflight:
+                waits[chat_id] = self.inflight[key]
+            else:
+                task = asyncio.ensure_future(self._fetch(bot, key, chat_id))
+                self.inflight[key] = task
+                task.add_done_callback(lambda _, k=key: self.inflight.pop(k, None))
+                waits[chat_id] = task
+
+        if waits:
+            fetched = await asyncio.gather(*waits.values())
+            result.update(zip(waits.keys(), fetched))
+            await asyncio.to_thread(self._save, dict(self.cache))
+        return result
+
+    async def lookup(self, bot_name: str, bot, chat_id, max_age: float | None = None) -> dict | None:
+        return (await self.lookup_many(bot_name, bot, [chat_id], max_age))[str(chat_id)]
+
+
+# Единственный экземпляр на процесс
+names = ChatNameResolver(
+    ROOT_DIR / os.getenv("CHAT_NAMES_CACHE", "chat_names.json"),
+    ttl=float(os.getenv("CHAT_NAMES_TTL_HOURS", "24")) * 3600,
+    negative_ttl=float(os.getenv("CHAT_NAMES_NEGATIVE_TTL_HOURS", "6")) * 3600,
+)
@@ -0,0 +1,63 @@
+# -*- coding: utf-8 -*-
+# Кэш готовых отчётов для всех ботов: результат хранится вместе с версией
+# данных, из которых он посчитан (смещение лога bot2, версия звонков Binotel,
+# хэш статистики bot3). Пока версия та же — повторные и веерные запросы
+# получают готовый результат, новые данные сами инвалидируют запись.
+import json
+import hashlib
+import inspect
+import logging
+from collections import OrderedDict
+from typing import Any, Callable, Hashable
+
+
+def data_version(*parts) -> str:
+    """Короткий хэш произвольных данных (словари, списки, числа) для версии."""
+    raw = json.dumps(parts, ensure_ascii=False, sort_keys=True, default=str)
+    return hashlib.blake2b(raw.encode("utf-8"), digest_size=12).hexdigest()
+
+
+class ReportCache:
+    def __init__(self, max_entries: int = 64):
+        self.max_entries = max_entries
+        self.entries: OrderedDict[Hashable, tuple[Hashable, Any]] = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: Hashable, version: Hashable, default=None):
+        entry = self.entries.get(key)
+        if entry is None or entry[0] != version:
+            self.misses += 1
+            return default
+        self.hits += 1
+        self.entries.move_to_end(key)
+        return entry[1]
+
+    def put(self, key: Hashable, version: Hashable, value):
+        # На ключ — одна запись: новая версия вытесняет старую
+        self.entries[key] = (version, value)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+    async def get_or_build(self, key: Hashable, version: Hashable, build: Callable[[], Any]):
+        """Готовый результат для (key, version) или build() (обычная функция или корутина)."""
+        entry = self.entries.get(key)
+        if entry is not None and entry[0] == version:
+            self.hits += 1
+            self.entries.move_to_end(key)
+            return entry[1]
+        self.misses += 1
+        value = build()
+        if inspect.isawaitable(value):
+            value = await value
+        self.put(key, version, value)
+        logging.debug(f"🧮 Отчёт {key} пересчитан (версия {version})")
+        return value
+
+    def clear(self):
+        self.entries.clear()
+
+
+# Единственный экземпляр на процесс, ключи с префиксом бота: ("bot2", ...)
+reports = ReportCache()
@@ -0,0 +1,267 @@
+# -*- coding: utf-8 -*-
+# Общий планировщик задач ботов (автоотчёты bot1/bot2, авторассылка bot3).
+# Работает внутри event loop multi_app, без отдельных потоков. Для каждой задачи
+# в scheduler_state.json хранится последний отработанный слот и история запусков,
+# поэтому перезапуск не повторяет уже отправленное и не теряет следующее.
+# Правила пропусков:
+#   - слот, опоздавший больше чем на grace, пропускается (misfire);
+#   - несколько пропущенных слотов сливаются в один запуск (coalesce);
+#   - jitter — случайная задержка запуска, чтобы боты не ходили в API в одну секунду;
+#   - задача вернула False (нечего отправлять) — повтор через retry, пока не вышел grace.
+# Prefetch задачи запускается за PREFETCH_LEAD до слота: тяжёлые загрузки (Binotel,
+# статистика) идут заранее, а сама задача берёт уже прогретые данные.
+import os
+import time
+import random
+import asyncio
+import logging
+from collections import deque
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Awaitable, Callable, Iterable
+
+import pytz
+
+from shared.state import state
+
+ROOT_DIR = Path(__file__).resolve().parent.parent
+KYIV_TZ = pytz.timezone("Europe/Kyiv")
+
+HISTORY_SIZE = 50
+# Сколько можно опоздать со слотом (перезапуск, долгий предыдущий запуск) и разброс старта
+MISFIRE_GRACE = float(os.getenv("SCHEDULER_MISFIRE_GRACE_MINUTES", "10")) * 60
+JITTER = float(os.getenv("SCHEDULER_JITTER_SECONDS", "20"))
+PREFETCH_LEAD = float(os.getenv("SCHEDULER_PREFETCH_MINUTES", "3")) * 60
+
+
+def cron(hours: Iterable[int], minute: int = 0) -> Callable[[], list[str]]:
+    """Расписание «каждый час из hours в minute минут»."""
+    times = [f"{hour:02d}:{minute:02d}" for hour in hours]
+    return lambda: times
+
+
+def daily(get_time: Callable[[], str]) -> Callable[[], list[str]]:
+    """Расписание «раз в день в HH:MM»; время читается при каждой проверке (меняется из меню)."""
+    return lambda: [get_time()]
+
+
+class Job:
+    def __init__(self, name: str, func: Callable[[], Awaitable], times: Callable[[], Iterable[str]],
+                 grace: float = MISFIRE_GRACE, jitter: float = JITTER, coalesce: bool = True, retry: float = 60,
+                 prefetch: Callable[[], Awaitable] | None = None, lead: float = PREFETCH_LEAD):
+        self.name = name
+        self.func = func
+        self.prefetch = prefetch
+        self.lead = lead
+        self.prefetched: datetime | None = None
+        self.prefetch_task: asyncio.Task | None = None
+        self.times = times
+        self.grace = grace
+        self.jitter = jitter
+        self.coalesce = coalesce
+        self.retry = retry
+        self.spec: list[str] | None = None
+        self.last_slot: datetime | None = None
+        self.history: deque = deque(maxlen=HISTORY_SIZE)
+        self.task: asyncio.Task | None = None
+        self.retry_at = 0.0
+        self.delays: dict[datetime, float] = {}
+
+    def slots(self, start: datetime, end: datetime) -> list[datetime]:
+        """Моменты запуска (киевское время) между start и end по текущему расписанию."""
+        result = []
+        day = start.date()
+        while day <= end.date():
+            for value in self.spec:
+                hour, minute = map(int, value.split(":"))
+                slot = KYIV_TZ.localize(datetime(day.year, day.month, day.day, hour, minute))
+                if start <= slot <= end:
+                    result.append(slot)
+            day += timedelta(days=1)
+        return sorted(result)
+
+    def delay(self, slot: datetime) -> float:
+        # Jitter выбирается один раз на слот, повторные проверки его не сдвигают
+        if slot not in self.delays:
+            self.delays = {slot: random.uniform(0, self.jitter) if self.jitter else 0.0}
+        return self.delays[slot]
+
+
+class Scheduler:
+    def __init__(self, path: Path, max_sleep: float = 30.0):
+        self.path = path
+        self.max_sleep = max_sleep
+        self.jobs: dict[str, Job] = {}
+        self.wakeup = asyncio.Event()
+        self.task: asyncio.Task | None = None
+
+    def add_job(self, name: str, func: Callable[[], Awaitable], times: Callable[[], Iterable[str]], **kwargs) -> Job:
+        job = Job(name, func, times, **kwargs)
+        saved = state.load(self.path, {}).get(name, {})
+        if saved.get("last_slot"):
+            job.last_slot = datetime.fromisoformat(saved["last_slot"])
+        job.spec = saved.get("spec")
+        job.history.extend(saved.get("history", []))
+        self.jobs[name] = job
+        self.refresh()
+        return job
+
+    def refresh(self):
+        """Перепроверить расписание сейчас (например, после смены времени отчёта)."""
+        self.wakeup.set()
+
+    def status(self) -> dict:
+        return {
+            name: {
+                "last_slot": job.last_slot.isoformat() if job.last_slot else None,
+                "running": job.task is not None,
+                "history": list(job.history),
+            }
+            for name, job in self.jobs.items()
+        }
+
+    def _save(self):
+        state.save(self.path, {
+            name: {
+                "last_slot": job.last_slot.isoformat() if job.last_slot else None,
+                "spec": job.spec,
+                "history": list(job.history),
+            }
+            for name, job in self.jobs.items()
+        })
+
+    def _record(self, job: Job, slot: datetime, result: str, started: float | None = None,
+                duration: float | None = None):
+        job.history.append({
+            "slot": slot.isoformat(),
+            "started": datetime.fromtimestamp(started, KYIV_TZ).isoformat(timespec="seconds") if started else None,
+            "duration": round(duration, 2) if duration is not None else None,
+            "result": result,
+        })
+
+    def _check(self, job: Job, now: datetime) -> float:
+        """Запускает задачу, если подошёл её слот; возвращает, сколько можно спать до следующей проверки."""
+        spec = sorted(set(job.times()))
+        if spec != job.spec:
+            if job.spec is not None:
+                # Расписание поменяли: уже прошедшие сегодня слоты нового расписания не догоняем
+                logging.info(f"🗓 [{job.name}] Новое расписание: {', '.join(spec)}")
+                job.last_slot = now
+            job.spec = spec
+            self._save()
+
+        # Без сохранённого состояния (первый запуск) догоняем только то, что в пределах grace
+        last = job.last_slot or now - timedelta(seconds=job.grace)
+        due = [slot for slot in job.slots(now - timedelta(days=1), now) if slot > last]
+        if due:
+            late = [slot for slot in due if (now - slot).total_seconds() > job.grace]
+            fresh = due[len(late):]
+            # Опоздавшие больше grace не запускаем; при coalesce из свежих остаётся только последний
+            skipped = late + fresh[:-1] if job.coalesce else late
+            if skipped:
+                for slot in skipped:
+                    self._record(job, slot, "misfire" if slot in late else "coalesced")
+                logging.warning(f"⏭ [{job.name}] Пропущено запусков: {len(skipped)} "
+                                f"(последний {skipped[-1]:%d.%m %H:%M})")
+                job.last_slot = skipped[-1]
+                self._save()
+            if fresh:
+                slot = fresh[-1] if job.coalesce else fresh[0]
+                wait = max((slot - now).total_seconds() + job.delay(slot), job.retry_at - time.time())
+                if wait <= 0:
+                    job.task = asyncio.create_task(self._run(job, slot))
+                    return self.max_sleep
+                return wait
+
+        upcoming = job.slots(now, now + timedelta(days=1))
+        if not upcoming:
+            return self.max_sleep
+        slot = upcoming[0]
+        wait = (slot - now).total_seconds()
+        if job.prefetch is None or job.prefetched == slot:
+            return wait
+        if wait <= job.lead:
+            if job.prefetch_task is None:
+                job.prefetched = slot
+                job.prefetch_task = asyncio.create_task(self._prefetch(job, slot))
+            return wait
+        return wait - job.lead
+
+    async def _run(self, job: Job, slot: datetime):
+        previous = job.last_slot
+        # Слот отмечается до запуска: прерванная на середине рассылка после перезапуска не повторяется
+        job.last_slot = slot
+        self._save()
+        started = time.time()
+        result = "cancelled"
+        logging.info(f"⏰ [{job.name}] Запуск за {slot:%d.%m %H:%M}")
+        try:
+            if await job.func() is False:
+                # Задача ничего не сделала — вернём слот, повтор через retry (пока не вышел grace)
+                result = "retry"
+                job.last_slot = previous
+                job.retry_at = time.time() + job.retry
+            else:
+                result = "ok"
+        except Exception:
+            result = "error"
+            logging.exception(f"❌ [{job.name}] Ошибка задачи за {slot:%d.%m %H:%M}")
+        finally:
+            duration = time.time() - started
+            self._record(job, slot, result, started, duration)
+            self._save()
+            job.task = None
+            self.wakeup.set()
+            logging.info(f"🏁 [{job.name}] {result} за {duration:.1f} с")
+
+    async def _prefetch(self, job: Job, slot: datetime):
+        started = time.time()
+        result = "prefetch cancelled"
+        try:
+            await job.prefetch()
+            result = "prefetch ok"
+        except Exception:
+            # Не страшно: задача в слот загрузит данные сама
+            result = "prefetch error"
+            logging.exception(f"⚠️ [{job.name}] Ошибка предзагрузки за {slot:%d.%m %H:%M}")
+        finally:
+            duration = time.time() - started
+            self._record(job, slot, result, started, duration)
+            self._save()
+            job.prefetch_task = None
+            logging.info(f"🔥 [{job.name}] Данные к {slot:%H:%M} подготовлены заранее: {result} за {duration:.1f} с")
+
+    async def _loop(self):
+        while True:
+            now = datetime.now(KYIV_TZ)
+            sleep = self.max_sleep
+            for job in self.jobs.values():
+                if job.task is not None:
+                    continue
+                try:
+                    sleep = min(sleep, self._check(job, now))
+                except Exception:
+                    logging.exception(f"❌ [{job.name}] Ошибка планировщика")
+            self.wakeup.clear()
+            try:
+                await asyncio.wait_for(self.wakeup.wait(), timeout=max(sleep, 0.05))
+            except asyncio.TimeoutError:
+                pass
+
+    def start(self):
+        if self.task is None:
+            self.task = asyncio.create_task(self._loop())
+
+    async def stop(self):
+        tasks = [task for job in self.jobs.values() for task in (job.task, job.prefetch_task) if task is not None]
+        if self.task is not None:
+            self.task.cancel()
+            tasks.append(self.task)
+            self.task = None
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+
+# Единственный экземпляр на процесс: задачи добавляют боты в handle_startup, запускает multi_app
+scheduler = Scheduler(ROOT_DIR / os.getenv("SCHEDULER_STATE_FILE", "scheduler_state.json"))
@@ -0,0 +1,32 @@
+# -*- coding: utf-8 -*-
+# Рабочие сессии сотрудников по звонкам: звонки с паузой не больше gap —
+# одна сессия. Один векторный проход по всем звонкам сразу (sort + diff + cumsum),
+# используется для активных часов bot1 (gap 1 ч) и скорости bot3 (gap 80 мин).
+import pandas as pd
+
+
+def work_sessions(keys: pd.Series, call_times: pd.Series, gap) -> pd.DataFrame:
+    """Одна строка на сессию: key, start, end, calls (время — datetime или epoch-секунды)."""
+    frame = pd.DataFrame({"key": keys.values, "call_dt": call_times.values}).sort_values(["key", "call_dt"])
+    new_session = frame["key"].ne(frame["key"].shift()) | (frame["call_dt"].diff() > gap)
+    frame["session"] = new_session.cumsum()
+    return frame.groupby("session").agg(
+        key=("key", "first"),
+        start=("call_dt", "min"),
+        end=("call_dt", "max"),
+        calls=("call_dt", "size"),
+    ).reset_index(drop=True)
+
+
+def union_sessions(intervals, gap) -> list[list]:
+    """
+    Склеивает сессии из разных окон/дней/сотрудников: пауза не больше gap — одна сессия.
+    Результат тот же, что у work_sessions по всем исходным звонкам вместе.
+    """
+    merged = []
+    for start, end in sorted(intervals):
+        if merged and start - merged[-1][1] <= gap:
+            merged[-1][1] = max(merged[-1][1], end)
+        else:
+            merged.append([start, end])
+    return merged
@@ -0,0 +1,32 @@
+# -*- coding: utf-8 -*-
+# Single-flight для тяжёлых задач ботов (загрузка Binotel, выгрузка статистики,
+# рассылка, отчёты): на ключ (тип задачи, дата...) выполняется одна задача,
+# остальные вызовы с тем же ключом ждут её результат, а не запускают свою.
+# Так нет повторной нагрузки на API и гонок за одни и те же файлы.
+import asyncio
+import logging
+from typing import Any, Awaitable, Callable, Hashable
+
+
+class SingleFlight:
+    def __init__(self):
+        self.inflight: dict[Hashable, asyncio.Future] = {}
+
+    def running(self, key: Hashable) -> bool:
+        return key in self.inflight
+
+    async def run(self, key: Hashable, func: Callable[..., Awaitable], *args, **kwargs) -> Any:
+        """Результат func(*args, **kwargs); если задача с key уже идёт — её результат."""
+        task = self.inflight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(func(*args, **kwargs))
+            self.inflight[key] = task
+            task.add_done_callback(lambda done: self.inflight.pop(key, None) if self.inflight.get(key) is done else None)
+        else:
+            logging.info(f"⏳ {key} уже выполняется — ждём её результат")
+        # Отмена одного ожидающего не отменяет общую задачу
+        return await asyncio.shield(task)
+
+
+# Единственный экземпляр на процесс, ключи с префиксом задачи: ("binotel_refresh", date)
+jobs = SingleFlight()
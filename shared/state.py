@@ -0,0 +1,105 @@
+# -*- coding: utf-8 -*-
+# Общее хранилище JSON-состояния ботов (настройки, каналы, пользователи, нормы).
+# Состояние живёт в памяти: чтение не трогает диск, запись сразу обновляет
+# память, а файл переписывается позже — несколько правок подряд сливаются
+# в одну запись. Запись атомарная (tmp + fsync + os.replace) и идёт в потоке,
+# не блокируя event loop; при остановке всё несохранённое дописывается.
+import os
+import copy
+import json
+import asyncio
+import logging
+from pathlib import Path
+from typing import Any
+
+
+class JsonStateStore:
+    def __init__(self, delay: float = 0.5):
+        self.delay = delay
+        self.cache: dict[Path, Any] = {}
+        self.pending: dict[Path, str] = {}
+        self.tasks: dict[Path, asyncio.Task] = {}
+        self.wakeup = asyncio.Event()
+
+    @staticmethod
+    def _read(path: Path, default):
+        try:
+            with open(path, encoding="utf-8") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return default
+        except Exception as e:
+            logging.error(f"⚠️ Ошибка чтения {path}: {e}")
+            return default
+
+    @staticmethod
+    def _write(path: Path, text: str):
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_name(path.name + ".tmp")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(text)
+            f.flush()
+            os.fsync(f.fileno())
+        # Читатель (и перезапуск после сбоя) видит либо старый файл, либо новый целиком
+        os.replace(tmp_path, path)
+
+    def load(self, path: Path | str, default=None):
+        """Копия состояния из памяти; с диска файл читается только при первом обращении."""
+        path = Path(path)
+        if path not in self.cache:
+            self.cache[path] = self._read(path, default)
+        return copy.deepcopy(self.cache[path])
+
+    def reload(self, path: Path | str, default=None):
+        """Перечитывает файл с диска (например, после ручной правки) и возвращает копию."""
+        path = Path(path)
+        if path in self.pending:
+            # Несохранённые правки в памяти новее файла — перечитывать нечего
+            logging.warning(f"⚠️ {path.name} ещё не записан на диск — оставляем состояние из памяти")
+        else:
+            self.cache.pop(path, None)
+        return self.load(path, default)
+
+    def save(self, path: Path | str, data, indent: int | None = 2):
+        """Обновляет состояние в памяти и планирует запись файла."""
+        path = Path(path)
+        self.cache[path] = copy.deepcopy(data)
+        self.pending[path] = json.dumps(data, ensure_ascii=False, indent=indent)
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            # Вне event loop (импорт, скрипты) — пишем сразу
+            self._write(path, self.pending.pop(path))
+            return
+        if path not in self.tasks:
+            self.tasks[path] = loop.create_task(self._writer(path))
+
+    async def _writer(self, path: Path):
+        # Один писатель на файл: записи одного файла не пересекаются
+        try:
+            while path in self.pending:
+                if not self.wakeup.is_set():
+                    try:
+                        await asyncio.wait_for(self.wakeup.wait(), timeout=self.delay)
+                    except asyncio.TimeoutError:
+                        pass
+                text = self.pending.pop(path)
+                try:
+                    await asyncio.to_thread(self._write, path, text)
+                except Exception as e:
+                    logging.error(f"❌ Ошибка сохранения {path}: {e}")
+        finally:
+            self.tasks.pop(path, None)
+
+    async def flush(self):
+        """Дописывает всё несохранённое (при остановке)."""
+        self.wakeup.set()
+        try:
+            while self.tasks:
+                await asyncio.gather(*list(self.tasks.values()))
+        finally:
+            self.wakeup.clear()
+
+
+# Единственный экземпляр на процесс, сбрасывается в on_shutdown multi_app.py
+state = JsonStateStore()
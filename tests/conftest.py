@@ -0,0 +1,18 @@
+# -*- coding: utf-8 -*-
+# Общие настройки тестов: корень проекта в sys.path и переменные окружения,
+# без которых модули ботов не импортируются (токены проверяются при импорте).
+import os
+import sys
+from pathlib import Path
+
+ROOT_DIR = Path(__file__).resolve().parent.parent
+if str(ROOT_DIR) not in sys.path:
+    sys.path.insert(0, str(ROOT_DIR))
+
+for name, value in {
+    "BOT1_TOKEN": "123:abc",
+    "BOT2_TOKEN": "123:abc",
+    "BOT3_TOKEN": "123:abc",
+    "ERROR_CHANNEL_ID": "1",
+}.items():
+    os.environ.setdefault(name, value)
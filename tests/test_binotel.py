@@ -0,0 +1,84 @@
+# -*- coding: utf-8 -*-
+# Планирование окон Binotel: какие окна качать целиком, какие — хвостом, какие уже закрыты.
+import json
+from datetime import datetime
+
+import numpy as np
+
+from shared.binotel import KYIV_TZ, BinotelIngestion, plan_windows, store_response, window_filename
+from shared.callstore import calls_to_columns
+
+
+def at(hour: int, minute: int = 0) -> datetime:
+    return KYIV_TZ.localize(datetime(2025, 8, 8, hour, minute))
+
+
+def call(call_id: int, start: int, billsec: int = 10) -> dict:
+    return {"generalCallID": str(call_id), "startTime": str(start), "billsec": str(billsec), "waitsec": "3",
+            "disposition": "ANSWER", "employeeData": {"name": "ДЖ-Іваненко (АБ)"}}
+
+
+def response(*calls, status: str = "success") -> bytes:
+    return json.dumps({"status": status, "callDetails": {c["generalCallID"]: c for c in calls}}).encode()
+
+
+def test_plan_windows():
+    assert plan_windows(at(7, 29)) == []
+    assert plan_windows(at(7, 30)) == [(at(7, 30), at(8))]
+
+    windows = plan_windows(at(10, 45))
+    assert windows[0] == (at(7, 30), at(8)) and windows[-1] == (at(10, 30), at(11))
+    assert len(windows) == 7
+    assert all(end == next_start for (_, end), (next_start, _) in zip(windows, windows[1:]))
+
+    # После 22:00 новых окон нет
+    assert plan_windows(at(23, 10))[-1] == (at(21, 30), at(22))
+    assert len(plan_windows(at(23, 10))) == 29
+
+
+def test_plan_missing_skips_sealed_and_tails_open_windows(tmp_path):
+    ingestion = BinotelIngestion(tmp_path)
+    folder = ingestion.day_folder("2025-08-08")
+    folder.mkdir(parents=True)
+    windows = plan_windows(at(10, 45))
+
+    sealed_path = folder / window_filename(at(7, 30), at(8))
+    ingestion.store.write_window(sealed_path, calls_to_columns({}), sealed=True)
+    open_path = folder / window_filename(at(10), at(10, 30))
+    last_start = int(at(10, 20).timestamp())
+    ingestion.store.write_window(open_path, calls_to_columns({"1": call(1, last_start)}), sealed=False)
+
+    missing = ingestion._plan_missing(folder, windows, at(10, 45))
+    plan = {start.strftime("%H:%M"): (tail_from, sealed) for start, _, _, tail_from, sealed in missing}
+
+    assert "07:30" not in plan and sealed_path in ingestion.sealed
+    # Незакрытое окно докачивается с последнего виденного звонка и после SEAL_GRACE закрывается
+    assert plan["10:00"] == (last_start, True)
+    assert plan["10:30"] == (None, False)
+    assert plan["08:00"] == (None, True)
+    assert len(missing) == len(windows) - 1
+
+    # Закрытое окно больше не читается с диска
+    sealed_path.unlink()
+    assert "07:30" not in {s.strftime("%H:%M") for s, *_ in ingestion._plan_missing(folder, windows, at(10, 50))}
+
+
+def test_store_response_merges_tail_by_call_id(tmp_path):
+    ingestion = BinotelIngestion(tmp_path)
+    path = ingestion.day_folder("2025-08-08") / window_filename(at(10), at(10, 30))
+    path.parent.mkdir(parents=True)
+    start = int(at(10).timestamp())
+
+    assert store_response(ingestion.store, path, response(call(1, start), call(2, start + 60)), None, False) == 2
+    # Хвост: звонок 2 пришёл снова (закончился, billsec изменился) и один новый
+    tail = response(call(2, start + 60, billsec=95), call(3, start + 600))
+    assert store_response(ingestion.store, path, tail, start + 60, True) == 1
+
+    window = ingestion.store.read_window(path)
+    assert sorted(window["call_id"].tolist()) == [1, 2, 3]
+    assert int(window["billsec"][window["call_id"] == 2][0]) == 95
+    assert bool(window["sealed"]) and int(window["last_start"]) == start + 600
+
+    # Ошибка Binotel окно не трогает
+    assert store_response(ingestion.store, path, response(status="error"), start + 600, True) is None
+    assert np.array_equal(ingestion.store.read_window(path)["call_id"], window["call_id"])
@@ -0,0 +1,192 @@
+# -*- coding: utf-8 -*-
+# Готовые агрегаты звонков: отчёт bot1 из merge_aggregates должен совпадать с отчётом
+# старого build_reports, который перебирал все звонки дня из CSV.
+import random
+from datetime import date, datetime
+
+import pandas as pd
+import pytest
+
+import bot1.zvonki_single_run as bot1
+from shared.binotel import KYIV_TZ, day_end, plan_windows, window_filename
+from shared.callstats import merge_aggregates, window_aggregates
+from shared.callstore import CallStore, calls_to_columns, columns_to_frame
+
+DAY = date(2025, 8, 8)
+REPORT_TIME = "21:00 08-08-2025"
+EMPLOYEES = [
+    "ДЖ-Іваненко (АБ)",
+    "дж-Петренко (ВГ)",
+    "ДЖ-Сидоренко (АБ)",   # те же инициалы — одна строка отчёта
+    "ДЖ-Без ініціалів",
+    "Продаж-Коваль (ДЕ)",  # не Дожим — в отчёт не попадает
+]
+
+
+def legacy_active_hours(call_times: pd.Series) -> float:
+    times = call_times.sort_values().reset_index(drop=True)
+    if times.empty:
+        return 1.0
+    active_periods = []
+    start_time = times.iloc[0]
+    prev_time = start_time
+    for current_time in times[1:]:
+        if (current_time - prev_time) > pd.Timedelta(hours=1):
+            active_periods.append((start_time, prev_time))
+            start_time = current_time
+        prev_time = current_time
+    active_periods.append((start_time, prev_time))
+    total_seconds = sum((end - start).total_seconds() for start, end in active_periods)
+    return max(total_seconds / 3600, 1.0)
+
+
+def legacy_build_reports(df: pd.DataFrame) -> tuple[str, str]:
+    """build_reports bot1 до агрегатов: проход по всем звонкам дня из CSV."""
+    df.columns = df.columns.str.lower().str.strip()
+    df = df[df['employee name'].str.contains(r'дж-', case=False, na=False)].copy()
+    df.loc[:, 'initials'] = df['employee name'].str.extract(r'\((.*?)\)')
+    df.loc[:, 'call_dt'] = pd.to_datetime(df['date'], dayfirst=True, errors='coerce')
+
+    s = df.groupby('initials', group_keys=False).apply(
+        lambda x: pd.Series({
+            'total': len(x),
+            'cancel': (x['disposition'].str.upper() == 'CANCEL').sum(),
+            'zero': (x['billsec'] == 0).sum(),
+            'wait': x['waitsec'].sum(),
+            'talk': x['billsec'].sum(),
+            'first_call': x['call_dt'].min(),
+            'last_call': x['call_dt'].max(),
+            'active_hours': legacy_active_hours(x['call_dt']),
+        }),
+        include_groups=False
+    ).reset_index()
+
+    s['in_hour'] = s.apply(
+        lambda r: round(r['total'] / r['active_hours'], 1) if r['active_hours'] else 0,
+        axis=1
+    )
+    s['cancel_pct'] = (s['cancel'] / s['total']) * 100
+    s['talk_hours'] = s['talk'] / 3600
+    s['period_hours'] = (s['last_call'] - s['first_call']).dt.total_seconds() / 3600
+
+    now_str = REPORT_TIME
+    emp_report = f"\U0001F4DE <b>Звонки Дожим отчёт на {now_str}:</b>\n\n"
+    for _, r in s.sort_values(by='total', ascending=False).iterrows():
+        cancel_pct_rounded = round(r['cancel_pct'])
+        cancel_style = ("<b>", "</b>") if cancel_pct_rounded >= 20 else ("", "")
+        in_hour_val = (
+            f"{r['in_hour']:.1f}" if pd.notnull(r['in_hour']) and r['in_hour'] != float("inf") else "0"
+        )
+        emp_report += (
+            f"\U0001F464 <b>{r['initials']}</b> — "
+            f"звонков <b>{int(r['total'])}</b>, "
+            f"в час <b>{in_hour_val}</b>, "
+            f"сбросов {cancel_style[0]}{int(r['cancel'])} ({cancel_pct_rounded}%){cancel_style[1]}"
+            f"{'‼️' if cancel_pct_rounded >= 20 else ''}\n\n"
+        )
+
+    mgr_report = f"\U0001F4C8 <b>Звонки Дожим — для руководителя</b>\n⏰ <i>Отчёт на {now_str}</i>\n\n"
+    for _, r in s.sort_values(by='total', ascending=False).iterrows():
+        cancel_pct_rounded = round(r['cancel_pct'])
+        cancel_str = f"<b>{int(r['cancel'])}</b>‼️" if cancel_pct_rounded >= 20 else f"{int(r['cancel'])}"
+        first_call = r['first_call'].strftime('%H:%M %d-%m-%Y') if pd.notnull(r['first_call']) else "нет данных"
+        last_call = r['last_call'].strftime('%H:%M %d-%m-%Y') if pd.notnull(r['last_call']) else "нет данных"
+        bold = ("<b>", "</b>") if r['total'] >= 5 else ("", "")
+        mgr_report += (
+            f"\U0001F464 {bold[0]}{r['initials']}{bold[1]} — звонков: {bold[0]}{int(r['total'])}{bold[1]}, "
+            f"сбросов: {cancel_str}, недозвонов: {int(r['zero'])},\n"
+            f"первый звонок: {first_call}, последний звонок: {last_call},\n"
+            f"разговоров: {r['talk_hours']:.2f} ч, период активности: {r['period_hours']:.2f} ч\n\n"
+        )
+    return emp_report, mgr_report
+
+
+def epoch(hour: int, minute: int = 0, second: int = 0) -> int:
+    return int(KYIV_TZ.localize(datetime(DAY.year, DAY.month, DAY.day, hour, minute, second)).timestamp())
+
+
+def make_calls(seed: int = 9) -> list[dict]:
+    """Звонки дня в формате callDetails Binotel, с перерывами дольше часа у части сотрудников."""
+    rng = random.Random(seed)
+    calls = []
+    for employee in EMPLOYEES:
+        blocks = [(epoch(8), epoch(11)), (epoch(13, 30), epoch(14, 10)), (epoch(17), epoch(21, 30))]
+        for block_start, block_end in rng.sample(blocks, rng.randint(1, 3)):
+            for _ in range(rng.randint(3, 40)):
+                billsec = rng.choice([0, 0, rng.randint(1, 600)])
+                calls.append({
+                    "generalCallID": str(len(calls) + 1000),
+                    "startTime": str(rng.randint(block_start, block_end)),
+                    "billsec": str(billsec),
+                    "waitsec": str(rng.randint(0, 40)),
+                    "disposition": rng.choice(["ANSWER", "CANCEL", "Cancel", "BUSY", "NOANSWER"]),
+                    "employeeData": {"name": employee},
+                })
+    # Паузы на границе сессии: 55 мин и ровно час — та же сессия, час и секунда — новая
+    # (через границы окон); сотрудник с одним звонком — активных часов не меньше одного
+    pauses = [("ДЖ-Паузи (ПЗ)", epoch(h, m, s)) for h, m, s in
+              [(9, 0, 0), (9, 55, 0), (10, 55, 0), (11, 55, 1), (12, 40, 0), (14, 10, 0)]]
+    for employee, start in pauses + [("ДЖ-Один (ОД)", epoch(12, 0, 5))]:
+        calls.append({"generalCallID": str(len(calls) + 1000), "startTime": str(start), "billsec": "30",
+                      "waitsec": "5", "disposition": "ANSWER", "employeeData": {"name": employee}})
+    return calls
+
+
+def write_day(store: CallStore, calls: list[dict]):
+    """Раскладывает звонки по получасовым окнам так же, как их пишет загрузка Binotel."""
+    folder = store.day_folder(DAY.isoformat())
+    folder.mkdir(parents=True)
+    for start, end in plan_windows(day_end(DAY.isoformat())):
+        window = {c["generalCallID"]: c for c in calls
+                  if start.timestamp() <= int(c["startTime"]) < end.timestamp()}
+        store.write_window(folder / window_filename(start, end), calls_to_columns(window), sealed=True)
+
+
+def legacy_frame(calls: list[dict]) -> pd.DataFrame:
+    """Звонки в колонках старого CSV (дата строкой по Киеву)."""
+    return pd.DataFrame({
+        "employee name": [c["employeeData"]["name"] for c in calls],
+        "date": [datetime.fromtimestamp(int(c["startTime"]), KYIV_TZ).strftime("%d.%m.%Y %H:%M:%S") for c in calls],
+        "waitsec": [int(c["waitsec"]) for c in calls],
+        "billsec": [int(c["billsec"]) for c in calls],
+        "disposition": [c["disposition"] for c in calls],
+    })
+
+
+@pytest.fixture
+def report_time(monkeypatch):
+    monkeypatch.setattr(bot1, "get_report_time", lambda now=None: REPORT_TIME)
+
+
+@pytest.mark.parametrize("seed", [1, 9, 25])
+def test_bot1_report_matches_legacy_build_reports(tmp_path, report_time, seed):
+    calls = make_calls(seed)
+    store = CallStore(tmp_path)
+    write_day(store, calls)
+
+    stats = merge_aggregates(store.stats(DAY, DAY), bot1.employee_initials)
+    assert bot1.build_reports(stats) == legacy_build_reports(legacy_frame(calls))
+
+
+def test_window_aggregates_merge_like_whole_day(tmp_path):
+    calls = make_calls()
+    store = CallStore(tmp_path)
+    write_day(store, calls)
+    whole_day = window_aggregates(columns_to_frame(calls_to_columns({c["generalCallID"]: c for c in calls})))
+
+    assert merge_aggregates(store.stats(DAY, DAY)) == merge_aggregates([whole_day])
+
+    # Сжатый день (один файл) и агрегаты, пересчитанные новым процессом с диска, — те же
+    store.compact_day(DAY.isoformat())
+    assert merge_aggregates(CallStore(tmp_path).stats(DAY, DAY)) == merge_aggregates([whole_day])
+
+
+def test_stats_until_cuts_boundary_window(tmp_path):
+    calls = make_calls()
+    store = CallStore(tmp_path)
+    write_day(store, calls)
+    until = epoch(13, 45)
+    before = {c["generalCallID"]: c for c in calls if int(c["startTime"]) < until}
+
+    expected = merge_aggregates([window_aggregates(columns_to_frame(calls_to_columns(before)))])
+    assert merge_aggregates(store.stats(DAY, DAY, until)) == expected
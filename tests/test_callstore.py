@@ -0,0 +1,70 @@
+# -*- coding: utf-8 -*-
+# История звонков: сжатие прошедших дней в один файл и срок хранения.
+from datetime import date
+
+from shared.binotel import BinotelIngestion, day_end, plan_windows, window_filename
+from shared.callstore import calls_to_columns
+
+
+def call(call_id: int, start: int) -> dict:
+    return {"generalCallID": str(call_id), "startTime": str(start), "billsec": "20", "waitsec": "4",
+            "disposition": "ANSWER", "employeeData": {"name": "ДЖ-Іваненко (АБ)"}}
+
+
+def write_day(ingestion: BinotelIngestion, date_str: str, open_windows: int = 0):
+    """Все окна дня с одним звонком в каждом; последние open_windows окон не закрыты."""
+    folder = ingestion.day_folder(date_str)
+    folder.mkdir(parents=True)
+    windows = plan_windows(day_end(date_str))
+    for i, (start, end) in enumerate(windows):
+        columns = calls_to_columns({str(i): call(i, int(start.timestamp()) + 60)})
+        ingestion.store.write_window(folder / window_filename(start, end), columns,
+                                     sealed=i < len(windows) - open_windows)
+    return len(windows)
+
+
+def test_housekeeping_compacts_finished_days(tmp_path):
+    ingestion = BinotelIngestion(tmp_path)
+    calls = write_day(ingestion, "2025-08-07")
+    write_day(ingestion, "2025-08-06", open_windows=1)
+    write_day(ingestion, "2025-08-05", open_windows=1)
+    before = ingestion.store.load_day("2025-08-07")
+
+    ingestion._housekeeping("2025-08-08")
+    store = ingestion.store
+
+    # Вчера закрыт целиком — сжат в один файл, звонки те же
+    assert store.is_compacted("2025-08-07") and not store.day_folder("2025-08-07").exists()
+    after = store.load_day("2025-08-07")
+    assert len(after) == calls
+    assert after["call_id"].tolist() == before["call_id"].tolist()
+    # Позавчерашний хвост уже не докачать — сжимается, даже если окно не закрыто
+    assert store.is_compacted("2025-08-06") and store.is_compacted("2025-08-05")
+
+
+def test_housekeeping_keeps_yesterday_with_open_window(tmp_path):
+    ingestion = BinotelIngestion(tmp_path)
+    write_day(ingestion, "2025-08-07", open_windows=1)
+
+    ingestion._housekeeping("2025-08-08")
+
+    assert not ingestion.store.is_compacted("2025-08-07")
+    assert ingestion._pending_days("2025-08-08") == ["2025-08-07"]
+
+
+def test_retention_removes_old_days_and_bumps_version(tmp_path):
+    ingestion = BinotelIngestion(tmp_path, retention_days=3)
+    write_day(ingestion, "2025-08-01")
+    write_day(ingestion, "2025-08-06")
+    store = ingestion.store
+    version = store.version(date(2025, 8, 1), date(2025, 8, 1))
+
+    ingestion._housekeeping("2025-08-08")
+
+    assert store.days() == ["2025-08-06"]
+    assert not store.stats_path("2025-08-01").exists()
+    assert store.stats_path("2025-08-06").exists()
+    assert store.load_day("2025-08-01").empty
+    assert store.stats(date(2025, 8, 1), date(2025, 8, 1)) == []
+    # Кэш готовых отчётов за удалённый день устаревает
+    assert store.version(date(2025, 8, 1), date(2025, 8, 1)) != version
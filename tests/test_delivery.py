@@ -0,0 +1,152 @@
+# -*- coding: utf-8 -*-
+# Журнал доставки: восстановление неотправленного после перезапуска и сжатие журнала.
+import asyncio
+import json
+import logging
+
+import pytest
+
+import shared.delivery as delivery_module
+from shared.delivery import TelegramDelivery
+
+
+@pytest.fixture(autouse=True)
+def fast_journal(monkeypatch):
+    monkeypatch.setattr(delivery_module, "JOURNAL_DELAY", 0.01)
+
+
+def make_delivery(path) -> TelegramDelivery:
+    return TelegramDelivery(path, global_rate=1000, chat_rate=1000, group_per_minute=60000, group_burst=100)
+
+
+def journal(path) -> list[dict]:
+    return [json.loads(line) for line in path.read_text(encoding="utf-8").splitlines()]
+
+
+def add_record(job_id: str, chat_id, bot: str = "bot1", text: str = "текст") -> str:
+    job = {"id": job_id, "bot": bot, "chat_id": chat_id, "text": text, "parse_mode": None,
+           "urgent": False, "kwargs": {}, "label": None, "attempts": 0}
+    return json.dumps({"op": "add", "job": job}, ensure_ascii=False) + "\n"
+
+
+async def wait_until(condition, timeout: float = 5.0):
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout
+    while not condition():
+        assert loop.time() < deadline, "не дождались доставки"
+        await asyncio.sleep(0.01)
+
+
+def recorder(sent: list):
+    async def send_func(**kwargs):
+        sent.append(kwargs)
+    return send_func
+
+
+def test_restore_replays_only_unsent(tmp_path):
+    path = tmp_path / "outbox.jsonl"
+    path.write_text(
+        add_record("1", "-100500", text="доставлено")
+        + add_record("2", "-100500", text="ждёт")
+        + json.dumps({"op": "done", "id": "1"}) + "\n"
+        + "{битая строка после сбоя\n"
+        + add_record("3", 42, bot="bot2"),
+        encoding="utf-8",
+    )
+    sent = []
+
+    async def scenario():
+        delivery = make_delivery(path)
+        await delivery.start()
+        # Журнал сразу переписан только с неотправленным
+        assert [r["job"]["id"] for r in journal(path)] == ["2", "3"]
+        delivery.register("bot1", recorder(sent))
+        await wait_until(lambda: "2" not in delivery.unsent)
+        await delivery.stop()
+
+    asyncio.run(scenario())
+    assert sent == [{"chat_id": -100500, "text": "ждёт", "parse_mode": None}]
+    # bot2 не зарегистрирован — его сообщение остаётся до следующего запуска
+    assert [r["job"]["id"] for r in journal(path)] == ["3"]
+
+
+def test_unsent_message_survives_restart(tmp_path):
+    path = tmp_path / "outbox.jsonl"
+    sent = []
+
+    async def first_process():
+        delivery = make_delivery(path)
+        await delivery.start()
+        await delivery.send("bot1", "-100123", "<b>отчёт</b>", parse_mode="HTML", label="отчёт",
+                            disable_web_page_preview=True)
+        await delivery.stop(timeout=0)
+
+    async def second_process():
+        delivery = make_delivery(path)
+        await delivery.start()
+        delivery.register("bot1", recorder(sent))
+        await wait_until(lambda: not delivery.unsent)
+        await delivery.stop()
+
+    asyncio.run(first_process())
+    assert [r["job"]["text"] for r in journal(path)] == ["<b>отчёт</b>"]
+
+    asyncio.run(second_process())
+    assert sent == [{"chat_id": -100123, "text": "<b>отчёт</b>", "parse_mode": "HTML",
+                     "disable_web_page_preview": True}]
+    assert journal(path) == []
+
+
+def test_journal_is_compacted_when_it_grows(tmp_path, monkeypatch):
+    monkeypatch.setattr(delivery_module, "JOURNAL_COMPACT_LINES", 10)
+    path = tmp_path / "outbox.jsonl"
+    sent = []
+
+    async def scenario():
+        delivery = make_delivery(path)
+        await delivery.start()
+        delivery.register("bot1", recorder(sent))
+        for chat_id in range(30):
+            await delivery.send("bot1", chat_id, f"сообщение {chat_id}")
+        await wait_until(lambda: len(sent) == 30 and not delivery.unsent)
+        await wait_until(lambda: not delivery._journal_buffer and not delivery._journal_wakeup.is_set())
+        await asyncio.sleep(0.05)
+        # Без сжатия в журнале было бы 60 строк (add + done на сообщение)
+        lines = len(journal(path))
+        assert lines == delivery._journal_lines
+        assert lines <= 10
+        await delivery.stop()
+
+    asyncio.run(scenario())
+    assert len(sent) == 30
+    assert journal(path) == []
+
+
+def test_failed_message_is_logged_with_label_and_dropped(tmp_path, caplog):
+    path = tmp_path / "outbox.jsonl"
+
+    class Forbidden(Exception):
+        pass
+
+    async def send_func(**kwargs):
+        raise Forbidden("bot was blocked by the user")
+
+    async def scenario():
+        delivery = make_delivery(path)
+        await delivery.start()
+        delivery.register("bot3", send_func)
+        await delivery.send("bot3", 77, "рассылка", label="рассылка 77")
+        await wait_until(lambda: not delivery.unsent)
+        await delivery.stop()
+
+    with caplog.at_level(logging.ERROR):
+        asyncio.run(scenario())
+    assert "Не доставлено в 77 (рассылка 77): bot was blocked by the user" in caplog.text
+    assert journal(path) == []
+
+
+def test_send_rejects_kwargs_that_cannot_be_journaled(tmp_path):
+    delivery = make_delivery(tmp_path / "outbox.jsonl")
+    with pytest.raises(TypeError):
+        asyncio.run(delivery.send("bot1", 1, "текст", reply_markup=object()))
+    assert delivery.lanes == {}
@@ -0,0 +1,152 @@
+# -*- coding: utf-8 -*-
+# Приём апдейтов: порядок внутри чата, параллельность между чатами, отказ 503 при переполнении.
+import asyncio
+import json
+import logging
+
+import pytest
+from starlette.requests import Request
+
+import multi_app
+import shared.intake as intake_module
+from shared.intake import RecentUpdates, UpdateIntake, update_chat_key
+from shared.state import JsonStateStore
+
+
+def update(update_id: int, chat_id: int) -> dict:
+    return {"update_id": update_id, "message": {"message_id": update_id, "chat": {"id": chat_id}, "text": "ттн"}}
+
+
+async def drained(intake: UpdateIntake, timeout: float = 5.0):
+    await asyncio.wait_for(_wait_empty(intake), timeout)
+
+
+async def _wait_empty(intake: UpdateIntake):
+    while intake.pending:
+        await asyncio.sleep(0.01)
+
+
+def test_update_chat_key():
+    assert update_chat_key(update(1, -100)) == -100
+    assert update_chat_key({"update_id": 2, "callback_query": {"from": {"id": 7},
+                                                               "message": {"chat": {"id": -200}}}}) == -200
+    assert update_chat_key({"update_id": 3, "inline_query": {"from": {"id": 7}}}) == 7
+    assert update_chat_key({"update_id": 4, "my_chat_member": {"chat": {"id": -300}}}) == -300
+    assert update_chat_key({"update_id": 5}) == "update:5"
+
+
+def test_updates_of_one_chat_keep_order_while_chats_run_in_parallel():
+    processed = []
+
+    async def scenario():
+        chat_b_done = asyncio.Event()
+
+        async def process(data):
+            chat_id = data["message"]["chat"]["id"]
+            # Первый апдейт чата A ждёт, пока чат B обработается целиком
+            if data["update_id"] == 1:
+                await asyncio.wait_for(chat_b_done.wait(), 5)
+            processed.append((chat_id, data["update_id"]))
+            if data["update_id"] == 4:
+                chat_b_done.set()
+
+        intake = UpdateIntake("bot", process, workers=4)
+        intake.start()
+        for update_id, chat_id in [(1, 10), (2, 10), (3, 20), (5, 10), (4, 20)]:
+            assert intake.submit(update(update_id, chat_id))
+        await drained(intake)
+        await intake.stop()
+
+    asyncio.run(scenario())
+    assert processed == [(20, 3), (20, 4), (10, 1), (10, 2), (10, 5)]
+
+
+def test_failing_update_does_not_stop_the_chat(caplog):
+    processed = []
+
+    async def process(data):
+        if data["update_id"] == 2:
+            raise ValueError("сломанный апдейт")
+        processed.append(data["update_id"])
+
+    async def scenario():
+        intake = UpdateIntake("bot", process, workers=1)
+        intake.start()
+        for update_id in (1, 2, 3):
+            intake.submit(update(update_id, 10))
+        await drained(intake)
+        await intake.stop()
+        return intake
+
+    with caplog.at_level(logging.ERROR):
+        intake = asyncio.run(scenario())
+    assert processed == [1, 3]
+    assert intake.chats == {}
+    assert "Ошибка при обработке апдейта 2" in caplog.text
+
+
+def test_full_queue_rejects_until_drained():
+    processed = []
+
+    async def process(data):
+        processed.append(data["update_id"])
+
+    async def scenario():
+        intake = UpdateIntake("bot", process, max_pending=2, workers=2)
+        assert intake.submit(update(1, 10)) and intake.submit(update(2, 20))
+        assert not intake.submit(update(3, 30))
+        intake.start()
+        await drained(intake)
+        assert intake.submit(update(3, 30))
+        await drained(intake)
+        await intake.stop()
+
+    asyncio.run(scenario())
+    assert sorted(processed) == [1, 2, 3]
+
+
+def webhook_request(data: dict) -> Request:
+    body = json.dumps(data).encode()
+
+    async def receive():
+        return {"type": "http.request", "body": body, "more_body": False}
+
+    return Request({"type": "http", "method": "POST", "path": "/webhook/bot1", "headers": []}, receive)
+
+
+@pytest.fixture
+def webhook(tmp_path, monkeypatch):
+    """Очередь bot1 на одно место без воркеров и чистый список принятых update_id."""
+    monkeypatch.setattr(intake_module, "state", JsonStateStore(delay=0))
+    processed = []
+
+    async def process(data):
+        processed.append(data["update_id"])
+
+    intake = UpdateIntake("bot1", process, max_pending=1, workers=1)
+    recent = RecentUpdates(tmp_path / "recent_updates.json", save_delay=3600)
+    monkeypatch.setitem(multi_app.intakes, "bot1", intake)
+    monkeypatch.setattr(multi_app, "recent_updates", recent)
+    return intake, recent, processed
+
+
+def test_webhook_answers_503_when_queue_is_full(webhook):
+    intake, recent, processed = webhook
+
+    async def scenario():
+        assert await multi_app.webhook_router("bot1", webhook_request(update(1, 10))) == {"ok": True}
+        rejected = await multi_app.webhook_router("bot1", webhook_request(update(2, 10)))
+        assert rejected.status_code == 503
+        assert rejected.headers["Retry-After"] == "5"
+        # Отклонённый апдейт не считается принятым: повтор от Telegram пройдёт
+        assert not recent.is_duplicate("bot1", 2)
+
+        intake.start()
+        await drained(intake)
+        assert await multi_app.webhook_router("bot1", webhook_request(update(2, 10))) == {"ok": True}
+        await drained(intake)
+        await intake.stop()
+        recent.task.cancel()
+
+    asyncio.run(scenario())
+    assert processed == [1, 2]
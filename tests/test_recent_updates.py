@@ -0,0 +1,93 @@
+# -*- coding: utf-8 -*-
+# Повторная доставка апдейтов: update_id помнится по ботам, с ограничением и сроком, и после перезапуска.
+import asyncio
+import json
+import time
+
+import pytest
+from starlette.requests import Request
+
+import multi_app
+import shared.intake as intake_module
+from shared.intake import RecentUpdates, UpdateIntake
+from shared.state import JsonStateStore
+
+
+@pytest.fixture
+def recent_path(tmp_path, monkeypatch):
+    monkeypatch.setattr(intake_module, "state", JsonStateStore(delay=0))
+    return tmp_path / "recent_updates.json"
+
+
+def test_duplicates_are_per_bot_and_bounded(recent_path):
+    async def scenario():
+        recent = RecentUpdates(recent_path, max_per_bot=3, save_delay=3600)
+        for update_id in (1, 2, 3, 4):
+            recent.add("bot1", update_id)
+        recent.task.cancel()
+        return recent
+
+    recent = asyncio.run(scenario())
+    assert not recent.is_duplicate("bot1", 1)
+    assert all(recent.is_duplicate("bot1", update_id) for update_id in (2, 3, 4))
+    assert not recent.is_duplicate("bot2", 2)
+
+
+def test_expired_update_ids_are_forgotten(recent_path):
+    recent = RecentUpdates(recent_path, ttl=60)
+    recent.seen["bot1"] = {10: time.time() - 61, 11: time.time() - 30}
+    assert not recent.is_duplicate("bot1", 10)
+    assert recent.is_duplicate("bot1", 11)
+
+
+def test_seen_updates_survive_restart(recent_path, monkeypatch):
+    async def first_process():
+        recent = RecentUpdates(recent_path, ttl=60, save_delay=3600)
+        recent.add("bot1", 100)
+        recent.add("bot3", 7)
+        # Давний апдейт: при загрузке уже просрочен
+        recent.seen["bot1"][99] = time.time() - 120
+        recent.seen["bot1"].move_to_end(99, last=False)
+        recent.save()
+        await intake_module.state.flush()
+        recent.task.cancel()
+
+    asyncio.run(first_process())
+    monkeypatch.setattr(intake_module, "state", JsonStateStore(delay=0))
+    recent = RecentUpdates(recent_path, ttl=60)
+    recent.load()
+    assert recent.is_duplicate("bot1", 100) and recent.is_duplicate("bot3", 7)
+    assert list(recent.seen["bot1"]) == [100]
+
+
+def webhook_request(data: dict) -> Request:
+    body = json.dumps(data).encode()
+
+    async def receive():
+        return {"type": "http.request", "body": body, "more_body": False}
+
+    return Request({"type": "http", "method": "POST", "path": "/webhook/bot2", "headers": []}, receive)
+
+
+def test_webhook_drops_redelivered_update(recent_path, monkeypatch):
+    processed = []
+
+    async def process(data):
+        processed.append(data["update_id"])
+
+    async def scenario():
+        intake = UpdateIntake("bot2", process, workers=1)
+        recent = RecentUpdates(recent_path, save_delay=3600)
+        monkeypatch.setitem(multi_app.intakes, "bot2", intake)
+        monkeypatch.setattr(multi_app, "recent_updates", recent)
+        intake.start()
+        data = {"update_id": 555, "message": {"message_id": 1, "chat": {"id": -100}, "text": "20450123456789"}}
+        for _ in range(3):
+            assert await multi_app.webhook_router("bot2", webhook_request(data)) == {"ok": True}
+        while intake.pending:
+            await asyncio.sleep(0.01)
+        await intake.stop()
+        recent.task.cancel()
+
+    asyncio.run(scenario())
+    assert processed == [555]
@@ -0,0 +1,195 @@
+# -*- coding: utf-8 -*-
+# Слоты планировщика: пропуски (misfire), слияние (coalesce), повтор, состояние после перезапуска.
+import asyncio
+import time
+from datetime import datetime, timedelta
+
+import pytest
+
+import shared.scheduler as scheduler_module
+from shared.scheduler import Scheduler, cron, daily
+from shared.state import JsonStateStore
+
+
+def at(hour: int, minute: int = 0, day: int = 8) -> datetime:
+    return scheduler_module.KYIV_TZ.localize(datetime(2025, 8, day, hour, minute))
+
+
+@pytest.fixture
+def state_path(tmp_path, monkeypatch):
+    # Своё хранилище на тест: asyncio.Event общего экземпляра привязан к чужому event loop
+    monkeypatch.setattr(scheduler_module, "state", JsonStateStore(delay=0))
+    return tmp_path / "scheduler_state.json"
+
+
+def add_job(scheduler: Scheduler, times, results=(), **kwargs):
+    """Задача, которая запоминает запуски; results — что вернуть на 1-й, 2-й... запуск."""
+    runs = []
+
+    async def func():
+        runs.append(len(runs))
+        return results[len(runs) - 1] if len(runs) <= len(results) else None
+
+    kwargs.setdefault("jitter", 0)
+    job = scheduler.add_job("job", func, times, **kwargs)
+    return job, runs
+
+
+async def check(scheduler: Scheduler, job, now: datetime) -> float:
+    """Одна проверка планировщика; запущенная задача дожидается завершения."""
+    wait = scheduler._check(job, now)
+    if job.task is not None:
+        await job.task
+    return wait
+
+
+def history(job) -> list[tuple[str, str]]:
+    return [(datetime.fromisoformat(h["slot"]).strftime("%H:%M"), h["result"]) for h in job.history]
+
+
+def test_due_slot_runs_once(state_path):
+    async def scenario():
+        scheduler = Scheduler(state_path)
+        job, runs = add_job(scheduler, cron([9, 10]))
+        await check(scheduler, job, at(10, 5))
+        wait = await check(scheduler, job, at(10, 6))
+        return job, runs, wait
+
+    job, runs, wait = asyncio.run(scenario())
+    assert runs == [0]
+    assert history(job) == [("10:00", "ok")]
+    assert job.last_slot == at(10)
+    # Следующий слот — завтра в 09:00
+    assert wait == (at(9, day=9) - at(10, 6)).total_seconds()
+
+
+def test_first_start_ignores_slots_older_than_grace(state_path):
+    async def scenario():
+        scheduler = Scheduler(state_path)
+        job, runs = add_job(scheduler, cron([9, 10]), grace=600)
+        await check(scheduler, job, at(10, 30))
+        return job, runs
+
+    job, runs = asyncio.run(scenario())
+    assert runs == []
+    assert list(job.history) == []
+
+
+def test_late_slots_misfire_and_fresh_ones_coalesce(state_path):
+    async def scenario():
+        scheduler = Scheduler(state_path)
+        job, runs = add_job(scheduler, cron([8, 9, 10, 11]), grace=2 * 3600)
+        job.last_slot = at(7)
+        await check(scheduler, job, at(11, 30))
+        return job, runs
+
+    job, runs = asyncio.run(scenario())
+    assert runs == [0]
+    assert history(job) == [("08:00", "misfire"), ("09:00", "misfire"), ("10:00", "coalesced"), ("11:00", "ok")]
+    assert job.last_slot == at(11)
+
+
+def test_without_coalesce_fresh_slots_run_in_order(state_path):
+    async def scenario():
+        scheduler = Scheduler(state_path)
+        job, runs = add_job(scheduler, cron([8, 9, 10, 11]), grace=2 * 3600, coalesce=False)
+        job.last_slot = at(7)
+        await check(scheduler, job, at(11, 30))
+        await check(scheduler, job, at(11, 30))
+        await check(scheduler, job, at(11, 30))
+        return job, runs
+
+    job, runs = asyncio.run(scenario())
+    assert runs == [0, 1]
+    assert history(job) == [("08:00", "misfire"), ("09:00", "misfire"), ("10:00", "ok"), ("11:00", "ok")]
+
+
+def test_false_result_returns_slot_for_retry(state_path):
+    async def scenario():
+        scheduler = Scheduler(state_path)
+        job, runs = add_job(scheduler, cron([10]), results=(False, None), retry=60)
+        job.last_slot = at(9, 30)
+        await check(scheduler, job, at(10, 1))
+        assert job.last_slot == at(9, 30)
+        assert job.retry_at > time.time()
+
+        # До retry_at слот не перезапускается
+        wait = await check(scheduler, job, at(10, 1))
+        assert runs == [0] and 0 < wait <= 60
+
+        job.retry_at = 0
+        await check(scheduler, job, at(10, 2))
+        return job, runs
+
+    job, runs = asyncio.run(scenario())
+    assert runs == [0, 1]
+    assert history(job) == [("10:00", "retry"), ("10:00", "ok")]
+    assert job.last_slot == at(10)
+
+
+def test_state_survives_restart(state_path, monkeypatch):
+    async def first_process():
+        scheduler = Scheduler(state_path)
+        job, runs = add_job(scheduler, cron([10]))
+        await check(scheduler, job, at(10, 1))
+        await scheduler_module.state.flush()
+        return runs
+
+    async def second_process():
+        scheduler = Scheduler(state_path)
+        job, runs = add_job(scheduler, cron([10]))
+        await check(scheduler, job, at(10, 3))
+        return job, runs
+
+    assert asyncio.run(first_process()) == [0]
+    assert state_path.exists()
+
+    # Новый процесс: состояние читается только с диска
+    monkeypatch.setattr(scheduler_module, "state", JsonStateStore(delay=0))
+    job, runs = asyncio.run(second_process())
+    assert runs == []
+    assert job.last_slot == at(10)
+    assert history(job) == [("10:00", "ok")]
+
+
+def test_changed_schedule_does_not_catch_up_passed_slots(state_path):
+    report_time = ["09:00"]
+
+    async def scenario():
+        scheduler = Scheduler(state_path)
+        job, runs = add_job(scheduler, daily(lambda: report_time[0]))
+        await check(scheduler, job, at(9, 1))
+        report_time[0] = "10:00"
+        wait = await check(scheduler, job, at(10, 5))
+        return job, runs, wait
+
+    job, runs, wait = asyncio.run(scenario())
+    assert runs == [0]
+    assert job.spec == ["10:00"]
+    assert job.last_slot == at(10, 5)
+    assert wait == timedelta(hours=23, minutes=55).total_seconds()
+
+
+def test_prefetch_starts_once_within_lead(state_path):
+    prefetched = []
+
+    async def prefetch():
+        prefetched.append(True)
+
+    async def scenario():
+        scheduler = Scheduler(state_path)
+        job, runs = add_job(scheduler, cron([10]), prefetch=prefetch, lead=180)
+        # До окна предзагрузки спим до его начала
+        wait = await check(scheduler, job, at(9, 50))
+        assert wait == 420 and job.prefetch_task is None
+
+        await check(scheduler, job, at(9, 58))
+        await job.prefetch_task
+        await check(scheduler, job, at(9, 59))
+        assert job.prefetch_task is None
+        return job, runs
+
+    job, runs = asyncio.run(scenario())
+    assert prefetched == [True]
+    assert runs == []
+    assert history(job) == [("10:00", "prefetch ok")]
@@ -0,0 +1,46 @@
+# -*- coding: utf-8 -*-
+# Рабочие сессии: граница паузы и склейка сессий из разных окон.
+import random
+
+import pandas as pd
+
+from shared.sessions import union_sessions, work_sessions
+
+
+def test_work_sessions_split_on_gap_longer_than_limit():
+    keys = pd.Series(["АБ", "АБ", "АБ", "АБ", "ВГ", "АБ"])
+    times = pd.Series([0, 3600, 7201, 7300, 100, 50])
+    sessions = work_sessions(keys, times, 3600)
+
+    assert sessions[["key", "start", "end", "calls"]].values.tolist() == [
+        # Пауза ровно в gap — та же сессия, на секунду больше — новая
+        ["АБ", 0, 3600, 3],
+        ["АБ", 7201, 7300, 2],
+        ["ВГ", 100, 100, 1],
+    ]
+
+
+def test_work_sessions_accept_datetimes():
+    times = pd.to_datetime(pd.Series(["2025-08-08 09:00", "2025-08-08 09:50", "2025-08-08 11:30"]))
+    sessions = work_sessions(pd.Series(["АБ"] * 3), times, pd.Timedelta(minutes=80))
+    assert sessions["calls"].tolist() == [2, 1]
+    assert sessions["end"].iloc[0] == pd.Timestamp("2025-08-08 09:50")
+
+
+def test_union_of_window_sessions_equals_sessions_of_all_calls():
+    rng = random.Random(8)
+    gap = 3600
+    for _ in range(20):
+        times = sorted(rng.randint(0, 12 * 3600) for _ in range(rng.randint(1, 40)))
+        expected = work_sessions(pd.Series(["АБ"] * len(times)), pd.Series(times), gap)
+
+        # Сессии считаются по каждому получасовому окну отдельно, затем склеиваются
+        windows = {}
+        for t in times:
+            windows.setdefault(t // 1800, []).append(t)
+        parts = []
+        for window in windows.values():
+            part = work_sessions(pd.Series(["АБ"] * len(window)), pd.Series(window), gap)
+            parts += part[["start", "end"]].values.tolist()
+
+        assert union_sessions(parts, gap) == expected[["start", "end"]].values.tolist()
@@ -0,0 +1,78 @@
+# -*- coding: utf-8 -*-
+# Хранилище JSON-состояния: память вместо диска при чтении, слияние записей, атомарная замена файла.
+import asyncio
+import json
+
+from shared.state import JsonStateStore
+
+
+def counting_store(delay: float = 0.05) -> tuple[JsonStateStore, list]:
+    """Хранилище, которое запоминает каждую запись файла."""
+    store = JsonStateStore(delay=delay)
+    writes = []
+
+    def write(path, text):
+        writes.append(json.loads(text))
+        JsonStateStore._write(path, text)
+
+    store._write = write
+    return store, writes
+
+
+def test_saves_in_a_row_become_one_write(tmp_path):
+    path = tmp_path / "settings.json"
+    store, writes = counting_store()
+
+    async def scenario():
+        for norm in range(5):
+            store.save(path, {"norm": norm})
+            # Чтение сразу видит новое значение, не дожидаясь диска
+            assert store.load(path) == {"norm": norm}
+        await store.flush()
+
+    asyncio.run(scenario())
+    assert writes == [{"norm": 4}]
+    assert json.loads(path.read_text(encoding="utf-8")) == {"norm": 4}
+    assert [p.name for p in tmp_path.iterdir()] == ["settings.json"]
+
+
+def test_load_reads_disk_once_and_returns_copies(tmp_path):
+    path = tmp_path / "users.json"
+    path.write_text('{"users": [1]}', encoding="utf-8")
+    store = JsonStateStore()
+
+    data = store.load(path)
+    data["users"].append(2)
+    path.write_text('{"users": [3]}', encoding="utf-8")
+
+    assert store.load(path) == {"users": [1]}
+    assert store.load(tmp_path / "missing.json", {}) == {}
+
+
+def test_save_outside_event_loop_writes_immediately(tmp_path):
+    path = tmp_path / "nested" / "channels.json"
+    store = JsonStateStore()
+    store.save(path, {"emp": -100})
+    assert json.loads(path.read_text(encoding="utf-8")) == {"emp": -100}
+    assert store.pending == {}
+
+
+def test_reload_keeps_unsaved_changes(tmp_path):
+    path = tmp_path / "norms.json"
+    path.write_text('{"norm": 1}', encoding="utf-8")
+    store, writes = counting_store(delay=60)
+
+    async def scenario():
+        store.load(path)
+        # Ручная правка файла подхватывается
+        path.write_text('{"norm": 2}', encoding="utf-8")
+        assert store.reload(path, {}) == {"norm": 2}
+        # Пока своя правка не записана, файл не перечитывается
+        store.save(path, {"norm": 3})
+        path.write_text('{"norm": 4}', encoding="utf-8")
+        assert store.reload(path, {}) == {"norm": 3}
+        await store.flush()
+
+    asyncio.run(scenario())
+    assert writes == [{"norm": 3}]
+    assert store.reload(path, {}) == {"norm": 3}
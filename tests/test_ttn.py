@@ -0,0 +1,86 @@
+# -*- coding: utf-8 -*-
+# ТТН в bot2: регулярка, дедупликация по чату и перевод старых партиций на колонку ttn.
+import csv
+from datetime import date
+
+import pytest
+
+import bot2.flashcall_app20 as bot2
+
+
+@pytest.mark.parametrize("text, expected", [
+    ("ТТН 20450123456789", ["20450123456789"]),
+    ("ттн:59001234567890, дубль 59001234567890 і 1234567890123", ["59001234567890", "1234567890123"]),
+    ("12 цифр 412345678901, 14 цифр 61234567890123", ["412345678901", "61234567890123"]),
+    # Первая цифра не 1/2/4/5/6, слишком коротко или длинно, часть телефона
+    ("30450123456789 20450123456 204501234567890 +380671234567", []),
+    ("", []),
+    (None, []),
+])
+def test_extract_ttns(text, expected):
+    assert bot2.extract_ttns(text) == expected
+
+
+def test_take_new_ttns_dedups_per_chat_within_window():
+    seen = {}
+    assert bot2.take_new_ttns(seen, 1, "2025-08-01", ["20450123456789", "20450123456789"]) == ["20450123456789"]
+    # Пересланное сообщение в том же чате — не новое, в другом чате — новое
+    assert bot2.take_new_ttns(seen, 1, "2025-08-20", ["20450123456789"]) == []
+    assert bot2.take_new_ttns(seen, 2, "2025-08-20", ["20450123456789"]) == ["20450123456789"]
+    # Последний день окна TTN_DEDUP_DAYS и первый день после него
+    assert bot2.take_new_ttns(seen, 1, "2025-08-31", ["20450123456789"]) == []
+    assert bot2.take_new_ttns(seen, 1, "2025-09-01", ["20450123456789"]) == ["20450123456789"]
+    assert seen[(1, "20450123456789")] == "2025-09-01"
+
+
+def write_partition(path, fields, rows):
+    with open(path, "w", encoding="utf-8", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=fields)
+        writer.writeheader()
+        writer.writerows(rows)
+
+
+def read_partition(path) -> list[dict]:
+    with open(path, encoding="utf-8", newline="") as f:
+        return list(csv.DictReader(f))
+
+
+def test_migrate_ttn_column_splits_rows_and_dedups(tmp_path, monkeypatch):
+    monkeypatch.setattr(bot2, "DATA_DIR", tmp_path)
+    old_fields = ["timestamp", "chat_id", "user_id", "message"]
+    write_partition(tmp_path / "2025-08-01.csv", old_fields, [
+        {"timestamp": "2025-08-01 10:00:00", "chat_id": "-100", "user_id": "7",
+         "message": "20450123456789 59001234567890"},
+        {"timestamp": "2025-08-01 10:05:00", "chat_id": "-100", "user_id": "8", "message": "без ТТН"},
+        {"timestamp": "2025-08-01 10:06:00", "chat_id": "не число", "user_id": "8", "message": "20450123456789"},
+    ])
+    write_partition(tmp_path / "2025-08-02.csv", old_fields, [
+        {"timestamp": "2025-08-02 09:00:00", "chat_id": "-100", "user_id": "7",
+         "message": "переслано 20450123456789 і нова 61234567890123"},
+        {"timestamp": "2025-08-02 09:30:00", "chat_id": "-200", "user_id": "9", "message": "20450123456789"},
+    ])
+
+    bot2.migrate_ttn_column()
+
+    first = read_partition(tmp_path / "2025-08-01.csv")
+    assert [(r["chat_id"], r["user_id"], r["ttn"]) for r in first] == [
+        ("-100", "7", "20450123456789"),
+        ("-100", "7", "59001234567890"),
+        ("-100", "8", ""),
+        # Битая строка остаётся в логе, но без ТТН
+        ("не число", "8", ""),
+    ]
+    second = read_partition(tmp_path / "2025-08-02.csv")
+    assert [(r["chat_id"], r["ttn"]) for r in second] == [("-100", "61234567890123"), ("-200", "20450123456789")]
+
+    # Повторный запуск — файлы уже в новом формате и не меняются
+    bot2.migrate_ttn_column()
+    assert read_partition(tmp_path / "2025-08-02.csv") == second
+
+    seen = bot2.build_ttn_seen(date(2025, 8, 1), date(2025, 8, 2))
+    assert seen == {
+        (-100, "20450123456789"): "2025-08-01",
+        (-100, "59001234567890"): "2025-08-01",
+        (-100, "61234567890123"): "2025-08-02",
+        (-200, "20450123456789"): "2025-08-02",
+    }